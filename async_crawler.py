@@ -0,0 +1,386 @@
+"""crawls many shopify stores concurrently using asyncio and aiohttp.
+
+through the Async_Crawl_Engine class it will crawl a list of stores
+concurrently, bounded by a global concurrency limit and a per-host limit,
+and feed every fetched page of products into the existing
+extract_page and Write_to_DB pipeline.
+
+within a store, up to `per_host_limit` pages are fetched ahead and
+processed in order until a page with fewer products than the page size
+is found, the fetches past it are cancelled and their errors ignored.
+every page is written together with its store's checkpoint, and with
+`resume` the stores already done are skipped and the others continue
+after their last stored page. with a `content_hash_index` the unchanged
+products are dropped before the extraction. with a streaming
+`req_handler` the pages are parsed and extracted in a worker thread
+while they are downloaded, unless `extract_workers` is set, then their
+bodies are read whole and extracted by the processes. the extraction
+runs in a worker thread, or in a pool of `extract_workers` processes,
+and the database writes run in worker threads, one page at a time per
+connection of the `write_to_db` (several with a
+save_to_sql_db.Pooled_Writer), so the event loop keeps fetching while
+postgres is busy. once `stop` is set no other page is written, and the
+stores being crawled are left in progress.
+
+Typical usage example:
+
+    engine = Async_Crawl_Engine(write_to_db, max_concurrency=50, per_host_limit=2, req_handler=req_handler, extract_workers=4)
+    all_stores_scraping_summary = engine.run(stores_list)
+"""
+
+import asyncio
+import aiohttp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from crawler import Requests_Handler
+from rate_limiting import (
+    Fetch_Error, Circuit_Open_Error, THROTTLE_STATUSES, SERVER_ERROR_STATUSES, retry_after_seconds, backoff_delay
+)
+from scraper import extract_page
+from save_to_sql_db import Write_to_DB
+from incremental_filter import Incremental_Filter
+from pagination import Page_Number_Pagination
+from http_cache import ACCEPT_ENCODING
+from dedup import Content_Hash_Index
+from json_backend import loads
+from streaming import Streamed_Page, stream_page_async, STREAM_CHUNK_SIZE
+from metrics import registry, record_extraction
+from threading import Event
+from time import perf_counter
+from typing import Optional
+
+
+class Async_Crawl_Engine:
+    """
+    Crawls shopify stores concurrently and stores their products.
+
+    Attributes:
+        write_to_db (Write_to_DB): Writes the extracted data to the database.
+        max_concurrency (int): Maximum number of requests in flight across all stores.
+        per_host_limit (int): Maximum number of requests in flight to one host.
+        req_handler (Requests_Handler): Builds the URLs and holds the rate limiting, retry, and circuit breaker policy.
+        extract_workers (int): Number of processes extracting the pages, 0 extracts them in a thread.
+        resume (bool): Whether the stores continue from their checkpoints instead of starting over.
+        content_hash_index (Content_Hash_Index): Skips the products unchanged since they were written, None keeps them all.
+        stop (Optional[Event]): Stops the crawl once set, e.g. when the lease of a distributed worker is lost.
+    """
+
+    def __init__(
+        self,
+        write_to_db: Write_to_DB,
+        max_concurrency: int = 20,
+        per_host_limit: int = 2,
+        req_handler: Requests_Handler = None,
+        extract_workers: int = 0,
+        resume: bool = False,
+        content_hash_index: Content_Hash_Index = None,
+        stop: Optional[Event] = None,
+    ) -> None:
+        """
+        Initializes the Async_Crawl_Engine class.
+
+        Args:
+            write_to_db (Write_to_DB): Writes the extracted data to the database.
+            max_concurrency (int): Maximum number of requests in flight across all stores.
+            per_host_limit (int): Maximum number of requests in flight to one host.
+            req_handler (Requests_Handler): Holds the rate limiting, retry, and circuit breaker policy, a default one if None.
+            extract_workers (int): Number of processes extracting the pages, 0 extracts them in a thread.
+            resume (bool): Continue from the stores checkpoints instead of starting over.
+            content_hash_index (Content_Hash_Index): Skips the products unchanged since they were written, None keeps them all.
+            stop (Optional[Event]): Stops the crawl once set.
+        """
+        self.write_to_db = write_to_db
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.req_handler = req_handler or Requests_Handler()
+        self.extract_workers = extract_workers
+        self.resume = resume
+        self.content_hash_index = content_hash_index
+        self.stop = stop
+        self.__summaries = {}
+        self.__checkpoints = {}
+        self.__write_lock = None
+        self.__extract_executor = None
+
+    def run(self, stores_list: list) -> str:
+        """
+        Crawls all the stores and returns the scraping summary.
+
+        Args:
+            stores_list (list): List of store URLs.
+
+        Returns:
+            str: The scraping summary of all the stores, in the order of `stores_list`.
+        """
+        self.__summaries = {}
+        self.__checkpoints = self.write_to_db.get_checkpoints() if self.resume else {}
+        if self.extract_workers:
+            self.__extract_executor = ProcessPoolExecutor(self.extract_workers)
+        try:
+            asyncio.run(self.crawl_stores(stores_list))
+        finally:
+            if self.__extract_executor is not None:
+                self.__extract_executor.shutdown()
+                self.__extract_executor = None
+        self.req_handler.end_session()
+        return "".join(self.__summaries[store] for store in stores_list if store in self.__summaries)
+
+    async def crawl_stores(self, stores_list: list) -> None:
+        """
+        Crawls all the stores with at most `max_concurrency` stores at a time.
+
+        Args:
+            stores_list (list): List of store URLs.
+        """
+        # a Write_to_DB writes one page at a time, a Pooled_Writer one per connection
+        self.__write_lock = asyncio.Semaphore(self.write_to_db.pool_size)
+        stores_queue = asyncio.Queue()
+        for store in stores_list:
+            stores_queue.put_nowait(store)
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.req_handler.timeout)
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            workers = [
+                asyncio.create_task(self.__store_worker(session, stores_queue, len(stores_list)))
+                for _ in range(min(self.max_concurrency, len(stores_list)))
+            ]
+            await asyncio.gather(*workers)
+
+    async def __store_worker(self, session: aiohttp.ClientSession, stores_queue: asyncio.Queue, stores_count: int) -> None:
+        """
+        Takes stores off the queue and crawls them until the queue is empty.
+
+        Args:
+            session (aiohttp.ClientSession): The shared HTTP session.
+            stores_queue (asyncio.Queue): Queue of the stores left to crawl.
+            stores_count (int): Total number of stores, used for progress output.
+        """
+        while not stores_queue.empty() and not self.__stopped():
+            store = stores_queue.get_nowait()
+            try:
+                self.__summaries[store] = await self.crawl_store(session, store)
+            except Exception as e:
+                print(e)
+                self.__summaries[store] = f"{'-'*50}\n{store}\nfailed: {e}\n{'-'*50}\n"
+            print(f"stores done: <<{len(self.__summaries)}: {stores_count}>>")
+
+    async def crawl_store(self, session: aiohttp.ClientSession, store: str) -> str:
+        """
+        Crawls every page of a store and stores its products.
+
+        Args:
+            session (aiohttp.ClientSession): The shared HTTP session.
+            store (str): The store URL.
+
+        Returns:
+            str: The scraping summary of the store.
+        """
+        store_products_API, store_name = self.req_handler.config_store_url_and_name(store)
+        print(f"store: {store_name}\nurl: {store_products_API}")
+
+        checkpoint = self.__checkpoints.get(store_products_API, {"last_page": 0, "last_product_id": None, "status": "in_progress"})
+        if checkpoint["status"] == "done":
+            return f"{'-'*50}\n{store_products_API}\nalready crawled: {checkpoint['last_page']} pages\n{'-'*50}\n"
+        await self.__run_locked(self.write_to_db.start_checkpoint, store_products_API, checkpoint["last_page"], checkpoint["last_product_id"])
+
+        pagination = Page_Number_Pagination(self.req_handler, store_products_API)
+        page_number = checkpoint["last_page"] + 1
+        total_products = 0
+        incremental_filter = None
+        if self.write_to_db.incremental:
+            incremental_filter = Incremental_Filter(await self.__run_locked(self.write_to_db.get_watermark, store_products_API))
+        # up to per_host_limit pages are fetched ahead and processed in order, the fetches past the last page are cancelled
+        fetches = deque()
+        try:
+            while True:
+                while len(fetches) < self.per_host_limit:
+                    url = self.req_handler.config_store_products_url(store_products_API, page_number + len(fetches), pagination.limit)
+                    fetches.append(asyncio.create_task(self.fetch_products_list(session, url)))
+                json_response = await fetches.popleft()
+                if self.__stopped():
+                    # the store is resumed from its checkpoint by whoever crawls it next
+                    print(f"{store_name} crawl stopped before page {page_number}.")
+                    return f"{'-'*50}\n{store_products_API}\nstopped before page {page_number}\n{'-'*50}\n"
+                row_products_list = json_response["products"]
+                # a page not modified since it was written is neither parsed nor written again
+                products_count = json_response["products_count"] if json_response.get("not_modified") else len(row_products_list)
+                if len(row_products_list) > 0:
+                    total_products += len(row_products_list)
+                    last_product_id = row_products_list[-1]["id"]
+                    if isinstance(row_products_list, Streamed_Page):
+                        # a streamed page was extracted while it was downloaded
+                        extracted_lists, content_hashes = await asyncio.to_thread(row_products_list.extracted_lists, self.content_hash_index)
+                    else:
+                        changed_products, content_hashes = row_products_list, None
+                        if self.content_hash_index is not None:
+                            # the stored hashes are read on their own pooled connection, outside the write lock
+                            changed_products, content_hashes = await asyncio.to_thread(self.content_hash_index.filter_page, row_products_list)
+                        start = perf_counter()
+                        extracted_lists = await asyncio.get_running_loop().run_in_executor(self.__extract_executor, extract_page, changed_products)
+                        if self.__extract_executor is not None:
+                            # the worker counted the page in its own process
+                            record_extraction(extracted_lists, perf_counter() - start)
+                    await self.__run_locked(
+                        self.__write_page, store_products_API, page_number, last_product_id, extracted_lists, incremental_filter, content_hashes
+                    )
+                    print(f"{store_name} current page: {page_number}")
+                if products_count < pagination.limit:
+                    pages_scraped = page_number if products_count > 0 else page_number - 1
+                    await self.__run_locked(self.write_to_db.finish_checkpoint, store_products_API, "done")
+                    if self.req_handler.http_cache is not None:
+                        self.req_handler.http_cache.flush(store_products_API)
+                    summary = f"{'-'*50}\n{store_products_API}\n"
+                    if checkpoint["last_page"]:
+                        summary += f"resumed after page: {checkpoint['last_page']}\n"
+                    summary += f"pages scraped: {pages_scraped}\nproducts scraped: {total_products}\n"
+                    if incremental_filter is not None:
+                        summary += f"products unchanged: {incremental_filter.unchanged_products}\n"
+                        if incremental_filter.new_high_water_mark is not None:
+                            await self.__run_locked(self.write_to_db.set_watermark, store_products_API, incremental_filter.new_high_water_mark)
+                    return summary + f"{'-'*50}\n"
+                page_number += 1
+        except Fetch_Error:
+            await self.__run_locked(self.write_to_db.finish_checkpoint, store_products_API, "failed")
+            if self.req_handler.http_cache is not None:
+                self.req_handler.http_cache.discard(store_products_API)
+            raise
+        finally:
+            for fetch in fetches:
+                fetch.cancel()
+            # a page past the last one may have failed, its error is dropped
+            await asyncio.gather(*fetches, return_exceptions=True)
+
+    async def fetch_products_list(self, session: aiohttp.ClientSession, url: str) -> dict:
+        """
+        Fetches the list of products from the given URL.
+
+        the requests follow the same rate limiting, backoff, and circuit
+        breaker policy as `Requests_Handler.fetch_products_list`.
+
+        Args:
+            session (aiohttp.ClientSession): The shared HTTP session.
+            url (str): The products URL.
+
+        Returns:
+            dict: The json response, or the `Http_Cache.not_modified_page` of a page answered with a 304.
+
+        Raises:
+            Circuit_Open_Error: If the store's circuit breaker is open.
+            Fetch_Error: If the page could not be fetched after `max_retries` attempts,
+                or the store answered with a client error other than 429.
+        """
+        req_handler = self.req_handler
+        host = urlsplit(url).netloc
+        circuit_breaker = req_handler.circuit_breaker(url)
+        for attempt in range(req_handler.max_retries):
+            if not circuit_breaker.allow():
+                raise Circuit_Open_Error(f"circuit open for {url}")
+            await req_handler.rate_limiter.acquire_async(host)
+            retry_after = None
+            start = perf_counter()
+            try:
+                headers = req_handler.http_cache.conditional_headers(url) if req_handler.http_cache is not None else None
+                response = await session.get(url, headers=headers)
+                try:
+                    registry.increment("shopify_fetch_responses_total", status=response.status)
+                    if response.status == 304 and req_handler.http_cache is not None:
+                        not_modified_page = req_handler.http_cache.not_modified_page(url)
+                        if not_modified_page is not None:
+                            req_handler.rate_limiter.on_success(host)
+                            circuit_breaker.record_success()
+                            return not_modified_page
+                        # a 304 without a cached page is a miss, the page is requested again without validators
+                        response.release()
+                        await req_handler.rate_limiter.acquire_async(host)
+                        response = await session.get(url)
+                        registry.increment("shopify_fetch_responses_total", status=response.status)
+                    if response.status in THROTTLE_STATUSES:
+                        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                        req_handler.rate_limiter.on_throttle(host, retry_after)
+                        print(f"throttled ({response.status}) {url}, rate now {req_handler.rate_limiter.rate(host):.2f}/s")
+                    elif response.status in SERVER_ERROR_STATUSES:
+                        circuit_breaker.record_failure()
+                        print(f"server error ({response.status}) {url}")
+                    elif response.status >= 400:
+                        circuit_breaker.record_failure()
+                        raise Fetch_Error(f"{response.status} error for {url}")
+                    else:
+                        if req_handler.stream and self.__extract_executor is None:
+                            json_response = {"products": await stream_page_async(
+                                response.content.iter_chunked(STREAM_CHUNK_SIZE), req_handler.stream_content_hashes
+                            )}
+                        else:
+                            body = await response.read()
+                            registry.increment("shopify_fetch_decoded_bytes_total", len(body))
+                            json_response = loads(body)
+                        registry.observe("shopify_fetch_seconds", perf_counter() - start)
+                        if req_handler.http_cache is not None:
+                            # a chunked response has no Content-Length, its decoded bytes read are counted instead
+                            body_size = response.content_length if response.content_length is not None else response.content.total_bytes
+                            req_handler.http_cache.record(url, response.headers, json_response["products"], body_size)
+                        req_handler.rate_limiter.on_success(host)
+                        circuit_breaker.record_success()
+                        return json_response
+                finally:
+                    response.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                circuit_breaker.record_failure()
+                registry.increment("shopify_fetch_errors_total")
+                print(f"Connection error!! {url}: {e!r}")
+            if attempt + 1 < req_handler.max_retries:
+                await asyncio.sleep(backoff_delay(attempt, req_handler.backoff_base, req_handler.backoff_cap, retry_after))
+        raise Fetch_Error(f"failed to fetch {url} after {req_handler.max_retries} attempts")
+
+    def __stopped(self) -> bool:
+        """
+        Checks whether the crawl was asked to stop.
+
+        Returns:
+            bool: True once `stop` is set.
+        """
+        return self.stop is not None and self.stop.is_set()
+
+    async def __run_locked(self, function, *args):
+        """
+        Runs a call that touches the database in a worker thread, one call at a time per connection.
+
+        Args:
+            function: The function to call.
+            *args: The arguments of the call.
+
+        Returns:
+            The return value of the call.
+        """
+        async with self.__write_lock:
+            return await asyncio.to_thread(function, *args)
+
+    def __write_page(
+        self,
+        store_products_API: str,
+        page_number: int,
+        last_product_id: int,
+        extracted_lists: tuple,
+        incremental_filter: Incremental_Filter = None,
+        content_hashes: dict = None,
+    ) -> None:
+        """
+        Inserts an extracted page into the database together with its store's checkpoint.
+
+        Args:
+            store_products_API (str): The store URL.
+            page_number (int): The number of the page.
+            last_product_id (int): The id of the last product of the fetched page.
+            extracted_lists (tuple): The products, variants, and images lists of the page.
+            incremental_filter (Incremental_Filter): Drops the unchanged products in incremental mode.
+            content_hashes (dict): The content hashes of the page's products by product id.
+        """
+        products_list, variants_list, images_list = extracted_lists
+        if incremental_filter is not None:
+            products_list, variants_list, images_list = incremental_filter.filter_page(products_list, variants_list, images_list)
+        stored_hashes = self.write_to_db.write_page(products_list, variants_list, images_list, store_products_API, page_number,
+                                                    last_product_id, content_hashes)
+        if self.content_hash_index is not None:
+            self.content_hash_index.remember(stored_hashes)
@@ -0,0 +1,869 @@
+"""benchmarks the stages of the scraper and prints the results as json.
+
+every benchmark returns a list of result dicts, one per compared mode,
+which are printed as a json array so the numbers can be tracked across
+changes, and `--output` also appends them, with the time and the git
+commit, as one JSON line to a results file. the data is built with the
+synthetic products of local_store_server, the database benchmarks read
+their credentials from the .env file and only touch the rows they
+create.
+
+the fetch, extract, and end-to-end benchmarks replay a fixture archive
+of `python replay.py record` through a Replay_Server, with the latency
+and errors asked for, or record the synthetic stores of a
+Local_Store_Server into one when no archive is given.
+
+Typical usage example:
+
+    python benchmark.py insert --pages 8
+    python benchmark.py records --fixture products.json
+    python benchmark.py pagination --products 1100 --latency 0.05
+    python benchmark.py json --fixture products.json
+    python benchmark.py descriptions --fixture products.json
+    python benchmark.py streaming --products 250 --variants 30
+    python benchmark.py sinks --pages 20
+    python benchmark.py fetch --archive fixtures.zip --latency 0.02 --error-rate 0.05
+    python benchmark.py extract --archive fixtures.zip
+    python benchmark.py --output results.jsonl e2e --archive fixtures.zip --engines serial,async,pipeline --main-args "--bulk"
+"""
+
+from local_store_server import Local_Store_Server, make_product
+from crawler import Requests_Handler
+from rate_limiting import Host_Rate_Limiter
+from pagination import paginate
+from scraper import Products_Data_Extractors, extract_page
+from save_to_sql_db import Write_to_DB
+from validation_and_cleansing import Products, Variants, Images
+from json_backend import available_backends, get_backend, loads
+from streaming import stream_page, STREAM_CHUNK_SIZE
+from description_cleaning import clean_description
+from sinks import available_sinks, get_sink
+from replay import Fixture_Archive, Replay_Server, record_stores
+from rate_limiting import Fetch_Error
+from dataclasses import asdict
+from sqlalchemy import text
+from dotenv import dotenv_values
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+import argparse
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+# ids of the benchmark products start here so they never collide with scraped ones
+BENCHMARK_BASE_ID = 9_000_000_000
+
+
+def synthetic_pages(pages: int, page_size: int = 250, base_id: int = BENCHMARK_BASE_ID, variants_count: int = 8, images_count: int = 6) -> list:
+    """
+    Builds pages of synthetic raw products.
+
+    Args:
+        pages (int): The number of pages.
+        page_size (int): The number of products per page.
+        base_id (int): The id of the first product.
+        variants_count (int): The number of variants per product.
+        images_count (int): The number of images per product.
+
+    Returns:
+        list: List of pages, each a list of raw product dictionaries.
+    """
+    return [
+        [make_product(base_id + page * page_size + i, "benchmark", variants_count, images_count) for i in range(page_size)]
+        for page in range(pages)
+    ]
+
+
+def delete_benchmark_rows(write_to_db: Write_to_DB, first_id: int, last_id: int) -> None:
+    """
+    Deletes the rows written by a benchmark.
+
+    Args:
+        write_to_db (Write_to_DB): The writer whose connection is used.
+        first_id (int): The id of the first benchmark product.
+        last_id (int): The id of the last benchmark product.
+    """
+    with write_to_db.connection.begin():
+        write_to_db.connection.execute(text("DELETE FROM images WHERE id BETWEEN :a AND :b"), {"a": first_id * 100, "b": last_id * 100 + 99})
+        write_to_db.connection.execute(text("DELETE FROM variants WHERE product_id BETWEEN :a AND :b"), {"a": first_id, "b": last_id})
+        write_to_db.connection.execute(text("DELETE FROM products WHERE id BETWEEN :a AND :b"), {"a": first_id, "b": last_id})
+
+
+def bench_insert_into_table(db_info: dict, pages: int) -> list:
+    """
+    Compares the rows/sec of the per-row INSERT path and the bulk COPY path of `Write_to_DB.insert_into_table`.
+
+    Args:
+        db_info (dict): The database credentials.
+        pages (int): The number of 250 products pages written by each mode.
+
+    Returns:
+        list: One result dict per mode.
+    """
+    p_d_extractors = Products_Data_Extractors()
+    results = []
+    for bulk in (False, True):
+        raw_pages = synthetic_pages(pages)
+        extracted_pages = []
+        for row_products_list in raw_pages:
+            extracted_pages.append(tuple(list(l) for l in p_d_extractors.get_products_data_sql(row_products_list)))
+            p_d_extractors.empty_all_lists()
+        first_id, last_id = raw_pages[0][0]["id"], raw_pages[-1][-1]["id"]
+
+        write_to_db = Write_to_DB(db_info["db_user_name"], db_info["db_password"], db_info["db_port"], db_info["db_name"], bulk=bulk)
+        delete_benchmark_rows(write_to_db, first_id, last_id)
+        rows = 0
+        start = perf_counter()
+        for products_list, variants_list, images_list in extracted_pages:
+            write_to_db.insert_into_table("products", products_list)
+            write_to_db.insert_into_table("variants", variants_list)
+            write_to_db.insert_into_table("images", images_list)
+            rows += len(products_list) + len(variants_list) + len(images_list)
+        seconds = perf_counter() - start
+        delete_benchmark_rows(write_to_db, first_id, last_id)
+        write_to_db.terminate_connection()
+
+        results.append({
+            "benchmark": "insert_into_table",
+            "mode": "bulk" if bulk else "row",
+            "rows": rows,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 1),
+        })
+    return results
+
+
+def load_fixture(path: str = None, pages: int = 4) -> list:
+    """
+    Loads the raw products of a saved `products.json` response, or builds synthetic ones.
+
+    Args:
+        path (str): Path of a saved `products.json` response, None for synthetic products.
+        pages (int): The number of synthetic 250 products pages.
+
+    Returns:
+        list: List of raw product dictionaries.
+    """
+    if path is None:
+        return [product for page in synthetic_pages(pages) for product in page]
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["products"]
+
+
+def build_records(row_products_list: list, to_dict) -> list:
+    """
+    Builds the products, variants, and images records of raw products and converts them to dicts.
+
+    Args:
+        row_products_list (list): List of raw product dictionaries.
+        to_dict: The function converting a record to a dict.
+
+    Returns:
+        list: List of the records dicts.
+    """
+    rows = []
+    for product in row_products_list:
+        rows.append(to_dict(Products(
+            id = product["id"],
+            product_publish_date = product.get("published_at"),
+            product_vendor = product.get("vendor"),
+            product_type = product.get("product_type"),
+            product_tags = product.get("tags"),
+            product_options = product.get("options"),
+            product_page = product.get("handle"),
+            product_description = product.get("body_html"),
+            product_title = product.get("title"),
+            images_ids = product.get("images")
+        )))
+        for variant in product.get("variants"):
+            rows.append(to_dict(Variants(
+                id = variant["id"],
+                product_id = variant["product_id"],
+                variant_title = variant.get("title"),
+                variant_price = variant.get("price"),
+                variant_compare_at_price = variant.get("compare_at_price"),
+                variant_sku = variant["sku"],
+                variant_created_at = variant.get("created_at"),
+                variant_updated_at = variant.get("updated_at"),
+                variant_available = variant.get("available")
+            )))
+        for image in product.get("images") or []:
+            rows.append(to_dict(Images(
+                id = image["id"],
+                created_at = image.get("created_at"),
+                updated_at = image.get("updated_at"),
+                variant_ids = image.get("variant_ids"),
+                src = image.get("src"),
+                width = image.get("width"),
+                height = image.get("height")
+            )))
+    return rows
+
+
+def bench_records(fixture: str = None, pages: int = 4, repeat: int = 5) -> list:
+    """
+    Compares the records/sec and peak memory of `dataclasses.asdict` and the records' shallow `as_dict`.
+
+    Args:
+        fixture (str): Path of a saved `products.json` response, None for synthetic products.
+        pages (int): The number of synthetic 250 products pages when no fixture is given.
+        repeat (int): The number of timed runs, the fastest one is reported.
+
+    Returns:
+        list: One result dict per conversion.
+    """
+    row_products_list = load_fixture(fixture, pages)
+    results = []
+    for mode, to_dict in (("dataclasses.asdict", asdict), ("as_dict", lambda record: record.as_dict())):
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            records = build_records(row_products_list, to_dict)
+            seconds = min(seconds, perf_counter() - start)
+        del records
+
+        tracemalloc.start()
+        records = build_records(row_products_list, to_dict)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({
+            "benchmark": "records",
+            "mode": mode,
+            "records": len(records),
+            "seconds": round(seconds, 4),
+            "records_per_sec": round(len(records) / seconds, 1),
+            "peak_memory_mb": round(peak_bytes / 2**20, 2),
+        })
+    return results
+
+
+def load_response_bodies(path: str = None, pages: int = 4) -> list:
+    """
+    Loads the bodies of saved `products.json` responses, or builds synthetic ones.
+
+    Args:
+        path (str): Path of a saved `products.json` response, None for synthetic pages.
+        pages (int): The number of synthetic 250 products pages.
+
+    Returns:
+        list: List of the response bodies bytes.
+    """
+    if path is None:
+        return [json.dumps({"products": page}).encode() for page in synthetic_pages(pages)]
+    with open(path, "rb") as f:
+        return [f.read()]
+
+
+def bench_json(fixture: str = None, pages: int = 4, repeat: int = 5) -> list:
+    """
+    Compares the decode and encode throughput of the installed JSON backends.
+
+    the decode side parses the response bodies from their bytes, as the
+    fetchers do, and the encode side serializes the JSON columns of the
+    products, variants, and images, as `Write_to_DB` does for every row.
+
+    Args:
+        fixture (str): Path of a saved `products.json` response, None for synthetic pages.
+        pages (int): The number of synthetic 250 products pages when no fixture is given.
+        repeat (int): The number of timed runs, the fastest one is reported.
+
+    Returns:
+        list: One result dict per backend.
+    """
+    bodies = load_response_bodies(fixture, pages)
+    body_bytes = sum(len(body) for body in bodies)
+    row_products_list = [product for body in bodies for product in json.loads(body)["products"]]
+    json_values = [
+        value for rows in extract_page(row_products_list) for row in rows
+        for value in row.values() if type(value) in [dict, list]
+    ]
+    results = []
+    for name in available_backends():
+        backend = get_backend(name)
+        decode_seconds = encode_seconds = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            for body in bodies:
+                backend.loads(body)
+            decode_seconds = min(decode_seconds, perf_counter() - start)
+            start = perf_counter()
+            for value in json_values:
+                backend.dumps(value)
+            encode_seconds = min(encode_seconds, perf_counter() - start)
+
+        results.append({
+            "benchmark": "json",
+            "mode": name,
+            "products": len(row_products_list),
+            "decode_mb_per_sec": round(body_bytes / decode_seconds / 2**20, 1),
+            "decode_products_per_sec": round(len(row_products_list) / decode_seconds, 1),
+            "encode_values": len(json_values),
+            "encode_values_per_sec": round(len(json_values) / encode_seconds, 1),
+        })
+    return results
+
+
+def synthetic_description(paragraphs: int = 12) -> str:
+    """
+    Builds a long `body_html` shaped like the ones of real stores, with attributes, inline styles, lists, and entities.
+
+    Args:
+        paragraphs (int): The number of paragraphs, each followed by a list of features.
+
+    Returns:
+        str: The description HTML.
+    """
+    paragraph = (
+        '<p class="product-description__text" data-mce-fragment="1" style="text-align: left;">'
+        '<span style="font-weight: 400;" data-mce-style="font-weight: 400;">Our&nbsp;<strong>best-selling</strong> '
+        'tee is made of 100% organic cotton &amp; finished by hand &mdash; soft, breathable, and built to last.'
+        '</span><br/>\n</p>\n'
+        '<ul class="features">\n<li><span>Pre-shrunk &#8211; true to size</span></li>\n'
+        '<li><span>Machine wash cold, tumble dry low</span></li>\n</ul>\n'
+    )
+    return "<div>\n" + paragraph * paragraphs + '<!-- end of description --><img src="https://cdn.shopify.com/s/files/size-chart.png" alt="" /></div>'
+
+
+def load_descriptions(path: str = None, products: int = 1000) -> list:
+    """
+    Loads the `body_html` of the products of a saved `products.json` response, or builds synthetic ones.
+
+    Args:
+        path (str): Path of a saved `products.json` response, None for synthetic descriptions.
+        products (int): The number of synthetic descriptions.
+
+    Returns:
+        list: List of the descriptions, the products without one are left out.
+    """
+    if path is None:
+        return [synthetic_description() for _ in range(products)]
+    return [product["body_html"] for product in load_fixture(path) if product.get("body_html")]
+
+
+def bench_descriptions(fixture: str = None, products: int = 1000, max_length: int = 300, repeat: int = 5) -> list:
+    """
+    Compares the cost per product and the size of the stored descriptions of the description cleanings.
+
+    the "tags regex" mode is the original cleaning, which only strips
+    the tags without attributes and keeps the entities and whitespace.
+
+    Args:
+        fixture (str): Path of a saved `products.json` response, None for synthetic descriptions.
+        products (int): The number of synthetic descriptions when no fixture is given.
+        max_length (int): The cap of the capped mode.
+        repeat (int): The number of timed runs, the fastest one is reported.
+
+    Returns:
+        list: One result dict per cleaning.
+    """
+    descriptions = load_descriptions(fixture, products)
+    input_bytes = sum(len(description.encode()) for description in descriptions)
+    modes = (
+        ("tags regex", lambda description: re.sub(r"<\w+>|</\w+>", "", description)),
+        ("clean_description", lambda description: clean_description(description, None)),
+        (f"clean_description capped {max_length}", lambda description: clean_description(description, max_length)),
+    )
+    results = []
+    for mode, clean in modes:
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            cleaned = [clean(description) for description in descriptions]
+            seconds = min(seconds, perf_counter() - start)
+        output_bytes = sum(len(description.encode()) for description in cleaned if description)
+
+        results.append({
+            "benchmark": "descriptions",
+            "mode": mode,
+            "products": len(descriptions),
+            "microseconds_per_product": round(seconds / len(descriptions) * 1e6, 2),
+            "input_kb": round(input_bytes / 2**10, 1),
+            "stored_kb": round(output_bytes / 2**10, 1),
+            "storage_saved": f"{1 - output_bytes / input_bytes:.1%}",
+        })
+    return results
+
+
+def bench_streaming(products: int = 250, variants: int = 30, images: int = 20, paragraphs: int = 12, repeat: int = 3) -> list:
+    """
+    Compares the peak memory and time of extracting a large page parsed whole and streamed.
+
+    the body is built before the measure, as if it was still on the
+    socket, and read in `STREAM_CHUNK_SIZE` chunks. the "whole body" mode
+    joins them like `response.content` does, decodes the body, and
+    extracts the page, the "streamed" mode extracts every product as
+    soon as its chunks arrived.
+
+    Args:
+        products (int): The number of products of the page.
+        variants (int): The number of variants per product.
+        images (int): The number of images per product.
+        paragraphs (int): The number of paragraphs of every product's description.
+        repeat (int): The number of timed runs, the fastest one is reported.
+
+    Returns:
+        list: One result dict per mode.
+    """
+    row_products_list = synthetic_pages(1, products, variants_count=variants, images_count=images)[0]
+    for product in row_products_list:
+        product["body_html"] = synthetic_description(paragraphs)
+    body = json.dumps({"products": row_products_list}).encode()
+    del row_products_list
+
+    def chunks():
+        for start in range(0, len(body), STREAM_CHUNK_SIZE):
+            yield body[start:start + STREAM_CHUNK_SIZE]
+
+    modes = (
+        ("whole body", lambda: extract_page(loads(b"".join(chunks()))["products"])),
+        ("streamed", lambda: stream_page(chunks()).extracted_lists()[0]),
+    )
+    results = []
+    for mode, extract in modes:
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            extract()
+            seconds = min(seconds, perf_counter() - start)
+
+        tracemalloc.start()
+        extracted_lists = extract()
+        kept_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del extracted_lists
+
+        results.append({
+            "benchmark": "streaming",
+            "mode": mode,
+            "products": products,
+            "body_mb": round(len(body) / 2**20, 2),
+            "seconds": round(seconds, 4),
+            "peak_memory_mb": round(peak_bytes / 2**20, 2),
+            "extracted_records_mb": round(kept_bytes / 2**20, 2),
+        })
+    return results
+
+
+def bench_sinks(db_info: dict, pages: int = 20, row_group_size: int = 100_000) -> list:
+    """
+    Compares the write throughput of the sinks over the same extracted pages.
+
+    every page is written with `write_page`, the postgres sink per row and
+    bulk, when the .env file has the database credentials, and the file
+    sinks whose library is installed into a temporary directory. the timer
+    includes closing the files, the size on disk is reported for them.
+
+    Args:
+        db_info (dict): The database credentials, the postgres sink is skipped if empty.
+        pages (int): The number of 250 products pages written by each sink.
+        row_group_size (int): The row group size of the parquet sink.
+
+    Returns:
+        list: One result dict per sink.
+    """
+    raw_pages = synthetic_pages(pages)
+    first_id, last_id = raw_pages[0][0]["id"], raw_pages[-1][-1]["id"]
+    modes = []
+    if db_info.get("db_user_name"):
+        modes += [("postgres", False), ("postgres bulk", True)]
+    modes += [(name, None) for name in available_sinks() if name != "postgres"]
+    results = []
+    for mode, bulk in modes:
+        # write_page adds the store to the items, so every sink gets its own copy
+        extracted_pages = [extract_page(row_products_list) for row_products_list in raw_pages]
+        with tempfile.TemporaryDirectory() as output_dir:
+            if bulk is not None:
+                sink = Write_to_DB(db_info["db_user_name"], db_info["db_password"], db_info["db_port"], db_info["db_name"], bulk=bulk,
+                                   host=db_info.get("db_host", "localhost"))
+                delete_benchmark_rows(sink, first_id, last_id)
+            else:
+                sink = get_sink(mode, output_dir, **({"row_group_size": row_group_size} if mode == "parquet" else {}))
+            rows = 0
+            start = perf_counter()
+            for products_list, variants_list, images_list in extracted_pages:
+                sink.write_page(products_list, variants_list, images_list)
+                rows += len(products_list) + len(variants_list) + len(images_list)
+            sink.commit()
+            seconds = perf_counter() - start
+            if bulk is not None:
+                delete_benchmark_rows(sink, first_id, last_id)
+            sink.terminate_connection()
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output_dir) for name in names)
+
+        result = {
+            "benchmark": "sinks",
+            "mode": mode,
+            "rows": rows,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 1),
+        }
+        if bulk is None:
+            result["size_mb"] = round(size / 2**20, 2)
+        results.append(result)
+    return results
+
+
+def bench_pagination(products: int = 1100, latency: float = 0.05, processing: float = 0.05) -> list:
+    """
+    Compares the requests count and wall time of the pagination strategies against a local store.
+
+    the "empty page" mode is the original loop, requesting pages until an
+    empty one comes back. every page is held for `processing` seconds to
+    stand in for the extraction and the database writes prefetching
+    overlaps with.
+
+    Args:
+        products (int): The number of products of the store.
+        latency (float): Seconds every response of the store is delayed by.
+        processing (float): Seconds spent on every page once fetched.
+
+    Returns:
+        list: One result dict per mode.
+    """
+    # the local store never throttles, so the rate limiter is kept out of the timings
+    req_handler = Requests_Handler(Host_Rate_Limiter(initial_rate=1000, max_rate=1000, burst=1000), max_retries=1)
+    modes = (
+        ("empty page", "page", False, True),
+        ("page", "page", False, True),
+        ("since_id", "since_id", False, True),
+        ("since_id ignored", "since_id", False, False),
+        ("page + prefetch", "page", True, True),
+        ("since_id + prefetch", "since_id", True, True),
+    )
+    results = []
+    for mode, strategy, prefetch, supports_since_id in modes:
+        server = Local_Store_Server(1, products, latency=latency, supports_since_id=supports_since_id)
+        server.start()
+        store_products_API, _ = req_handler.config_store_url_and_name(server.stores_urls()[0])
+        products_count = 0
+        start = perf_counter()
+        if mode == "empty page":
+            page_number = 1
+            while row_products_list := req_handler.fetch_products_list(req_handler.config_store_products_url(store_products_API, page_number))["products"]:
+                sleep(processing)
+                products_count += len(row_products_list)
+                page_number += 1
+        else:
+            for _, row_products_list in paginate(req_handler, store_products_API, strategy, prefetch):
+                sleep(processing)
+                products_count += len(row_products_list)
+        seconds = perf_counter() - start
+        server.stop()
+
+        results.append({
+            "benchmark": "pagination",
+            "mode": mode,
+            "products": products_count,
+            "requests": server.requests_count,
+            "seconds": round(seconds, 4),
+        })
+    return results
+
+
+def load_archive(path: str = None, stores: int = 3, products: int = 1000, directory: str = None) -> Fixture_Archive:
+    """
+    Loads a fixture archive, or records the synthetic stores of a Local_Store_Server into a new one.
+
+    Args:
+        path (str): Path of an archive written by `python replay.py record`, None to record synthetic stores.
+        stores (int): The number of synthetic stores.
+        products (int): The number of products of every synthetic store.
+        directory (str): Where the synthetic archive is written, a temporary directory if None.
+
+    Returns:
+        Fixture_Archive: The archive, read.
+    """
+    if path is None:
+        server = Local_Store_Server(stores, products)
+        server.start()
+        path = os.path.join(directory or tempfile.mkdtemp(), "synthetic fixtures.zip")
+        record_stores(server.stores_urls(), path, Requests_Handler(Host_Rate_Limiter(initial_rate=1000, max_rate=1000, burst=1000)), verbose=False)
+        server.stop()
+    return Fixture_Archive(path)
+
+
+def bench_fetch(archive: Fixture_Archive, latency: float = 0, jitter: float = 0, error_rate: float = 0, seed: int = 1) -> list:
+    """
+    Measures the pages/sec and MB/s of `Requests_Handler.fetch_products_list` against the replayed stores.
+
+    every store is fetched by page number, whole pages and streamed (the
+    streamed pages are extracted while they download). the retries of the
+    injected errors back off for 10 ms to 100 ms, so they count in the time
+    without dominating it.
+
+    Args:
+        archive (Fixture_Archive): The recorded stores.
+        latency (float): Seconds every response is delayed by.
+        jitter (float): Up to that many more seconds every response is delayed by.
+        error_rate (float): The share of the requests answered with an error.
+        seed (int): The seed of the jitter and errors.
+
+    Returns:
+        list: One result dict per mode.
+    """
+    results = []
+    for mode, stream in (("whole", False), ("stream", True)):
+        server = Replay_Server(archive, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+        server.start()
+        req_handler = Requests_Handler(Host_Rate_Limiter(initial_rate=1000, max_rate=1000, burst=1000), max_retries=6,
+                                       backoff_base=0.01, backoff_cap=0.1, failure_threshold=1000, stream=stream)
+        pages = products = failed_stores = 0
+        start = perf_counter()
+        for store in server.stores_urls():
+            store_products_API, _ = req_handler.config_store_url_and_name(store)
+            try:
+                for _, row_products_list in paginate(req_handler, store_products_API):
+                    pages += 1
+                    products += len(row_products_list)
+            except Fetch_Error:
+                failed_stores += 1
+        seconds = perf_counter() - start
+        req_handler.end_session()
+        server.stop()
+
+        results.append({
+            "benchmark": "fetch",
+            "mode": mode,
+            "pages": pages,
+            "products": products,
+            "requests": server.requests_count,
+            "error_responses": sum(count for status, count in server.statuses_count.items() if status != 200),
+            "failed_stores": failed_stores,
+            "seconds": round(seconds, 4),
+            "pages_per_sec": round(pages / seconds, 1),
+            "mb_per_sec": round(server.bytes_sent / seconds / 2**20, 2),
+        })
+    return results
+
+
+def bench_extract(archive: Fixture_Archive, repeat: int = 3) -> list:
+    """
+    Measures the records/sec of `Products_Data_Extractors.get_products_data_sql` and `get_products_columns` over the recorded pages.
+
+    the pages are decoded before the timer starts.
+
+    Args:
+        archive (Fixture_Archive): The recorded stores.
+        repeat (int): The number of timed runs, the fastest one is reported.
+
+    Returns:
+        list: One result dict per method.
+    """
+    raw_pages = [loads(body)["products"] for store_index in range(len(archive.stores)) for body in archive.pages(store_index)]
+    products = sum(len(row_products_list) for row_products_list in raw_pages)
+    p_d_extractors = Products_Data_Extractors()
+    results = []
+    for mode in ("get_products_data_sql", "get_products_columns"):
+        seconds = float("inf")
+        for _ in range(repeat):
+            records = 0
+            start = perf_counter()
+            for row_products_list in raw_pages:
+                if mode == "get_products_data_sql":
+                    records += sum(len(items_list) for items_list in p_d_extractors.get_products_data_sql(row_products_list))
+                    p_d_extractors.empty_all_lists()
+                else:
+                    columns_batch = p_d_extractors.get_products_columns([row_products_list])
+                    records += sum(len(columns_batch.table(table_name)["id"]) for table_name in ("products", "variants", "images"))
+            seconds = min(seconds, perf_counter() - start)
+
+        results.append({
+            "benchmark": "extract",
+            "mode": mode,
+            "pages": len(raw_pages),
+            "products": products,
+            "records": records,
+            "seconds": round(seconds, 4),
+            "records_per_sec": round(records / seconds, 1),
+        })
+    return results
+
+
+def bench_end_to_end(
+    archive: Fixture_Archive,
+    engines: list,
+    sink: str = "postgres",
+    latency: float = 0,
+    error_rate: float = 0,
+    seed: int = 1,
+    main_args: str = "--max-rate 1000",
+) -> list:
+    """
+    Measures the full `main.py` flow crawling the replayed stores, once per engine.
+
+    main.py runs in its own process from a temporary directory holding
+    the replayed stores list, a copy of the .env file, and its metrics
+    file, which the products and rows counts and the fetch latency are
+    read from. the postgres sink upserts the recorded rows into the
+    database of the .env file, the file sinks write under the temporary
+    directory.
+
+    Args:
+        archive (Fixture_Archive): The recorded stores.
+        engines (list): The engines compared, "serial", "async", or "pipeline".
+        sink (str): The sink of main.py, "postgres", "parquet", or "jsonl".
+        latency (float): Seconds every response is delayed by.
+        error_rate (float): The share of the requests answered with an error.
+        seed (int): The seed of the errors.
+        main_args (str): More arguments of main.py, e.g. "--bulk --db-pool-size 4".
+
+    Returns:
+        list: One result dict per engine.
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for engine in engines:
+        server = Replay_Server(archive, latency=latency, error_rate=error_rate, seed=seed)
+        server.start()
+        with tempfile.TemporaryDirectory() as work_dir:
+            with open(os.path.join(work_dir, "stores_to_scrape.json"), "w") as f:
+                json.dump(server.stores_urls(), f)
+            os.makedirs(os.path.join(work_dir, "failed items"))
+            if os.path.exists(".env"):
+                shutil.copy(".env", work_dir)
+            command = [sys.executable, os.path.join(project_dir, "main.py"), "--engine", engine, "--sink", sink,
+                       "--metrics-file", "metrics.json", "--metrics-interval", "3600"] + shlex.split(main_args)
+            environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [project_dir, os.environ.get("PYTHONPATH")])))
+            start = perf_counter()
+            completed = subprocess.run(command, cwd=work_dir, env=environment, capture_output=True, text=True)
+            seconds = perf_counter() - start
+            metrics = {}
+            if os.path.exists(os.path.join(work_dir, "metrics.json")):
+                with open(os.path.join(work_dir, "metrics.json"), "r") as f:
+                    metrics = json.load(f)
+        server.stop()
+
+        rows = {
+            counter["labels"]["table"]: counter["value"]
+            for counter in metrics.get("counters", []) if counter["name"] == "shopify_write_rows_total"
+        }
+        fetch = next((histogram for histogram in metrics.get("histograms", []) if histogram["name"] == "shopify_fetch_seconds"), {})
+        result = {
+            "benchmark": "end_to_end",
+            "mode": f"{engine} {sink}",
+            "exit_code": completed.returncode,
+            "products": rows.get("products", 0),
+            "rows": sum(rows.values()),
+            "requests": server.requests_count,
+            "error_responses": sum(count for status, count in server.statuses_count.items() if status != 200),
+            "seconds": round(seconds, 4),
+            "products_per_sec": round(rows.get("products", 0) / seconds, 1),
+            "rows_per_sec": round(sum(rows.values()) / seconds, 1),
+            "fetch_ms_avg": round(fetch.get("avg", 0) * 1000, 2),
+            "fetch_ms_max": round(fetch.get("max", 0) * 1000, 2),
+        }
+        if completed.returncode:
+            result["stderr"] = completed.stderr[-2000:]
+        results.append(result)
+    return results
+
+
+def git_commit() -> str:
+    """
+    Reads the commit of the benchmarked tree.
+
+    Returns:
+        str: The commit hash, None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the scraper stages.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    insert_parser = subparsers.add_parser("insert", help="rows/sec of Write_to_DB.insert_into_table, per-row vs bulk COPY.")
+    insert_parser.add_argument("--pages", type=int, default=4)
+
+    records_parser = subparsers.add_parser("records", help="records/sec and peak memory of building the records dicts.")
+    records_parser.add_argument("--fixture", default=None, help="a saved products.json response, synthetic products if omitted.")
+    records_parser.add_argument("--pages", type=int, default=4)
+
+    pagination_parser = subparsers.add_parser("pagination", help="requests count and wall time of the pagination strategies.")
+    pagination_parser.add_argument("--products", type=int, default=1100)
+    pagination_parser.add_argument("--latency", type=float, default=0.05, help="seconds every response of the store is delayed by.")
+    pagination_parser.add_argument("--processing", type=float, default=0.05, help="seconds spent on every page once fetched.")
+
+    json_parser = subparsers.add_parser("json", help="decode and encode throughput of the installed JSON backends.")
+    json_parser.add_argument("--fixture", default=None, help="a saved products.json response, synthetic pages if omitted.")
+    json_parser.add_argument("--pages", type=int, default=4)
+
+    descriptions_parser = subparsers.add_parser("descriptions", help="cost per product and storage saved by the description cleaning.")
+    descriptions_parser.add_argument("--fixture", default=None, help="a saved products.json response, synthetic descriptions if omitted.")
+    descriptions_parser.add_argument("--products", type=int, default=1000)
+    descriptions_parser.add_argument("--max-length", type=int, default=300, help="the cap of the capped mode.")
+
+    streaming_parser = subparsers.add_parser("streaming", help="peak memory of extracting a large page parsed whole and streamed.")
+    streaming_parser.add_argument("--products", type=int, default=250)
+    streaming_parser.add_argument("--variants", type=int, default=30)
+    streaming_parser.add_argument("--images", type=int, default=20)
+    streaming_parser.add_argument("--paragraphs", type=int, default=12, help="paragraphs of every product's description.")
+
+    sinks_parser = subparsers.add_parser("sinks", help="write throughput of the postgres, parquet, and jsonl sinks.")
+    sinks_parser.add_argument("--pages", type=int, default=20)
+    sinks_parser.add_argument("--row-group-size", type=int, default=100_000)
+
+    fetch_parser = subparsers.add_parser("fetch", help="pages/sec and MB/s of fetching the replayed stores, whole and streamed.")
+    extract_parser = subparsers.add_parser("extract", help="records/sec of extracting the replayed pages.")
+    end_to_end_parser = subparsers.add_parser("e2e", help="products/sec of the full main.py flow over the replayed stores, per engine.")
+    for replay_parser in (fetch_parser, extract_parser, end_to_end_parser):
+        replay_parser.add_argument("--archive", default=None, help="a fixture archive of replay.py, synthetic stores recorded if omitted.")
+        replay_parser.add_argument("--stores", type=int, default=3, help="the number of synthetic stores.")
+        replay_parser.add_argument("--products", type=int, default=1000, help="the number of products of every synthetic store.")
+    for replay_parser in (fetch_parser, end_to_end_parser):
+        replay_parser.add_argument("--latency", type=float, default=0, help="seconds every response is delayed by.")
+        replay_parser.add_argument("--error-rate", type=float, default=0, help="the share of the requests answered with an error.")
+        replay_parser.add_argument("--seed", type=int, default=1, help="the seed of the jitter and errors.")
+    fetch_parser.add_argument("--jitter", type=float, default=0, help="up to that many more seconds every response is delayed by.")
+    end_to_end_parser.add_argument("--engines", default="serial,async,pipeline", help="the comma-separated engines compared.")
+    end_to_end_parser.add_argument("--sink", choices=["postgres", "parquet", "jsonl"], default="postgres")
+    end_to_end_parser.add_argument("--main-args", default="--max-rate 1000", help="more arguments of main.py.")
+
+    parser.add_argument("--output", default=None, metavar="PATH",
+                        help="also append the results, with the time and the git commit, as one JSON line to this file.")
+    args = parser.parse_args()
+
+    if args.benchmark == "insert":
+        results = bench_insert_into_table(dotenv_values(".env"), args.pages)
+    elif args.benchmark == "records":
+        results = bench_records(args.fixture, args.pages)
+    elif args.benchmark == "pagination":
+        results = bench_pagination(args.products, args.latency, args.processing)
+    elif args.benchmark == "json":
+        results = bench_json(args.fixture, args.pages)
+    elif args.benchmark == "descriptions":
+        results = bench_descriptions(args.fixture, args.products, args.max_length)
+    elif args.benchmark == "streaming":
+        results = bench_streaming(args.products, args.variants, args.images, args.paragraphs)
+    elif args.benchmark == "sinks":
+        results = bench_sinks(dotenv_values(".env"), args.pages, args.row_group_size)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            archive = load_archive(args.archive, args.stores, args.products, directory)
+        if args.benchmark == "fetch":
+            results = bench_fetch(archive, args.latency, args.jitter, args.error_rate, args.seed)
+        elif args.benchmark == "extract":
+            results = bench_extract(archive)
+        else:
+            results = bench_end_to_end(archive, args.engines.split(","), args.sink, args.latency, args.error_rate, args.seed, args.main_args)
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "benchmark": args.benchmark,
+                "time": datetime.now(timezone.utc).isoformat(),
+                "commit": git_commit(),
+                "results": results,
+            }) + "\n")
@@ -0,0 +1,163 @@
+"""extracts whole pages of raw products into column-oriented buffers.
+
+through the extract_columns function it will turn one or many pages of
+raw products into a Columnar_Batch holding one list or array per column
+of the products, variants, and images tables. every column is validated
+and coerced in a single pass over the page, the same way the Products,
+Variants, and Images records do it row by row, e.g. all the variant
+prices are parsed into one float64 array at once.
+
+the variants and images are flattened across all the products, and
+`variants_offsets` / `images_offsets` give the rows of each product:
+the variants of the i-th product are the rows
+`variants_offsets[i]:variants_offsets[i+1]`.
+
+the columns dicts map column names to sequences, so they can be handed
+to `Write_to_DB.insert_columns` or to an Arrow/Parquet exporter
+(`pyarrow.table(batch.variants)`) without rebuilding a dict per row.
+
+Typical usage example:
+
+    batch = extract_columns([row_products_list])
+    write_to_db.insert_columns("products", batch)
+    write_to_db.insert_columns("variants", batch)
+    write_to_db.insert_columns("images", batch)
+"""
+
+from array import array
+from itertools import accumulate
+from math import isnan
+from description_cleaning import clean_stored_description
+
+
+class Columnar_Batch:
+    """
+    The products, variants, and images of a batch of pages in columns.
+
+    Attributes:
+        products (dict): The products table columns.
+        variants (dict): The variants table columns.
+        images (dict): The images table columns.
+        variants_offsets (array): The first variant row of every product, followed by the variants count.
+        images_offsets (array): The first image row of every product, followed by the images count.
+    """
+
+    def __init__(self, products: dict, variants: dict, images: dict, variants_offsets: array, images_offsets: array) -> None:
+        """
+        Initializes the Columnar_Batch class.
+
+        Args:
+            products (dict): The products table columns.
+            variants (dict): The variants table columns.
+            images (dict): The images table columns.
+            variants_offsets (array): The first variant row of every product, followed by the variants count.
+            images_offsets (array): The first image row of every product, followed by the images count.
+        """
+        self.products = products
+        self.variants = variants
+        self.images = images
+        self.variants_offsets = variants_offsets
+        self.images_offsets = images_offsets
+
+    def __len__(self) -> int:
+        """Returns the number of products in the batch."""
+        return len(self.products["id"])
+
+    def table(self, table_name: str) -> dict:
+        """
+        Returns the columns of a table.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+
+        Returns:
+            dict: The columns of the table.
+        """
+        return getattr(self, table_name)
+
+    def rows(self, table_name: str, columns: list):
+        """
+        Yields the rows of a table as tuples, with NaN numbers turned back into None.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            columns (list): The columns of the tuples, in order.
+
+        Yields:
+            tuple: One row of the table.
+        """
+        table = self.table(table_name)
+        for row in zip(*(table[column] for column in columns)):
+            yield tuple(None if type(value) is float and isnan(value) else value for value in row)
+
+
+def to_float_array(values: list) -> array:
+    """
+    Coerces a column of price strings to a float64 array, NaN for the missing ones.
+
+    Args:
+        values (list): The raw values.
+
+    Returns:
+        array: The coerced column.
+    """
+    return array("d", [float(value) if value else float("nan") for value in values])
+
+
+def extract_columns(pages: list) -> Columnar_Batch:
+    """
+    Extracts pages of raw products into column-oriented buffers.
+
+    Args:
+        pages (list): List of pages, each a list of raw product dictionaries.
+
+    Returns:
+        Columnar_Batch: The products, variants, and images columns of all the pages.
+    """
+    products = [product for page in pages for product in page]
+    products_variants = [product.get("variants") or [] for product in products]
+    products_images = [product.get("images") or [] for product in products]
+    variants = [variant for product_variants in products_variants for variant in product_variants]
+    images = [image for product_images in products_images for image in product_images]
+
+    handles = [product.get("handle") for product in products]
+    vendors = [product.get("vendor") for product in products]
+    products_columns = {
+        "id": array("q", [product["id"] for product in products]),
+        "product_publish_date": [product.get("published_at") for product in products],
+        "product_vendor": vendors,
+        "product_type": [product.get("product_type") for product in products],
+        "product_tags": [product.get("tags") or [] for product in products],
+        "product_options": [product.get("options") or [] for product in products],
+        "product_page": ["https://:" + vendor + ".com" + "/products/" + handle.replace(" ", "") for vendor, handle in zip(vendors, handles)],
+        "product_description": [clean_stored_description(product.get("body_html")) for product in products],
+        "product_title": [product.get("title") for product in products],
+        "images_ids": [[image["id"] for image in product_images] for product_images in products_images],
+    }
+    variants_columns = {
+        "id": array("q", [variant["id"] for variant in variants]),
+        "product_id": array("q", [variant["product_id"] for variant in variants]),
+        "variant_title": [variant.get("title") for variant in variants],
+        "variant_price": to_float_array([variant.get("price") for variant in variants]),
+        "variant_compare_at_price": to_float_array([variant.get("compare_at_price") for variant in variants]),
+        "variant_sku": [variant["sku"] for variant in variants],
+        "variant_created_at": [variant.get("created_at") for variant in variants],
+        "variant_updated_at": [variant.get("updated_at") for variant in variants],
+        "variant_available": [variant.get("available") for variant in variants],
+    }
+    images_columns = {
+        "id": array("q", [image["id"] for image in images]),
+        "created_at": [image.get("created_at") for image in images],
+        "updated_at": [image.get("updated_at") for image in images],
+        "variant_ids": [image.get("variant_ids") or [] for image in images],
+        "src": [image.get("src") for image in images],
+        "width": [image.get("width") for image in images],
+        "height": [image.get("height") for image in images],
+    }
+    return Columnar_Batch(
+        products_columns,
+        variants_columns,
+        images_columns,
+        array("q", accumulate((len(product_variants) for product_variants in products_variants), initial=0)),
+        array("q", accumulate((len(product_images) for product_images in products_images), initial=0)),
+    )
@@ -21,13 +21,45 @@ Typical usage example:
             page_number += 1
         else:
             break
+
+every request goes through a per-host adaptive token bucket, HTTP 429
+and 5xx responses are retried with exponential backoff and jitter that
+honors `Retry-After`, and after `max_retries` attempts or while the
+store's circuit breaker is open a Fetch_Error is raised so the caller
+can move on to the next store.
+
+with an `http_cache` the pages are requested conditionally, and a page
+answered with a 304 is returned without products, flagged
+`not_modified` with its cached products count and last product id.
+
+the responses are decoded straight from their bytes by the fastest JSON
+library installed, see json_backend. with `stream` they are parsed and
+extracted while they are downloaded instead, see streaming.
         
 """
 
 from requests import session as r_session
+from requests import RequestException
+from urllib.parse import urlsplit
+from rate_limiting import (
+    Host_Rate_Limiter, Circuit_Breaker, Fetch_Error, Circuit_Open_Error,
+    THROTTLE_STATUSES, SERVER_ERROR_STATUSES, retry_after_seconds, backoff_delay
+)
+from http_cache import Http_Cache, ACCEPT_ENCODING
+from json_backend import loads
+from streaming import stream_page, STREAM_CHUNK_SIZE
+from metrics import registry, profiled
 import re
-from time import sleep
-import winsound
+from time import sleep, perf_counter
+
+try:
+    import winsound
+except ImportError:
+    # winsound only exists on Windows
+    winsound = None
+
+# the store name of the ".com" stores, the part of the URL before the domain's ".com"
+STORE_NAME_PATTERN = re.compile(r"(?<=://).+(?=\.com)")
 
 class Requests_Handler:
     """
@@ -35,18 +67,69 @@ class Requests_Handler:
 
     Attributes:
         __session__: An instance of `requests.Session` to manage and persist settings across requests.
+        rate_limiter (Host_Rate_Limiter): The per-host adaptive rate limiter.
+        max_retries (int): The number of attempts for a page before a Fetch_Error is raised.
+        backoff_base (float): The backoff of the first retry in seconds.
+        backoff_cap (float): The maximum backoff in seconds.
+        timeout (float): The timeout of one request in seconds.
+        failure_threshold (int): Consecutive failures opening a store's circuit breaker.
+        reset_timeout (float): Seconds a store's circuit breaker stays open.
+        http_cache (Http_Cache): The validators of the pages for conditional requests, None requests them in full.
+        stream (bool): Whether the pages are parsed and extracted while downloaded, into `streaming.Streamed_Page`s.
+        stream_content_hashes (bool): Whether the streamed products are hashed for a `dedup.Content_Hash_Index`.
     """
 
-    def __init__(self) -> None:
-        """Initializes the Requests_Handler with a new session."""
+    def __init__(
+        self,
+        rate_limiter: Host_Rate_Limiter = None,
+        max_retries: int = 6,
+        backoff_base: float = 1,
+        backoff_cap: float = 60,
+        timeout: float = 60,
+        failure_threshold: int = 5,
+        reset_timeout: float = 300,
+        http_cache: Http_Cache = None,
+        stream: bool = False,
+        stream_content_hashes: bool = False,
+    ) -> None:
+        """
+        Initializes the Requests_Handler with a new session.
+
+        Args:
+            rate_limiter (Host_Rate_Limiter): The per-host rate limiter, a default one if None.
+            max_retries (int): The number of attempts for a page before a Fetch_Error is raised.
+            backoff_base (float): The backoff of the first retry in seconds.
+            backoff_cap (float): The maximum backoff in seconds.
+            timeout (float): The timeout of one request in seconds.
+            failure_threshold (int): Consecutive failures opening a store's circuit breaker.
+            reset_timeout (float): Seconds a store's circuit breaker stays open.
+            http_cache (Http_Cache): The validators of the pages for conditional requests, None requests them in full.
+            stream (bool): Parse and extract the pages while they are downloaded, one product at a time.
+            stream_content_hashes (bool): Hash the streamed products for a `dedup.Content_Hash_Index`.
+        """
         self.__session__ = r_session()
+        self.__session__.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        self.rate_limiter = rate_limiter or Host_Rate_Limiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.http_cache = http_cache
+        self.stream = stream
+        self.stream_content_hashes = stream_content_hashes
+        self.__circuit_breakers = {}
         
     def sound_alarm(self) -> None:
         """
         Plays an alarm sound using the `winsound` library.
         
-        The alarm consists of a series of beeps with different frequencies and durations.
+        The alarm consists of a series of beeps with different frequencies and durations,
+        it is skipped where `winsound` isn't available.
         """
+        if winsound is None:
+            return
         winsound.Beep(90, 100)
         winsound.Beep(1200, 100)
         winsound.Beep(1200, 100)
@@ -62,53 +145,145 @@ class Requests_Handler:
             store: A string representing the store URL.
 
         Returns:
-            A tuple containing the formatted store URL and store name.
+            A tuple containing the formatted store URL and store name,
+            the host and path of the URL for the stores not on a ".com" domain.
         """
-        store = store.strip("/")
+        store = store.strip().strip("/")
         if "http" not in store:
             store_url = "https://" + store + "/"
         else:
             store_url  = store + "/"
-        store_name = re.search(r"(?<=://).+(?=\.com)", store_url)[0]
+        match = STORE_NAME_PATTERN.search(store_url)
+        store_name = match[0] if match else store_url.partition("://")[2].strip("/")
         return store_url, store_name
 
-    def config_store_products_url(self, store_url: str, page_number: int) -> str:
+    def config_store_products_url(self, store_url: str, page_number: int, limit: int = 250) -> str:
         """
         Configures the products URL for the given store and page number.
 
         Args:
             store_url: A string representing the store URL.
             page_number: An integer representing the page number.
+            limit: The number of products per page, shopify serves at most 250.
 
         Returns:
             A string representing the complete products URL.
         """
-        url = store_url + "products.json?limit=250&page=" + str(page_number)
+        url = store_url + "products.json?limit=" + str(limit) + "&page=" + str(page_number)
         return url
 
-    def fetch_products_list(self, url: str) -> list:
+    def config_store_products_cursor_url(self, store_url: str, since_id: int, limit: int = 250) -> str:
+        """
+        Configures the products URL for the given store, asking for the products after an id.
+
+        Args:
+            store_url: A string representing the store URL.
+            since_id: The id of the last product already fetched, 0 for the first page.
+            limit: The number of products per page, shopify serves at most 250.
+
+        Returns:
+            A string representing the complete products URL.
+        """
+        url = store_url + "products.json?limit=" + str(limit) + "&since_id=" + str(since_id)
+        return url
+
+    def circuit_breaker(self, url: str) -> Circuit_Breaker:
+        """
+        Returns the circuit breaker of the store a products URL belongs to.
+
+        Args:
+            url: A string representing the products URL.
+
+        Returns:
+            Circuit_Breaker: The store's circuit breaker.
+        """
+        store_url = url.split("products.json")[0]
+        if store_url not in self.__circuit_breakers:
+            self.__circuit_breakers[store_url] = Circuit_Breaker(self.failure_threshold, self.reset_timeout)
+        return self.__circuit_breakers[store_url]
+
+    @profiled("fetch")
+    def fetch_products_list(self, url: str, keep_body: bool = False) -> dict:
         """
         Fetches the list of products from the given URL.
 
         Args:
             url: A string representing the products URL.
+            keep_body: Keep the body as received under the "body" key of the response, e.g. to record it,
+                the page is then neither streamed nor requested conditionally.
 
         Returns:
-            a json format response.
+            a json format response, or the `Http_Cache.not_modified_page` of a page answered with a 304.
+            with `stream` the "products" of the response are a `streaming.Streamed_Page`.
         
         Raises:
-            ConnectionError: If there is a connection error during the request.
+            Circuit_Open_Error: If the store's circuit breaker is open.
+            Fetch_Error: If the page could not be fetched after `max_retries` attempts,
+                or the store answered with a client error other than 429.
         """
-        while True:
+        host = urlsplit(url).netloc
+        circuit_breaker = self.circuit_breaker(url)
+        # a kept body is the whole page as received, never a 304
+        http_cache = self.http_cache if not keep_body else None
+        for attempt in range(self.max_retries):
+            if not circuit_breaker.allow():
+                raise Circuit_Open_Error(f"circuit open for {url}")
+            self.rate_limiter.acquire(host)
+            retry_after = None
+            response = None
+            start = perf_counter()
             try:
-                response = self.__session__.get(url)
-                break
-            except:
-                self.end_session()
-                self.sound_alarm()
-                print("Connection error!!")
-                sleep(30)
-        return response.json()
+                headers = http_cache.conditional_headers(url) if http_cache is not None else None
+                response = self.__session__.get(url, headers=headers, timeout=self.timeout, stream=self.stream and not keep_body)
+                registry.increment("shopify_fetch_responses_total", status=response.status_code)
+                if response.status_code == 304 and http_cache is not None:
+                    not_modified_page = http_cache.not_modified_page(url)
+                    if not_modified_page is not None:
+                        self.rate_limiter.on_success(host)
+                        circuit_breaker.record_success()
+                        return not_modified_page
+                    # a 304 without a cached page is a miss, the page is requested again without validators
+                    response.close()
+                    self.rate_limiter.acquire(host)
+                    response = self.__session__.get(url, timeout=self.timeout, stream=self.stream and not keep_body)
+                    registry.increment("shopify_fetch_responses_total", status=response.status_code)
+                if response.status_code in THROTTLE_STATUSES:
+                    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                    self.rate_limiter.on_throttle(host, retry_after)
+                    print(f"throttled ({response.status_code}) {url}, rate now {self.rate_limiter.rate(host):.2f}/s")
+                elif response.status_code in SERVER_ERROR_STATUSES:
+                    circuit_breaker.record_failure()
+                    print(f"server error ({response.status_code}) {url}")
+                elif response.status_code >= 400:
+                    circuit_breaker.record_failure()
+                    raise Fetch_Error(f"{response.status_code} error for {url}")
+                else:
+                    if self.stream and not keep_body:
+                        json_response = {"products": stream_page(response.iter_content(STREAM_CHUNK_SIZE), self.stream_content_hashes)}
+                    else:
+                        registry.increment("shopify_fetch_decoded_bytes_total", len(response.content))
+                        json_response = loads(response.content)
+                        if keep_body:
+                            json_response["body"] = response.content
+                    registry.observe("shopify_fetch_seconds", perf_counter() - start)
+                    if http_cache is not None:
+                        # the bytes read off the socket, a chunked response has no Content-Length to trust
+                        http_cache.record(url, response.headers, json_response["products"], response.raw.tell())
+                    self.rate_limiter.on_success(host)
+                    circuit_breaker.record_success()
+                    return json_response
+            except (RequestException, ValueError) as e:
+                circuit_breaker.record_failure()
+                registry.increment("shopify_fetch_errors_total")
+                print(f"Connection error!! {url}: {e!r}")
+            finally:
+                # a streamed response holds its connection until it is closed
+                if response is not None:
+                    response.close()
+            if attempt + 1 < self.max_retries:
+                sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+        self.sound_alarm()
+        raise Fetch_Error(f"failed to fetch {url} after {self.max_retries} attempts")
     
     def end_session(self) -> None:
         """Closes the current session."""
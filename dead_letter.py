@@ -0,0 +1,364 @@
+"""spools the rows that failed to write and loads them again once the cause is fixed.
+
+through the Dead_Letter_Spool class the rows that Write_to_DB fails to
+insert are buffered in memory, at most `buffer_size` of them, and
+appended in one gzip member per flush to rotating segments in "failed
+items/", e.g. "failed items/dead-letters-20241120-103000-123456-4242-0000.jsonl.gz".
+a segment holds the rows of all the tables, each as one JSON line with
+its table, its store, the error and its message, and the time it failed,
+and a new segment is started once it is `segment_bytes` large. the spool
+is flushed before every commit of the writer, so the rows of a page
+reach the disk before its checkpoint is committed.
+
+retry_failed reads the segments, and the "{table}.jsonl" files of the
+previous versions, and loads their rows table by table and store by
+store through the writer's COPY path, the rows that fail again going to
+a new segment. a spooled row never overwrites a newer one: a variant or
+an image whose stored `updated_at` is later than its own is skipped as
+stale, and so is a product already stored, the products having no
+`updated_at`. a file is deleted once all its rows were written, skipped
+as stale, or spooled again, and kept if a batch of its rows failed.
+
+Typical usage example:
+
+    spool = Dead_Letter_Spool("failed items")
+    spool.add("variants", item, store_products_API, e)
+    spool.flush()
+
+    write_to_db = Write_to_DB("admin", "12345", "5555", "shopify", bulk=True, incremental=True)
+    print(retry_failed(write_to_db, "failed items"))
+
+    or from the command line:
+
+    python dead_letter.py stats
+    python dead_letter.py retry-failed --tables variants images
+"""
+
+from json_backend import dumps, loads
+from sqlalchemy import text
+from collections import Counter
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Iterator, Optional
+import argparse
+import glob
+import gzip
+import os
+
+# the tables in the order their rows are loaded again, a variant references its product
+TABLES = ("products", "variants", "images")
+# the column telling which of a stored and a spooled row is newer, None to never replace a stored row
+UPDATED_AT_COLUMNS = {"products": None, "variants": "variant_updated_at", "images": "updated_at"}
+
+
+class Dead_Letter_Spool:
+    """
+    A buffered, rotating, and compressed spool of the rows that failed to write.
+
+    Attributes:
+        directory (str): The directory of the segments.
+        buffer_size (int): The maximum number of rows kept in memory before they are flushed.
+        segment_bytes (int): The size from which a new segment is started.
+        spooled (Counter): The number of rows spooled by table.
+        reasons (Counter): The number of rows spooled by table and error message.
+        segments (list): The paths of the segments written.
+    """
+
+    def __init__(self, directory: str = "failed items", buffer_size: int = 1000, segment_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        Initializes the Dead_Letter_Spool class.
+
+        Args:
+            directory (str): The directory of the segments, created if missing.
+            buffer_size (int): The maximum number of rows kept in memory before they are flushed.
+            segment_bytes (int): The size from which a new segment is started.
+        """
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.segment_bytes = segment_bytes
+        self.spooled = Counter()
+        self.reasons = Counter()
+        self.segments = []
+        self.__buffer = []
+        self.__lock = Lock()
+        # the segments of concurrent spools never share a name
+        self.__prefix = f"dead-letters-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}"
+        self.__segment = None
+
+    def add(self, table_name: str, item: dict, store: str = "", error: Optional[BaseException] = None) -> None:
+        """
+        Adds a row that failed to write, flushing the buffer once it is full.
+
+        Args:
+            table_name (str): The name of the table.
+            item (dict): The failed row.
+            store (str): The URL of the store the row was crawled from.
+            error (Optional[BaseException]): The exception raised by the write.
+        """
+        # the database error wrapped by sqlalchemy
+        error = getattr(error, "orig", None) or error
+        reason = str(error).strip().split("\n")[0] if error is not None else None
+        record = {
+            "table": table_name,
+            "store": store,
+            "error": type(error).__name__ if error is not None else None,
+            "reason": reason,
+            "failed_at": datetime.now(timezone.utc).isoformat(),
+            "item": item,
+        }
+        line = dumps(record) + "\n"
+        with self.__lock:
+            if (table_name, reason) not in self.reasons:
+                print(f"dead letter: {table_name}: {reason}")
+            self.spooled[table_name] += 1
+            self.reasons[(table_name, reason)] += 1
+            self.__buffer.append(line)
+            if len(self.__buffer) >= self.buffer_size:
+                self.__flush()
+
+    def flush(self) -> None:
+        """
+        Appends the buffered rows to the current segment.
+        """
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        """
+        Appends the buffered rows to the current segment as one gzip member, the lock being held.
+        """
+        if not self.__buffer:
+            return
+        if self.__segment is None or os.path.getsize(self.__segment) >= self.segment_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+            self.__segment = os.path.join(self.directory, f"{self.__prefix}-{len(self.segments):04d}.jsonl.gz")
+            self.segments.append(self.__segment)
+        with open(self.__segment, "ab") as f:
+            f.write(gzip.compress("".join(self.__buffer).encode("utf-8"), compresslevel=6))
+        self.__buffer = []
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the spooled rows.
+
+        Returns:
+            str: The rows spooled by table and the most frequent errors.
+        """
+        summary = f"{'-'*50}\ndead letters\nrows spooled: {sum(self.spooled.values())}\n"
+        for table_name in TABLES:
+            if self.spooled[table_name]:
+                summary += f"{table_name}: {self.spooled[table_name]}\n"
+        for (table_name, reason), count in self.reasons.most_common(5):
+            summary += f"{count} {table_name}: {reason}\n"
+        if self.segments:
+            summary += 'load them again with "python dead_letter.py retry-failed"\n'
+        return summary + f"{'-'*50}\n"
+
+    def close(self) -> None:
+        """Flushes the buffered rows, the spool can still be added to afterwards."""
+        self.flush()
+
+
+def spool_files(directory: str = "failed items") -> list:
+    """
+    Lists the files of a spool directory.
+
+    Args:
+        directory (str): The directory of the segments.
+
+    Returns:
+        list: The paths of the segments, oldest first, followed by the "{table}.jsonl" files of the previous versions.
+    """
+    segments = sorted(glob.glob(os.path.join(directory, "dead-letters-*.jsonl.gz")))
+    legacy_files = [os.path.join(directory, f"{table_name}.jsonl") for table_name in TABLES]
+    return segments + [path for path in legacy_files if os.path.exists(path)]
+
+
+def read_records(paths: list) -> Iterator[dict]:
+    """
+    Reads the rows of spool files.
+
+    Args:
+        paths (list): The paths of segments or of "{table}.jsonl" files.
+
+    Yields:
+        dict: A record with the table, store, error, reason, failure time, and row, the rows of a
+            "{table}.jsonl" file having no error.
+    """
+    for path in paths:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    yield loads(line)
+        else:
+            table_name = os.path.basename(path)[:-len(".jsonl")]
+            with open(path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        item = loads(line)
+                        yield {"table": table_name, "store": item.get("store") or "", "error": None,
+                               "reason": None, "failed_at": None, "item": item}
+
+
+def spool_stats(directory: str = "failed items") -> str:
+    """
+    Builds the summary of the rows waiting in a spool directory.
+
+    Args:
+        directory (str): The directory of the segments.
+
+    Returns:
+        str: The rows by table, by store, and by error message.
+    """
+    paths = spool_files(directory)
+    tables, stores, reasons = Counter(), Counter(), Counter()
+    for record in read_records(paths):
+        tables[record["table"]] += 1
+        stores[record["store"]] += 1
+        reasons[(record["table"], record["reason"])] += 1
+    summary = f"{'-'*50}\ndead letters in \"{directory}\"\nfiles: {len(paths)}\nrows: {sum(tables.values())}\n"
+    for table_name, count in tables.most_common():
+        summary += f"{table_name}: {count}\n"
+    for store, count in stores.most_common(10):
+        summary += f"{count} from {store or 'no store'}\n"
+    for (table_name, reason), count in reasons.most_common(10):
+        summary += f"{count} {table_name}: {reason}\n"
+    return summary + f"{'-'*50}\n"
+
+
+def stale_ids(write_to_db, table_name: str, items: list) -> set:
+    """
+    Finds the spooled rows older than the rows stored since.
+
+    Args:
+        write_to_db (Write_to_DB): The writer whose database is read.
+        table_name (str): The name of the table.
+        items (list): The spooled rows.
+
+    Returns:
+        set: The ids of the rows whose stored row is newer, or of the products already stored.
+    """
+    column = UPDATED_AT_COLUMNS[table_name]
+    ids = [item.get("id") for item in items]
+    with write_to_db.engine.connect() as connection:
+        if column is None:
+            rows = connection.execute(text(f"SELECT id FROM {table_name} WHERE id = ANY(:ids);"), {"ids": ids}).all()
+        else:
+            # the timestamps are cast like the inserts cast them
+            rows = connection.execute(text(f"""
+                SELECT stored.id FROM {table_name} AS stored
+                JOIN unnest(CAST(:ids AS BIGINT[]), CAST(:updated_ats AS TIMESTAMP[])) AS spooled (id, updated_at) ON stored.id = spooled.id
+                WHERE stored.{column} > spooled.updated_at;
+            """), {"ids": ids, "updated_ats": [item.get(column) for item in items]}).all()
+    return {row.id for row in rows}
+
+
+def retry_failed(write_to_db, directory: str = "failed items", tables: tuple = TABLES, batch_size: int = 5000) -> str:
+    """
+    Loads the spooled rows again through a writer, and removes the files they were read from.
+
+    The rows are loaded table by table, in the order of TABLES, and in batches of
+    one store, so a writer made with bulk=True loads them through COPY. a writer
+    made with incremental=True also upserts the rows that were written since,
+    unless the stored row is newer, see stale_ids. it is run while no crawl
+    spools to the directory, as the files whose rows were all handled are removed.
+
+    Args:
+        write_to_db (Write_to_DB): The writer, its spool receives the rows failing again.
+        directory (str): The directory of the segments.
+        tables (tuple): The tables whose rows are loaded, the others are kept in the spool.
+        batch_size (int): The maximum number of rows of one batch.
+
+    Returns:
+        str: The summary of the rows loaded and of those failing again.
+    """
+    # the rows failing again are spooled after this snapshot, to segments of their own
+    paths = [path for path in spool_files(directory) if path not in write_to_db.spool.segments]
+    spooled_before = Counter(write_to_db.spool.spooled)
+    retried, stale = Counter(), Counter()
+    # the files holding rows of a batch that failed as a whole
+    failed_paths = set()
+    kept = []
+
+    def load(table_name: str, store: str, items: list, sources: list) -> None:
+        try:
+            skipped_ids = stale_ids(write_to_db, table_name, items)
+            fresh_items = [item for item in items if item.get("id") not in skipped_ids]
+            # the rows failing one by one are spooled again, a failure of the whole batch is raised
+            write_to_db.insert_into_table(table_name, fresh_items, store)
+        except Exception as e:
+            print(f"retrying {len(items)} {table_name} rows of {store or 'no store'} failed, their files are kept: {e}")
+            failed_paths.update(sources)
+            return
+        retried[table_name] += len(fresh_items)
+        stale[table_name] += len(items) - len(fresh_items)
+
+    for table_name in TABLES:
+        if table_name not in tables:
+            continue
+        # the rows and the files they were read from, by store
+        batches = {}
+        for path in paths:
+            for record in read_records([path]):
+                if record["table"] != table_name:
+                    continue
+                batch, sources = batches.setdefault(record["store"], ([], []))
+                batch.append(record["item"])
+                sources.append(path)
+                if len(batch) >= batch_size:
+                    load(table_name, record["store"], batch, sources)
+                    batches[record["store"]] = ([], [])
+        for store, (batch, sources) in batches.items():
+            if batch:
+                load(table_name, store, batch, sources)
+    # the rows failing again are on disk before the files they were read from are removed
+    write_to_db.spool.flush()
+
+    for path in paths:
+        if path in failed_paths or any(record["table"] not in tables for record in read_records([path])):
+            # the rows of a failed batch, or of the other tables, are still waiting in this file
+            kept.append(path)
+        elif path.endswith(".gz"):
+            os.remove(path)
+        else:
+            open(path, "w").close()
+
+    failed_again = write_to_db.spool.spooled - spooled_before
+    summary = f"{'-'*50}\nretry failed rows\nfiles read: {len(paths)}\nfiles kept: {len(kept)}\n"
+    for table_name in TABLES:
+        if table_name in tables:
+            summary += (f"{table_name}: {retried[table_name]} retried, {failed_again[table_name]} failed again, "
+                        f"{stale[table_name]} stale skipped\n")
+    return summary + f"{'-'*50}\n"
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+    from save_to_sql_db import Write_to_DB
+
+    parser = argparse.ArgumentParser(description="inspect and load again the rows that failed to write.")
+    parser.add_argument("--directory", default="failed items", help="the directory of the spool.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="count the spooled rows by table, store, and error.")
+    retry_parser = subparsers.add_parser("retry-failed", help="load the spooled rows again through COPY upserts.")
+    retry_parser.add_argument("--tables", nargs="+", choices=TABLES, default=list(TABLES), help="the tables whose rows are loaded.")
+    retry_parser.add_argument("--batch-size", type=int, default=5000, help="the maximum number of rows of one COPY.")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(spool_stats(args.directory))
+    else:
+        db_info = dotenv_values(".env")
+        write_to_db = Write_to_DB(
+            db_info["db_user_name"],
+            db_info["db_password"],
+            db_info["db_port"],
+            db_info["db_name"],
+            bulk=True,
+            incremental=True,
+            host=db_info.get("db_host", "localhost"),
+            spool=Dead_Letter_Spool(args.directory)
+            )
+        print(retry_failed(write_to_db, args.directory, tuple(args.tables), args.batch_size))
+        write_to_db.terminate_connection()
+        print(write_to_db.spool.summary())
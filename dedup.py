@@ -0,0 +1,162 @@
+"""skips the products unchanged since they were last written, by content hash.
+
+through the Content_Hash_Index class it will hash every raw product of a
+page and compare it with the hash stored in the product_hashes table
+when the product was last written. the products whose hash matches are
+dropped before they are validated, serialized, and inserted, and the
+hashes of the written products are stored by `Write_to_DB.write_page`
+in the same transaction as the page.
+
+the stored hashes are read through a bounded LRU cache, so a long
+running worker crawling the same stores again doesn't read them from
+the database every time.
+
+Typical usage example:
+
+    content_hash_index = Content_Hash_Index(write_to_db.engine, cache_size=100_000)
+
+    row_products_list, content_hashes = content_hash_index.filter_page(row_products_list)
+    products_list, variants_list, images_list = extract_page(row_products_list)
+    stored_hashes = write_to_db.write_page(products_list, variants_list, images_list, content_hashes=content_hashes)
+    content_hash_index.remember(stored_hashes)
+
+    print(content_hash_index.summary())
+"""
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import json
+
+
+def content_hash(product: dict) -> bytes:
+    """
+    Hashes a raw product, the same content always gives the same hash whatever the keys order.
+
+    Args:
+        product (dict): The raw product dictionary.
+
+    Returns:
+        bytes: The 16 bytes BLAKE2b digest of the product's canonical JSON.
+    """
+    return hashlib.blake2b(json.dumps(product, sort_keys=True, separators=(",", ":")).encode(), digest_size=16).digest()
+
+
+class Content_Hash_Index:
+    """
+    Looks up the stored content hashes of products through an LRU cache.
+
+    Attributes:
+        engine (Engine): The engine of the target database, every lookup takes its own pooled connection.
+        cache_size (int): The maximum number of hashes kept in memory.
+        hits (int): The number of products skipped because their hash matched.
+        misses (int): The number of new or changed products passed on.
+        cache_hits (int): The number of hashes found in the cache instead of the database.
+    """
+
+    def __init__(self, engine: Engine, cache_size: int = 100_000) -> None:
+        """
+        Initializes the Content_Hash_Index class.
+
+        Args:
+            engine (Engine): The engine of the target database.
+            cache_size (int): The maximum number of hashes kept in memory.
+        """
+        self.engine = engine
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.cache_hits = 0
+        self.__cache = OrderedDict()
+        self.__lock = Lock()
+
+    def filter_page(self, row_products_list: list) -> tuple:
+        """
+        Drops the products of a page whose content is unchanged.
+
+        Args:
+            row_products_list (list): List of raw product dictionaries.
+
+        Returns:
+            tuple: The list of new or changed raw products, and the dict of their hashes by product id.
+        """
+        changed_hashes = self.filter_hashes({product["id"]: content_hash(product) for product in row_products_list})
+        changed_products = [product for product in row_products_list if product["id"] in changed_hashes]
+        return changed_products, changed_hashes
+
+    def filter_hashes(self, content_hashes: dict) -> dict:
+        """
+        Drops the hashes of the products whose content is unchanged.
+
+        Args:
+            content_hashes (dict): The hashes of a page's products by product id.
+
+        Returns:
+            dict: The hashes of the new or changed products by product id.
+        """
+        stored_hashes = self.__lookup(list(content_hashes))
+        changed_hashes = {product_id: product_hash for product_id, product_hash in content_hashes.items()
+                          if stored_hashes.get(product_id) != product_hash}
+        with self.__lock:
+            self.hits += len(content_hashes) - len(changed_hashes)
+            self.misses += len(changed_hashes)
+        return changed_hashes
+
+    def remember(self, content_hashes: dict) -> None:
+        """
+        Caches the hashes of products once they are written.
+
+        Args:
+            content_hashes (dict): The hashes by product id.
+        """
+        with self.__lock:
+            for product_id, product_hash in content_hashes.items():
+                self.__cache[product_id] = product_hash
+                self.__cache.move_to_end(product_id)
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the work avoided.
+
+        Returns:
+            str: The hits, misses, and cache hits counts.
+        """
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"{'-'*50}\ncontent hash index\n"
+            f"products unchanged (hits): {self.hits}\nproducts new or changed (misses): {self.misses}\n"
+            f"hit rate: {hit_rate:.1%}\nhashes read from the cache: {self.cache_hits}\n{'-'*50}\n"
+        )
+
+    def __lookup(self, product_ids: list) -> dict:
+        """
+        Reads the stored hashes of products, from the cache or else the database.
+
+        Args:
+            product_ids (list): The product ids.
+
+        Returns:
+            dict: The stored hashes by product id, products never written are missing.
+        """
+        stored_hashes = {}
+        with self.__lock:
+            for product_id in product_ids:
+                if product_id in self.__cache:
+                    self.__cache.move_to_end(product_id)
+                    stored_hashes[product_id] = self.__cache[product_id]
+            self.cache_hits += len(stored_hashes)
+        missing_ids = [product_id for product_id in product_ids if product_id not in stored_hashes]
+        if missing_ids:
+            with self.engine.connect() as connection:
+                rows = connection.execute(
+                    text("SELECT id, content_hash FROM product_hashes WHERE id = ANY(:ids);"), {"ids": missing_ids}
+                ).all()
+            found = {product_id: bytes(product_hash) for product_id, product_hash in rows}
+            self.remember(found)
+            stored_hashes.update(found)
+        return stored_hashes
@@ -0,0 +1,97 @@
+"""turns the `body_html` of a product into a plain text description.
+
+the clean_description function strips the HTML of a description with a
+few precompiled patterns, each replaced in one scan of the text without
+calling back into python for every match: the comments and the whole
+`<script>` and `<style>` blocks are dropped, the block tags (`<p>`,
+`<br/>`, `<li>`, ...) become a space, and the other tags, with or
+without attributes or self-closing, are removed, so "<b>pro</b>duct"
+stays one word and "</p><p>" separates two. the entities are then
+decoded and every run of whitespace collapsed to one space. the tag
+names match in any case, e.g. `<Br>` and `<P>`.
+
+`max_length` caps the text at a word boundary. the descriptions
+stored by the extractors go through clean_stored_description, whole
+unless set_stored_max_length was called, e.g. by the
+`--description-max-length` option of main.py, before the extraction
+processes are started, so they inherit the cap.
+
+Typical usage example:
+
+    product_description = clean_description(product.get("body_html"))
+    product_summary = clean_description(product.get("body_html"), max_length=300)
+
+    set_stored_max_length(300)
+    product_description = clean_stored_description(product.get("body_html"))
+"""
+
+from html import unescape
+from typing import Optional
+import re
+
+HIDDEN_BLOCKS = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.S | re.I)
+
+BLOCK_TAGS_NAMES = (
+    "address|article|aside|blockquote|br|dd|div|dl|dt|figcaption|figure|footer|h[1-6]|header|hr"
+    "|li|main|nav|ol|p|pre|section|table|tbody|td|tfoot|th|thead|tr|ul"
+)
+
+# every letter of the names matches both cases, re.I would make every scan twice as slow
+BLOCK_TAGS = re.compile(r"</?(?:" + re.sub(r"[a-z]", lambda letter: f"[{letter[0]}{letter[0].upper()}]", BLOCK_TAGS_NAMES) + r")\b[^>]*>")
+
+TAGS = re.compile(r"</?[a-zA-Z][^>]*>")
+
+# the cap of the stored descriptions, None stores them whole
+stored_max_length = None
+
+
+def set_stored_max_length(max_length: Optional[int]) -> None:
+    """
+    Caps the descriptions stored by the extractors.
+
+    Args:
+        max_length (Optional[int]): The maximum number of characters stored, None stores the whole text.
+    """
+    global stored_max_length
+    stored_max_length = max_length
+
+
+def clean_description(description: Optional[str], max_length: Optional[int] = None) -> Optional[str]:
+    """
+    Strips the HTML of a product description.
+
+    Args:
+        description (Optional[str]): The `body_html` of the product.
+        max_length (Optional[int]): The maximum number of characters kept, None keeps the whole text.
+
+    Returns:
+        Optional[str]: The plain text description, None if the description has no text.
+    """
+    if not description:
+        return None
+    if "<" in description:
+        if "<!--" in description or "<s" in description or "<S" in description:
+            description = HIDDEN_BLOCKS.sub(" ", description)
+        description = TAGS.sub("", BLOCK_TAGS.sub(" ", description))
+    if "&" in description:
+        description = unescape(description)
+    # str.split also splits on the no-break spaces of the decoded "&nbsp;"
+    description = " ".join(description.split())
+    if max_length is not None and len(description) > max_length:
+        # the character after the cap tells whether the cut falls inside a word
+        words = description[:max_length + 1].rsplit(" ", 1)[0]
+        description = words if len(words) <= max_length else description[:max_length]
+    return description or None
+
+
+def clean_stored_description(description: Optional[str]) -> Optional[str]:
+    """
+    Strips the HTML of a product description to store, capped if set_stored_max_length was called.
+
+    Args:
+        description (Optional[str]): The `body_html` of the product.
+
+    Returns:
+        Optional[str]: The plain text description, None if the description has no text.
+    """
+    return clean_description(description, stored_max_length)
@@ -0,0 +1,190 @@
+"""caches the validators of the products pages to make conditional requests.
+
+through the Http_Cache class it will keep, for every products page URL,
+the `ETag` and `Last-Modified` headers of its last response together
+with the number of products on the page and the id of the last one. the
+next request of the page sends them back as `If-None-Match` and
+`If-Modified-Since`, and a 304 answer means the page didn't change
+since it was written: it is neither downloaded, parsed, nor written
+again, and the cached products count and last id are enough for the
+pagination to move on to the next page.
+
+the entries of a store are only saved to the cache file once all its
+pages were written, so a crawl that crashes halfway never skips a page
+that was fetched but not stored.
+
+ACCEPT_ENCODING asks the stores for brotli when the `brotli` package is
+installed to decode it, and for gzip otherwise.
+
+Typical usage example:
+
+    http_cache = Http_Cache("http_cache.sqlite")
+    req_handler = Requests_Handler(http_cache=http_cache)
+    ...
+    http_cache.flush(store_products_API)
+    print(http_cache.summary())
+"""
+
+from threading import Lock
+from time import time
+from typing import Optional
+import sqlite3
+
+try:
+    import brotli
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    # the responses couldn't be decoded without it
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class Http_Cache:
+    """
+    A persistent cache of the products pages validators.
+
+    Attributes:
+        path (str): The SQLite file of the cache.
+        not_modified (int): The number of 304 answers.
+        modified (int): The number of pages downloaded.
+        bytes_received (int): The bytes of the downloaded pages as sent by the stores, compressed, chunked ones included.
+    """
+
+    def __init__(self, path: str = "http_cache.sqlite") -> None:
+        """
+        Initializes the Http_Cache class.
+
+        Args:
+            path (str): The SQLite file of the cache, created if missing.
+        """
+        self.path = path
+        self.not_modified = 0
+        self.modified = 0
+        self.bytes_received = 0
+        self.__pending = {}
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    products_count INTEGER NOT NULL,
+                    last_product_id INTEGER,
+                    stored_at REAL NOT NULL
+                );
+            """)
+
+    def conditional_headers(self, url: str) -> dict:
+        """
+        Builds the conditional headers of a page.
+
+        Args:
+            url (str): The page URL.
+
+        Returns:
+            dict: `If-None-Match` and `If-Modified-Since`, empty if the page isn't cached.
+        """
+        entry = self.__entry(url)
+        headers = {}
+        if entry is not None:
+            etag, last_modified = entry[0], entry[1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def not_modified_page(self, url: str) -> Optional[dict]:
+        """
+        Builds the response of a page answered with a 304.
+
+        Args:
+            url (str): The page URL.
+
+        Returns:
+            Optional[dict]: No products, with `not_modified` set and the cached `products_count` and `last_product_id`,
+                None if the page isn't cached, e.g. a store answering a request without validators with a 304,
+                the page must then be requested in full.
+        """
+        entry = self.__entry(url)
+        if entry is None:
+            return None
+        with self.__lock:
+            self.not_modified += 1
+        return {"products": [], "not_modified": True, "products_count": entry[2], "last_product_id": entry[3]}
+
+    def record(self, url: str, headers, products: list, body_size: int = 0) -> None:
+        """
+        Keeps the validators of a downloaded page until its store is flushed.
+
+        Args:
+            url (str): The page URL.
+            headers: The response headers.
+            products (list): The products of the page.
+            body_size (int): The bytes of the response body as received, counted while it was read.
+        """
+        with self.__lock:
+            self.modified += 1
+            self.bytes_received += body_size
+            etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+            # an empty page is the end of a store, it may be filled by new products
+            if (etag or last_modified) and products:
+                self.__pending[url] = (etag, last_modified, len(products), products[-1]["id"])
+
+    def flush(self, store_url: str) -> None:
+        """
+        Saves the validators of a store's pages once they were all written.
+
+        Args:
+            store_url (str): The store URL the pages URLs start with.
+        """
+        with self.__lock:
+            urls = [url for url in self.__pending if url.startswith(store_url)]
+            rows = [(url, *self.__pending.pop(url), time()) for url in urls]
+            with self.__connection:
+                self.__connection.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?);", rows)
+
+    def discard(self, store_url: str) -> None:
+        """
+        Drops the validators of a store whose crawl failed, its pages are downloaded again next time.
+
+        Args:
+            store_url (str): The store URL the pages URLs start with.
+        """
+        with self.__lock:
+            for url in [url for url in self.__pending if url.startswith(store_url)]:
+                del self.__pending[url]
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the requests avoided.
+
+        Returns:
+            str: The 304 and downloaded pages counts and the bytes received.
+        """
+        return (
+            f"{'-'*50}\nhttp cache\npages not modified (304): {self.not_modified}\n"
+            f"pages downloaded: {self.modified}\nbytes received: {self.bytes_received}\n{'-'*50}\n"
+        )
+
+    def close(self) -> None:
+        """
+        Closes the cache file.
+        """
+        self.__connection.close()
+
+    def __entry(self, url: str) -> Optional[tuple]:
+        """
+        Reads the saved entry of a page.
+
+        Args:
+            url (str): The page URL.
+
+        Returns:
+            Optional[tuple]: The etag, last modified, products count, and last product id, None if not cached.
+        """
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT etag, last_modified, products_count, last_product_id FROM pages WHERE url = ?;", (url,)
+            ).fetchone()
@@ -0,0 +1,344 @@
+"""downloads the images of the crawled products into content-addressed storage.
+
+through the Image_Downloader class it will read the images whose asset
+wasn't downloaded yet from the images table, download them
+concurrently with asyncio and aiohttp, bounded by a global limit and a
+per-host limit so no CDN gets more than `per_host_limit` connections at
+once, and record the byte size, SHA-256, and extension of every image
+back into its row, with the src it was downloaded from.
+
+the assets are stored by an Asset_Store under their SHA-256 alone, so
+an image shared by several products or variants, or served under
+several URLs or extensions, is stored once, and the rows whose src
+didn't change since their asset was downloaded are skipped. an image
+whose src changed is downloaded again on the next run, and the images
+that failed are retried.
+
+Typical usage example:
+
+    image_downloader = Image_Downloader(write_to_db.engine, "images", concurrency=32, per_host_limit=8)
+    print(image_downloader.run([store_products_API]))
+
+    or from the command line, with the database in the .env file:
+
+    python image_assets.py --store-dir images --concurrency 32 --per-host 8
+"""
+
+import asyncio
+import aiohttp
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from urllib.parse import urlsplit
+from crawler import Requests_Handler
+from rate_limiting import THROTTLE_STATUSES, SERVER_ERROR_STATUSES, retry_after_seconds, backoff_delay
+from metrics import registry
+from time import perf_counter
+from typing import Optional
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".svg", ".bmp", ".tif", ".tiff", ".heic"}
+
+
+class Asset_Store:
+    """
+    Stores files on disk under their SHA-256, `root/ab/cd/abcd...`.
+
+    the file names carry no extension, so the same bytes served as a
+    .jpg and a .jpeg are one file, the extension is recorded with the
+    rows pointing at it.
+
+    Attributes:
+        root (str): The storage directory.
+    """
+
+    def __init__(self, root: str) -> None:
+        """
+        Initializes the Asset_Store class.
+
+        Args:
+            root (str): The storage directory, created if missing.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """
+        Builds the path of a file.
+
+        Args:
+            digest (str): The hex SHA-256 of the file's content.
+
+        Returns:
+            str: The path, two levels of directories deep so none holds too many files.
+        """
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, body: bytes) -> tuple:
+        """
+        Stores a file unless a file with the same content is stored already.
+
+        The file is written to a temporary file first and renamed, so a
+        crash never leaves a partial file under a digest.
+
+        Args:
+            body (bytes): The file's content.
+
+        Returns:
+            tuple: The hex SHA-256 of the content and whether it was stored already.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(body)
+        os.replace(temporary_path, path)
+        return digest, False
+
+
+def asset_extension(src: str, content_type: Optional[str] = None) -> str:
+    """
+    Picks the extension of an image file.
+
+    Args:
+        src (str): The image URL.
+        content_type (Optional[str]): The Content-Type of its response.
+
+    Returns:
+        str: The extension of the URL's path if it is an image one, else the one of the content type, '' if neither.
+    """
+    extension = os.path.splitext(urlsplit(src).path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return extension
+    if content_type:
+        return mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return ""
+
+
+class Image_Downloader:
+    """
+    Downloads the pending images of the images table into an Asset_Store.
+
+    Attributes:
+        engine (Engine): The engine of the database.
+        asset_store (Asset_Store): Where the images are stored.
+        concurrency (int): The maximum number of downloads at once.
+        per_host_limit (int): The maximum number of connections per host.
+        timeout (float): The timeout of one download in seconds.
+        max_retries (int): The number of attempts per image.
+        batch_size (int): The number of rows read, downloaded, and recorded at a time.
+        downloaded (int): The number of images downloaded.
+        deduplicated (int): The number of them whose content was stored already.
+        failed (int): The number of images that couldn't be downloaded.
+        rows_recorded (int): The number of rows updated with their asset.
+        bytes_downloaded (int): The bytes of the images downloaded.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        store_dir: str = "images",
+        concurrency: int = 32,
+        per_host_limit: int = 8,
+        timeout: float = 60,
+        max_retries: int = 3,
+        batch_size: int = 500,
+    ) -> None:
+        """
+        Initializes the Image_Downloader class.
+
+        Args:
+            engine (Engine): The engine of the database, its images table migrated by schema.MIGRATIONS.
+            store_dir (str): The directory of the Asset_Store.
+            concurrency (int): The maximum number of downloads at once.
+            per_host_limit (int): The maximum number of connections per host, i.e. per CDN.
+            timeout (float): The timeout of one download in seconds.
+            max_retries (int): The number of attempts per image.
+            batch_size (int): The number of rows read, downloaded, and recorded at a time.
+        """
+        self.engine = engine
+        self.asset_store = Asset_Store(store_dir)
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.rows_recorded = 0
+        self.bytes_downloaded = 0
+        self.__seconds = 0.0
+
+    def pending_images(self, stores: Optional[list] = None, after: tuple = ("", -1)) -> list:
+        """
+        Reads a batch of the images whose asset wasn't downloaded from their current src.
+
+        Args:
+            stores (Optional[list]): Only the images of these store URLs, None for all of them.
+            after (tuple): The (store, id) of the last image of the previous batch.
+
+        Returns:
+            list: Up to `batch_size` (store, id, src) tuples, in (store, id) order.
+        """
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(text(f"""
+                SELECT store, id, src FROM images
+                WHERE asset_src IS DISTINCT FROM src AND src IS NOT NULL AND (store, id) > (:store, :id)
+                {"AND store = ANY(:stores)" if stores is not None else ""}
+                ORDER BY store, id LIMIT :limit;
+            """), {"store": after[0], "id": after[1], "stores": stores, "limit": self.batch_size})]
+
+    def record_assets(self, assets: list) -> None:
+        """
+        Records the byte size, SHA-256, extension, and src of downloaded images in their rows.
+
+        Args:
+            assets (list): List of (store, id, src, byte size, hex SHA-256, extension) tuples.
+        """
+        if not assets:
+            return
+        stores, ids, srcs, sizes, digests, extensions = (list(column) for column in zip(*assets))
+        with self.engine.begin() as connection:
+            connection.execute(text("""
+                UPDATE images SET byte_size = assets.byte_size, content_sha256 = assets.content_sha256,
+                                  asset_extension = assets.extension, asset_src = assets.src
+                FROM unnest(CAST(:stores AS VARCHAR[]), CAST(:ids AS BIGINT[]), CAST(:srcs AS VARCHAR[]),
+                            CAST(:sizes AS BIGINT[]), CAST(:digests AS CHAR(64)[]), CAST(:extensions AS VARCHAR[]))
+                    AS assets (store, id, src, byte_size, content_sha256, extension)
+                WHERE images.store = assets.store AND images.id = assets.id;
+            """), {"stores": stores, "ids": ids, "srcs": srcs, "sizes": sizes, "digests": digests, "extensions": extensions})
+        self.rows_recorded += len(assets)
+
+    def run(self, stores: Optional[list] = None) -> str:
+        """
+        Downloads all the pending images and returns the summary.
+
+        Args:
+            stores (Optional[list]): Only the images of these store URLs, None for all of them.
+
+        Returns:
+            str: The summary of the downloads.
+        """
+        start = perf_counter()
+        asyncio.run(self.download_all(stores))
+        self.__seconds += perf_counter() - start
+        return self.summary()
+
+    async def download_all(self, stores: Optional[list] = None) -> None:
+        """
+        Downloads the pending images batch by batch, the images of a batch concurrently.
+
+        Args:
+            stores (Optional[list]): Only the images of these store URLs, None for all of them.
+        """
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        after = ("", -1)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while rows := await asyncio.to_thread(self.pending_images, stores, after):
+                after = rows[-1][:2]
+                # the rows sharing a src are downloaded once
+                rows_by_src = {}
+                for store, image_id, src in rows:
+                    rows_by_src.setdefault(src, []).append((store, image_id))
+                srcs = list(rows_by_src)
+                downloads = await asyncio.gather(*(self.download(session, src) for src in srcs))
+                assets = [
+                    (store, image_id, src, size, digest, extension)
+                    for src, (size, digest, extension) in zip(srcs, downloads) if digest is not None
+                    for store, image_id in rows_by_src[src]
+                ]
+                await asyncio.to_thread(self.record_assets, assets)
+
+    async def download(self, session: aiohttp.ClientSession, src: str) -> tuple:
+        """
+        Downloads an image and stores it.
+
+        The throttling and server error responses are retried with the
+        backoff of the crawlers, up to `max_retries` attempts.
+
+        Args:
+            session (aiohttp.ClientSession): The shared HTTP session.
+            src (str): The image URL, protocol-relative ones are fetched over https.
+
+        Returns:
+            tuple: The byte size, hex SHA-256, and extension of the image, (None, None, None) if it couldn't be downloaded.
+        """
+        url = "https:" + src if src.startswith("//") else src
+        for attempt in range(self.max_retries):
+            retry_after = None
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        body = await response.read()
+                        digest, existed = await asyncio.to_thread(self.asset_store.put, body)
+                        self.downloaded += 1
+                        self.deduplicated += existed
+                        self.bytes_downloaded += len(body)
+                        registry.increment("shopify_image_downloads_total", status=200)
+                        registry.increment("shopify_image_bytes_total", len(body))
+                        return len(body), digest, asset_extension(url, response.headers.get("Content-Type"))
+                    registry.increment("shopify_image_downloads_total", status=response.status)
+                    if response.status not in THROTTLE_STATUSES and response.status not in SERVER_ERROR_STATUSES:
+                        print(f"image error ({response.status}) {url}")
+                        break
+                    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                registry.increment("shopify_image_downloads_total", status="error")
+                print(f"image connection error!! {url}: {e!r}")
+            if attempt + 1 < self.max_retries:
+                await asyncio.sleep(backoff_delay(attempt, retry_after=retry_after))
+        self.failed += 1
+        return None, None, None
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the downloads.
+
+        Returns:
+            str: The images downloaded, deduplicated, and failed, the rows recorded, and the throughput.
+        """
+        megabytes = self.bytes_downloaded / 2**20
+        megabytes_per_second = megabytes / self.__seconds if self.__seconds else 0.0
+        return (
+            f"{'-'*50}\nimage assets\nimages downloaded: {self.downloaded}\nalready stored: {self.deduplicated}\n"
+            f"failed: {self.failed}\nrows recorded: {self.rows_recorded}\n"
+            f"downloaded: {megabytes:.1f} MB ({megabytes_per_second:.1f} MB/s)\n{'-'*50}\n"
+        )
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+    from save_to_sql_db import Write_to_DB
+
+    parser = argparse.ArgumentParser(description="download the pending images of the images table.")
+    parser.add_argument("--store-dir", default="images", help="the directory the images are stored in, by SHA-256.")
+    parser.add_argument("--concurrency", type=int, default=32, help="the maximum number of downloads at once.")
+    parser.add_argument("--per-host", type=int, default=8, help="the maximum number of connections per CDN host.")
+    parser.add_argument("--stores", default=None, help="a JSON list of the stores whose images are downloaded, all of them if omitted.")
+    args = parser.parse_args()
+
+    db_info = dotenv_values(".env")
+    # connecting the writer applies the pending migrations
+    write_to_db = Write_to_DB(
+        db_info["db_user_name"],
+        db_info["db_password"],
+        db_info["db_port"],
+        db_info["db_name"],
+        host=db_info.get("db_host", "localhost")
+        )
+    stores = None
+    if args.stores:
+        with open(args.stores, "r") as f:
+            stores = [Requests_Handler().config_store_url_and_name(store)[0] for store in json.load(f)]
+    image_downloader = Image_Downloader(write_to_db.engine, args.store_dir, args.concurrency, args.per_host)
+    print(image_downloader.run(stores))
+    write_to_db.terminate_connection()
@@ -0,0 +1,107 @@
+"""filters the extracted products of a store down to the ones changed since its last crawl.
+
+through the Incremental_Filter class it will compare the `updated_at`
+values of every product's variants and images with the store's
+high-water mark, drop the products whose variants and images are all
+older than it, and keep track of the newest `updated_at` seen so the
+high-water mark can be advanced once the store is fully crawled.
+
+Typical usage example:
+
+    incremental_filter = Incremental_Filter(write_to_db.get_watermark(store_products_API))
+    products_list, variants_list, images_list = incremental_filter.filter_page(products_list, variants_list, images_list)
+    ...
+    write_to_db.set_watermark(store_products_API, incremental_filter.new_high_water_mark)
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def parse_timestamp(timestamp: Optional[str]) -> Optional[datetime]:
+    """
+    Parses a shopify ISO 8601 timestamp into a timezone-aware datetime.
+
+    Args:
+        timestamp (Optional[str]): The timestamp, naive ones are taken as UTC.
+
+    Returns:
+        Optional[datetime]: The parsed datetime, None if the timestamp is missing or malformed.
+    """
+    if not timestamp:
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class Incremental_Filter:
+    """
+    Keeps only the products of a store that changed since its high-water mark.
+
+    a product counts as changed when any of its variants or images has an
+    `updated_at` at or after the high-water mark, or when none of them has
+    one. shopify's `updated_at` has a one second precision, so a product
+    changed in the second of the high-water mark is kept, and written
+    again as a no-op by the upsert if it didn't change.
+
+    Attributes:
+        high_water_mark (Optional[datetime]): The high-water mark of the store, None keeps every product.
+        new_high_water_mark (Optional[datetime]): The newest `updated_at` seen so far.
+        changed_products (int): The number of products kept.
+        unchanged_products (int): The number of products skipped.
+    """
+
+    def __init__(self, high_water_mark: Optional[datetime]) -> None:
+        """
+        Initializes the Incremental_Filter class.
+
+        Args:
+            high_water_mark (Optional[datetime]): The high-water mark of the store.
+        """
+        self.high_water_mark = high_water_mark
+        self.new_high_water_mark = high_water_mark
+        self.changed_products = 0
+        self.unchanged_products = 0
+
+    def filter_page(self, products_list: list, variants_list: list, images_list: list) -> tuple:
+        """
+        Filters a page of extracted products, variants, and images.
+
+        Args:
+            products_list (list): List of product dicts.
+            variants_list (list): List of variant dicts.
+            images_list (list): List of image dicts.
+
+        Returns:
+            tuple: A tuple containing the three lists with only the changed products and their variants and images.
+        """
+        images_updated_at = {image["id"]: parse_timestamp(image.get("updated_at")) for image in images_list}
+        products_updated_at = {product["id"]: [] for product in products_list}
+        for variant in variants_list:
+            products_updated_at.setdefault(variant["product_id"], []).append(parse_timestamp(variant.get("variant_updated_at")))
+        for product in products_list:
+            products_updated_at[product["id"]].extend(images_updated_at.get(image_id) for image_id in product.get("images_ids") or [])
+
+        changed_ids = set()
+        for product_id, updated_at_list in products_updated_at.items():
+            updated_at_list = [updated_at for updated_at in updated_at_list if updated_at is not None]
+            latest = max(updated_at_list, default=None)
+            if latest is not None and (self.new_high_water_mark is None or latest > self.new_high_water_mark):
+                self.new_high_water_mark = latest
+            if self.high_water_mark is None or latest is None or latest >= self.high_water_mark:
+                changed_ids.add(product_id)
+
+        changed_products_list = [product for product in products_list if product["id"] in changed_ids]
+        changed_images_ids = {image_id for product in changed_products_list for image_id in product.get("images_ids") or []}
+        self.changed_products += len(changed_products_list)
+        self.unchanged_products += len(products_list) - len(changed_products_list)
+        return (
+            changed_products_list,
+            [variant for variant in variants_list if variant["product_id"] in changed_ids],
+            [image for image in images_list if image["id"] in changed_images_ids],
+        )
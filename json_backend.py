@@ -0,0 +1,119 @@
+"""decodes and encodes JSON with the fastest library installed.
+
+the module picks orjson, else msgspec, else the standard json module,
+and exposes it through the module level `loads` and `dumps` functions.
+`loads` decodes the body of a response straight from its bytes, without
+decoding them to a str first, and `dumps` always gives the same compact
+text whatever the backend: no spaces and the non-ASCII characters kept
+as they are. so the JSON columns, compared as text by the incremental
+upserts, don't look changed when the backend does.
+
+the backend can be forced with the `JSON_BACKEND` environment variable,
+or any installed one can be picked with get_backend, e.g. to compare
+them.
+
+Typical usage example:
+
+    json_response = loads(response.content)
+    item["product_tags"] = dumps(item["product_tags"])
+
+    for name in available_backends():
+        backend = get_backend(name)
+        backend.loads(body)
+"""
+
+from typing import Optional
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class Json_Backend:
+    """
+    A JSON library behind the same `loads` and `dumps` functions.
+
+    Attributes:
+        name (str): The library name, "orjson", "msgspec", or "json".
+        loads: Decodes a JSON document from bytes or str, raises ValueError if it isn't valid.
+        dumps: Encodes a value to compact JSON text, keeping the non-ASCII characters.
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Initializes the Json_Backend class.
+
+        Args:
+            name (str): The library name, "orjson", "msgspec", or "json".
+
+        Raises:
+            ValueError: If the library is unknown or not installed.
+        """
+        if name not in available_backends():
+            raise ValueError(f"the {name} JSON backend is not installed, available: {available_backends()}")
+        self.name = name
+        if name == "orjson":
+            self.loads = orjson.loads
+            self.dumps = lambda value: orjson.dumps(value).decode()
+        elif name == "msgspec":
+            self.__decoder = msgspec.json.Decoder()
+            self.__encoder = msgspec.json.Encoder()
+            self.loads = self.__msgspec_loads
+            self.dumps = lambda value: self.__encoder.encode(value).decode()
+        else:
+            self.loads = json.loads
+            self.dumps = lambda value: json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    def __msgspec_loads(self, data):
+        """
+        Decodes a JSON document with msgspec.
+
+        Args:
+            data: The document, bytes or str.
+
+        Returns:
+            The decoded value.
+
+        Raises:
+            ValueError: If the document isn't valid JSON, msgspec's own errors don't derive from it.
+        """
+        try:
+            return self.__decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+def available_backends() -> list:
+    """
+    Lists the installed JSON backends, fastest first.
+
+    Returns:
+        list: The names of the installed backends.
+    """
+    return [name for name, module in (("orjson", orjson), ("msgspec", msgspec)) if module is not None] + ["json"]
+
+
+def get_backend(name: Optional[str] = None) -> Json_Backend:
+    """
+    Builds a JSON backend.
+
+    Args:
+        name (Optional[str]): The library name, None for the `JSON_BACKEND` environment variable or else the fastest installed.
+
+    Returns:
+        Json_Backend: The backend.
+    """
+    return Json_Backend(name or os.environ.get("JSON_BACKEND") or available_backends()[0])
+
+
+backend = get_backend()
+loads = backend.loads
+dumps = backend.dumps
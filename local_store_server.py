@@ -0,0 +1,382 @@
+"""serves synthetic shopify stores over HTTP for local crawling runs.
+
+through the Local_Store_Server class it will start a threaded HTTP
+server that answers `products.json` requests for any number of fake
+stores, so the crawlers can be exercised without hitting live shopify
+stores. each store lives under its own path prefix ending in ".com"
+so that `Requests_Handler.config_store_url_and_name` can parse it.
+
+the server can also throttle like a real storefront: `script_responses`
+queues status codes (e.g. 429 with a `Retry-After`) returned to the
+next requests, and `max_requests_per_second` answers 429 to a store's
+requests beyond that rate. `latency` delays every response to mimic the
+network, and `supports_since_id` decides whether the stores honor the
+`since_id` cursor or, like many storefronts, ignore it. `max_in_flight`
+keeps the highest number of requests served at once, to check the
+concurrency limits of the crawlers.
+
+every page is sent with an `ETag` and a `Last-Modified` header, answered
+with a 304 when the request's `If-None-Match` matches, and gzipped when
+the request accepts it, so the conditional requests of an Http_Cache
+can be tried locally; `bytes_sent` counts the bodies sent. with
+`send_content_length` off the pages have no `Content-Length`, their end
+is the end of the connection, like a chunked response.
+
+Typical usage example:
+
+    server = Local_Store_Server(stores_count=5, products_per_store=600)
+    server.start()
+    stores_list = server.stores_urls()
+    ...
+    server.script_responses([(429, "2"), (503, None)])
+    server.stop()
+
+    or from the command line:
+
+    python local_store_server.py --port 8765 --stores 5 --products 600
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread, Lock
+from collections import deque
+from time import monotonic, sleep
+from email.utils import formatdate
+import argparse
+import gzip
+import hashlib
+import json
+
+
+def make_product(product_id: int, store_name: str, variants_count: int = 3, images_count: int = 2) -> dict:
+    """
+    Builds a synthetic product dictionary shaped like a shopify `products.json` item.
+
+    Args:
+        product_id (int): The id of the product, variants and images ids are derived from it.
+        store_name (str): The name of the store used as the product vendor.
+        variants_count (int): The number of variants of the product.
+        images_count (int): The number of images of the product.
+
+    Returns:
+        dict: The raw product dictionary.
+    """
+    variants = [
+        {
+            "id": product_id * 100 + i,
+            "product_id": product_id,
+            "title": f"Size {i}",
+            "price": f"{19.99 + i:.2f}",
+            "compare_at_price": f"{29.99 + i:.2f}" if i % 2 else None,
+            "sku": f"SKU-{product_id}-{i}",
+            "created_at": "2024-01-01T10:00:00-05:00",
+            "updated_at": "2024-06-01T10:00:00-05:00",
+            "available": bool(i % 3),
+        }
+        for i in range(variants_count)
+    ]
+    images = [
+        {
+            "id": product_id * 100 + 50 + i,
+            "created_at": "2024-01-01T10:00:00-05:00",
+            "updated_at": "2024-06-01T10:00:00-05:00",
+            "variant_ids": [variants[i % variants_count]["id"]] if variants_count else [],
+            "src": f"https://cdn.shopify.com/s/files/{store_name}/{product_id}_{i}.jpg",
+            "width": 1000,
+            "height": 1200,
+        }
+        for i in range(images_count)
+    ]
+    return {
+        "id": product_id,
+        "title": f"Product {product_id}",
+        "handle": f"product-{product_id}",
+        "body_html": f"<p>Description of <strong>product {product_id}</strong>.</p>",
+        "published_at": "2024-01-01T10:00:00-05:00",
+        "created_at": "2024-01-01T10:00:00-05:00",
+        "updated_at": "2024-06-01T10:00:00-05:00",
+        "vendor": store_name,
+        "product_type": "Apparel",
+        "tags": ["synthetic", store_name],
+        "options": [{"name": "Size", "position": 1, "values": [v["title"] for v in variants]}],
+        "variants": variants,
+        "images": images,
+    }
+
+
+class Local_Store_Server:
+    """
+    A threaded HTTP server serving synthetic shopify stores.
+
+    Attributes:
+        stores_count (int): The number of stores served.
+        products_per_store (int): The number of products each store has.
+        host (str): The interface the server binds to.
+        port (int): The port the server listens on, 0 picks a free port.
+        requests_count (int): The number of requests served so far.
+        in_flight (int): The number of requests being served.
+        max_in_flight (int): The highest number of requests served at once.
+        max_requests_per_second (float): A store's requests beyond this rate get a 429, None never throttles.
+        latency (float): Seconds every response is delayed by.
+        supports_since_id (bool): Whether the `since_id` parameter is honored or ignored.
+        statuses_count (dict): The number of responses sent per status code.
+        bytes_sent (int): The bytes of the response bodies sent, compressed.
+        last_modified (str): The `Last-Modified` of all the pages, the time the server was created.
+        send_content_length (bool): Whether the pages are sent with a `Content-Length`.
+    """
+
+    def __init__(
+        self,
+        stores_count: int = 3,
+        products_per_store: int = 600,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_requests_per_second: float = None,
+        latency: float = 0,
+        supports_since_id: bool = True,
+        send_content_length: bool = True,
+    ) -> None:
+        """
+        Initializes the Local_Store_Server class.
+
+        Args:
+            stores_count (int): The number of stores to serve.
+            products_per_store (int): The number of products each store has.
+            host (str): The interface to bind to.
+            port (int): The port to listen on, 0 picks a free port.
+            max_requests_per_second (float): A store's requests beyond this rate get a 429, None never throttles.
+            latency (float): Seconds every response is delayed by.
+            supports_since_id (bool): Whether the `since_id` parameter is honored or ignored.
+            send_content_length (bool): Whether the pages are sent with a `Content-Length`, else they end with the connection.
+        """
+        self.stores_count = stores_count
+        self.products_per_store = products_per_store
+        self.host = host
+        self.requests_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.max_requests_per_second = max_requests_per_second
+        self.latency = latency
+        self.supports_since_id = supports_since_id
+        self.send_content_length = send_content_length
+        self.statuses_count = {}
+        self.bytes_sent = 0
+        self.last_modified = formatdate(usegmt=True)
+        self.__scripted_responses = deque()
+        self.__requests_times = {}
+        self.__lock = Lock()
+        self.__httpd = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.port = self.__httpd.server_address[1]
+        self.__thread = None
+
+    def stores_urls(self) -> list:
+        """
+        Returns the URLs of the served stores in the `stores_to_scrape.json` format.
+
+        Returns:
+            list: List of store URLs.
+        """
+        return [f"http://{self.host}:{self.port}/store{i}.com" for i in range(self.stores_count)]
+
+    def products_page(self, store_index: int, page_number: int, limit: int) -> list:
+        """
+        Builds one page of products for a store.
+
+        Args:
+            store_index (int): The index of the store.
+            page_number (int): The 1-based page number.
+            limit (int): The number of products per page.
+
+        Returns:
+            list: List of raw product dictionaries, empty past the last page.
+        """
+        first = (page_number - 1) * limit
+        last = min(first + limit, self.products_per_store)
+        base_id = (store_index + 1) * 10_000_000
+        return [make_product(base_id + i, f"store{store_index}") for i in range(first, last)]
+
+    def products_after(self, store_index: int, since_id: int, limit: int) -> list:
+        """
+        Builds the page of products of a store whose ids follow `since_id`.
+
+        Args:
+            store_index (int): The index of the store.
+            since_id (int): The id of the last product already fetched.
+            limit (int): The number of products per page.
+
+        Returns:
+            list: List of raw product dictionaries, in ascending id order.
+        """
+        base_id = (store_index + 1) * 10_000_000
+        first = max(since_id - base_id + 1, 0)
+        last = min(first + limit, self.products_per_store)
+        return [make_product(base_id + i, f"store{store_index}") for i in range(first, last)]
+
+    def script_responses(self, responses: list) -> None:
+        """
+        Queues error responses returned, in order, to the next products requests.
+
+        Args:
+            responses (list): List of (status code, Retry-After header or None) tuples.
+        """
+        with self.__lock:
+            self.__scripted_responses.extend(responses)
+
+    def next_error(self, store: str) -> tuple:
+        """
+        Decides whether a products request gets an error response.
+
+        Args:
+            store (str): The store path of the request.
+
+        Returns:
+            tuple: The (status code, Retry-After header) of the error, None to serve the page.
+        """
+        with self.__lock:
+            if self.__scripted_responses:
+                return self.__scripted_responses.popleft()
+            if self.max_requests_per_second:
+                now = monotonic()
+                requests_times = self.__requests_times.setdefault(store, deque())
+                while requests_times and now - requests_times[0] >= 1:
+                    requests_times.popleft()
+                if len(requests_times) >= self.max_requests_per_second:
+                    return (429, "1")
+                requests_times.append(now)
+        return None
+
+    def count_status(self, status: int) -> None:
+        """
+        Counts a response sent.
+
+        Args:
+            status (int): The status code of the response.
+        """
+        with self.__lock:
+            self.statuses_count[status] = self.statuses_count.get(status, 0) + 1
+
+    def count_request(self, change: int) -> None:
+        """
+        Counts a request starting or ending.
+
+        Args:
+            change (int): 1 when the request starts, -1 when its response was sent.
+        """
+        with self.__lock:
+            if change > 0:
+                self.requests_count += 1
+            self.in_flight += change
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def start(self) -> None:
+        """Starts serving in a background daemon thread."""
+        self.__thread = Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def serve_forever(self) -> None:
+        """Serves in the calling thread until interrupted."""
+        self.__httpd.serve_forever()
+
+    def stop(self) -> None:
+        """Stops the server and releases its socket."""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __make_handler(self) -> type:
+        """
+        Builds the request handler class bound to this server.
+
+        Returns:
+            type: A `BaseHTTPRequestHandler` subclass.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                server.count_request(1)
+                try:
+                    self.serve_products()
+                finally:
+                    server.count_request(-1)
+
+            def serve_products(self) -> None:
+                if server.latency:
+                    sleep(server.latency)
+                url = urlsplit(self.path)
+                store, _, endpoint = url.path.strip("/").partition("/")
+                if endpoint != "products.json" or not store.startswith("store") or not store.endswith(".com"):
+                    server.count_status(404)
+                    self.send_error(404)
+                    return
+                error = server.next_error(store)
+                if error is not None:
+                    status, retry_after = error
+                    server.count_status(status)
+                    self.send_response(status)
+                    if retry_after is not None:
+                        self.send_header("Retry-After", retry_after)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                query = parse_qs(url.query)
+                store_index = int(store[len("store"):-len(".com")])
+                page_number = int(query.get("page", ["1"])[0])
+                limit = int(query.get("limit", ["30"])[0])
+                if "since_id" in query and server.supports_since_id:
+                    products = server.products_after(store_index, int(query["since_id"][0]), limit)
+                else:
+                    products = server.products_page(store_index, page_number, limit)
+                body = json.dumps({"products": products}).encode()
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.count_status(304)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                server.count_status(200)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", server.last_modified)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=5)
+                    self.send_header("Content-Encoding", "gzip")
+                if server.send_content_length:
+                    self.send_header("Content-Length", str(len(body)))
+                else:
+                    self.close_connection = True
+                self.end_headers()
+                # counted before the client can finish reading it
+                server.bytes_sent += len(body)
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="serve synthetic shopify stores locally.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stores", type=int, default=3)
+    parser.add_argument("--products", type=int, default=600)
+    parser.add_argument("--max-rps", type=float, default=None, help="answer 429 to a store's requests beyond this rate.")
+    parser.add_argument("--latency", type=float, default=0, help="seconds every response is delayed by.")
+    parser.add_argument("--no-since-id", action="store_true", help="ignore the since_id parameter like many storefronts.")
+    args = parser.parse_args()
+
+    server = Local_Store_Server(
+        args.stores,
+        args.products,
+        port=args.port,
+        max_requests_per_second=args.max_rps,
+        latency=args.latency,
+        supports_since_id=not args.no_since_id,
+    )
+    print(json.dumps(server.stores_urls(), indent=4))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
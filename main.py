@@ -1,81 +1,400 @@
 from crawler import Requests_Handler
+from rate_limiting import Host_Rate_Limiter, Fetch_Error
 from scraper import Products_Data_Extractors
-from save_to_sql_db import Write_to_DB
+from save_to_sql_db import Write_to_DB, Pooled_Writer
+from schema import Schema_Manager
+from sinks import get_sink
+from incremental_filter import Incremental_Filter
+from pagination import paginate
+from dedup import Content_Hash_Index
+from price_history import Variant_History
+from http_cache import Http_Cache
+from streaming import Streamed_Page
+from metrics import registry, profiler, Metrics_Server, Metrics_Dumper
+from description_cleaning import set_stored_max_length
 from dotenv import load_dotenv, dotenv_values
+from threading import Event
+from typing import Optional
+import argparse
 import os
 import json
 
-if __name__ == "__main__":
-    # Load database credentials from .env file
-    db_info = dotenv_values(".env")
 
-    # Initialize instances for data extraction, request handling, and database insertion
-    p_d_extractors = Products_Data_Extractors()
-    req_handler = Requests_Handler()
-    write_to_db = Write_to_DB(
-        db_info["db_user_name"], 
-        db_info["db_password"], 
-        db_info["db_port"], 
-        db_info["db_name"]
-        )
-    
-    # Load list of stores to scrape from JSON file
-    with open("stores_to_scrape.json", "r") as f:
-        stores_list = json.load(f)
-    
+def crawl_stores_serially(
+    stores_list: list,
+    req_handler: Requests_Handler,
+    p_d_extractors: Products_Data_Extractors,
+    write_to_db: Write_to_DB,
+    pagination: str = "page",
+    prefetch: bool = False,
+    resume: bool = False,
+    content_hash_index: Content_Hash_Index = None,
+    stop: Optional[Event] = None,
+) -> str:
+    """
+    Crawls the stores one at a time and one page at a time.
+
+    every page is written together with its store's checkpoint, so with
+    `resume` the stores already done are skipped and the others continue
+    after their last stored page. once `stop` is set no other page is
+    written, and the store being crawled is left in progress.
+
+    Args:
+        stores_list (list): List of store URLs.
+        req_handler (Requests_Handler): Makes the requests to the stores.
+        p_d_extractors (Products_Data_Extractors): Extracts the products, variants, and images from a page.
+        write_to_db (Write_to_DB): Writes the extracted data to the database, or a sinks.File_Sink to files.
+        pagination (str): "page" to follow page numbers, "since_id" to follow cursors.
+        prefetch (bool): Fetch the next page while the current one is being processed.
+        resume (bool): Continue from the stores checkpoints instead of starting over.
+        content_hash_index (Content_Hash_Index): Skips the products unchanged since they were written, None writes them all.
+        stop (Optional[Event]): Stops the crawl once set, e.g. when the lease of a distributed worker is lost.
+
+    Returns:
+        str: The scraping summary of all the stores.
+    """
     all_stores_scraping_summary = ""
-    # Iterate over each store in the list 
-    for store in stores_list: 
+    checkpoints = write_to_db.get_checkpoints() if resume else {}
+    # Iterate over each store in the list
+    for store_index, store in enumerate(stores_list):
         # Configure the store's URL and name
-        store_products_API, store_name = req_handler.config_store_url_and_name(store) 
-        
-        print(f"\nstores index: <<{stores_list.index(store)+1}: {len(stores_list)}>>")
+        store_products_API, store_name = req_handler.config_store_url_and_name(store)
+
+        print(f"\nstores index: <<{store_index+1}: {len(stores_list)}>>")
         store_url_str = f"store: {store_name}\nurl: {store_products_API}"
         print(store_url_str)
-        
-        page_number = 1
-        # Iterate through paginated product lists
-        
-        # tracks the number of products scraped from a store
+
+        # a resumed crawl starts after the store's last stored page
+        checkpoint = checkpoints.get(store_products_API, {"last_page": 0, "last_product_id": None, "status": "in_progress"})
+        if checkpoint["status"] == "done":
+            print("already crawled, skipping.")
+            all_stores_scraping_summary += f"{'-'*50}\n{store_products_API}\nalready crawled: {checkpoint['last_page']} pages\n{'-'*50}\n"
+            continue
+        write_to_db.start_checkpoint(store_products_API, checkpoint["last_page"], checkpoint["last_product_id"])
+
+        # tracks the number of pages and products scraped from a store
+        pages_scraped = checkpoint["last_page"]
         total_products = 0
-        
-        while True:
-            # Configure the URL for the current page and fetch product data
-            store_products_API_paginated = req_handler.config_store_products_url(store_products_API, page_number)
-            json_response = req_handler.fetch_products_list(store_products_API_paginated)
-            row_products_list = json_response["products"]
-            
-            # Check if products are available on the page
-            if len(row_products_list) > 0:
-                # Extract product data and prepare for database insertion
-                products_list, variants_list, images_list = p_d_extractors.get_products_data_sql(row_products_list)
-                
+
+        # in incremental mode only the products changed since the last crawl are written
+        if write_to_db.incremental:
+            incremental_filter = Incremental_Filter(write_to_db.get_watermark(store_products_API))
+
+        # Iterate through paginated product lists, the pagination stops after the last page
+        try:
+            pages = paginate(req_handler, store_products_API, pagination, prefetch,
+                             last_page=checkpoint["last_page"], last_product_id=checkpoint["last_product_id"])
+            for page_number, row_products_list in pages:
+                if stop is not None and stop.is_set():
+                    # the store is resumed from its checkpoint by whoever crawls it next
+                    pages.close()
+                    print(f"crawl stopped before page {page_number}.")
+                    return all_stores_scraping_summary + f"{'-'*50}\n{store_products_API}\nstopped before page {page_number}\n{'-'*50}\n"
                 # counting the scraped products
-                total_products += len(products_list)
-                
-                # Insert extracted data into database tables
-                write_to_db.insert_into_table("products", products_list)
-                write_to_db.insert_into_table("variants", variants_list)
-                write_to_db.insert_into_table("images", images_list)
-                
+                total_products += len(row_products_list)
+                last_product_id = row_products_list[-1]["id"]
+
+                if isinstance(row_products_list, Streamed_Page):
+                    # a streamed page was extracted while it was downloaded
+                    (products_list, variants_list, images_list), content_hashes = row_products_list.extracted_lists(content_hash_index)
+                else:
+                    # drop the products whose content didn't change since they were written
+                    content_hashes = None
+                    if content_hash_index is not None:
+                        row_products_list, content_hashes = content_hash_index.filter_page(row_products_list)
+
+                    # Extract product data and prepare for database insertion
+                    products_list, variants_list, images_list = p_d_extractors.get_products_data_sql(row_products_list)
+
+                if write_to_db.incremental:
+                    products_list, variants_list, images_list = incremental_filter.filter_page(products_list, variants_list, images_list)
+
+                # Insert extracted data into database tables, committed with the store's checkpoint
+                stored_hashes = write_to_db.write_page(products_list, variants_list, images_list, store_products_API, page_number,
+                                                       last_product_id, content_hashes)
+                if content_hash_index is not None:
+                    content_hash_index.remember(stored_hashes)
+
                 # Clear data lists for the next page of products
                 p_d_extractors.empty_all_lists()
-                
+
                 print(f"current page: {page_number}")
-                page_number += 1
-                
-            else:
-                # save store scraping data to store summary
-                all_stores_scraping_summary += f"{'-'*50}\n{store_products_API}\npages scraped: {page_number}\nproducts scraped: {total_products}\n{'-'*50}\n"
-                # Exit pagination if no products are found on the current page
-                break
-        # Clear console output (for Windows systems)
-        os.system("cls")
-        
+                pages_scraped = page_number
+        except Fetch_Error as e:
+            # give up on this store, it is crawled again on the next run
+            print(e)
+            write_to_db.finish_checkpoint(store_products_API, "failed")
+            if req_handler.http_cache is not None:
+                req_handler.http_cache.discard(store_products_API)
+            all_stores_scraping_summary += f"{'-'*50}\n{store_products_API}\nfailed at page {pages_scraped + 1}: {e}\n{'-'*50}\n"
+            continue
+
+        # save store scraping data to store summary
+        write_to_db.finish_checkpoint(store_products_API, "done")
+        # the pages validators are only kept once all the store's pages are stored
+        if req_handler.http_cache is not None:
+            req_handler.http_cache.flush(store_products_API)
+        all_stores_scraping_summary += f"{'-'*50}\n{store_products_API}\n"
+        if checkpoint["last_page"]:
+            all_stores_scraping_summary += f"resumed after page: {checkpoint['last_page']}\n"
+        all_stores_scraping_summary += f"pages scraped: {pages_scraped}\nproducts scraped: {total_products}\n"
+        if write_to_db.incremental:
+            all_stores_scraping_summary += f"products unchanged: {incremental_filter.unchanged_products}\n"
+            if incremental_filter.new_high_water_mark is not None:
+                write_to_db.set_watermark(store_products_API, incremental_filter.new_high_water_mark)
+        all_stores_scraping_summary += f"{'-'*50}\n"
+    return all_stores_scraping_summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="scrape shopify stores into a PostgreSQL database.")
+    parser.add_argument("--engine", choices=["serial", "async", "pipeline"], default="serial",
+                        help="crawl the stores one at a time (serial), concurrently (async), "
+                             "or overlap fetching, extraction, and writing (pipeline).")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="async engine: maximum number of requests in flight across all stores.")
+    parser.add_argument("--per-host", type=int, default=2,
+                        help="async engine: maximum number of requests in flight to one host.")
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="pipeline engine: maximum number of pages waiting between two stages.")
+    parser.add_argument("--extract-workers", type=int, default=0,
+                        help="async and pipeline engines: number of processes extracting the pages, 0 uses a thread.")
+    parser.add_argument("--max-rate", type=float, default=10,
+                        help="highest number of requests per second sent to one host, the rate adapts below it.")
+    parser.add_argument("--max-retries", type=int, default=6,
+                        help="number of attempts for a page before its store is skipped.")
+    parser.add_argument("--pagination", choices=["page", "since_id"], default="page",
+                        help="follow page numbers, or since_id cursors falling back to page numbers where a store ignores them.")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="serial and pipeline engines: fetch the next page while the current one is being processed.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="write each page through COPY into staging tables instead of one INSERT per row.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only write the products changed since the last crawl of each store, upserting them.")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the stores done by the last run and continue the others after their last stored page.")
+    parser.add_argument("--distributed", choices=["coordinator", "worker"], default=None,
+                        help="coordinator: queue the stores in the crawl_queue table and exit, "
+                             "worker: claim and crawl stores from the queue until it is empty, on any number of machines.")
+    parser.add_argument("--worker-id", default=None,
+                        help="worker: the id recorded on the claimed stores, the host name and process id by default.")
+    parser.add_argument("--lease-seconds", type=float, default=60,
+                        help="worker: seconds a claimed store stays leased without a heartbeat before another worker takes it over.")
+    parser.add_argument("--dedup", action="store_true",
+                        help="skip the products whose content hash matches the one stored when they were last written.")
+    parser.add_argument("--http-cache", default=None, metavar="PATH",
+                        help="keep the ETag/Last-Modified of every page in this SQLite file and request the pages conditionally, "
+                             "pages answered with a 304 are neither parsed nor written.")
+    parser.add_argument("--dedup-cache-size", type=int, default=100_000,
+                        help="maximum number of content hashes kept in memory.")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse and extract every page while it is downloaded, one product at a time, "
+                             "so neither the whole body nor the raw products of a page are held in memory. "
+                             "the async engine reads the pages whole when --extract-workers is set.")
+    parser.add_argument("--db-pool-size", type=int, default=1,
+                        help="write through this many database connections, the async engine writes on all of them at once.")
+    parser.add_argument("--batch-pages", type=int, default=1,
+                        help="commit the pages written every this many pages, together with the stores' checkpoints.")
+    parser.add_argument("--batch-seconds", type=float, default=None,
+                        help="also commit the pages written once the open transaction is this many seconds old.")
+    parser.add_argument("--sink", choices=["postgres", "parquet", "jsonl"], default="postgres",
+                        help="where the pages are written: the database, or parquet / zstd-compressed jsonl files "
+                             "partitioned by store and crawl date under --output-dir.")
+    parser.add_argument("--output-dir", default=None,
+                        help="parquet and jsonl sinks: the directory the products, variants, and images tables are written under, "
+                             '"crawl output/{sink}" by default.')
+    parser.add_argument("--row-group-size", type=int, default=100_000,
+                        help="parquet sink: the number of rows of a row group.")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve the fetch, extract, and write metrics on this port, /metrics for prometheus and /metrics.json.")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help='the interface --metrics-port listens on, "0.0.0.0" to let other machines scrape it.')
+    parser.add_argument("--metrics-file", default=None, metavar="PATH",
+                        help="dump the metrics as JSON to this file every --metrics-interval seconds.")
+    parser.add_argument("--metrics-interval", type=float, default=10,
+                        help="seconds between two dumps of --metrics-file.")
+    parser.add_argument("--profile", default=None, metavar="STAGES",
+                        help='profile the comma-separated stages, "fetch", "extract", and "write", or "all".')
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile",
+                        help="the profiler of --profile, pyinstrument needs the pyinstrument package.")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="the directory the --profile reports are written to.")
+    parser.add_argument("--description-max-length", type=int, default=None, metavar="N",
+                        help="store the product descriptions capped to N characters, cut at a word boundary, "
+                             "they are stored whole by default.")
+    parser.add_argument("--download-images", default=None, metavar="DIR",
+                        help="after the crawl, download the images not downloaded yet into DIR, stored once per content by SHA-256, "
+                             "and record their byte size and checksum in the images table.")
+    parser.add_argument("--image-concurrency", type=int, default=32,
+                        help="the maximum number of image downloads at once.")
+    parser.add_argument("--image-per-host", type=int, default=8,
+                        help="the maximum number of connections to one image CDN host.")
+    parser.add_argument("--price-history", action="store_true",
+                        help="append the variants whose price, compare at price, or availability changed since they were "
+                             "last seen to the variant_history table, partitioned by month.")
+    parser.add_argument("--price-history-cache-size", type=int, default=1_000_000,
+                        help="maximum number of variants last states kept in memory.")
+    parser.add_argument("--preflight", action="store_true",
+                        help="before crawling, normalize and deduplicate the stores list, resolve the stores that moved to their new "
+                             "domain, and skip the dead ones, with the checks cached for --preflight-ttl hours.")
+    parser.add_argument("--preflight-cache", default="preflight_cache.sqlite", metavar="PATH",
+                        help="the SQLite file of the preflight checks.")
+    parser.add_argument("--preflight-ttl", type=float, default=24,
+                        help="hours a preflight check is reused before the store is checked again.")
+    args = parser.parse_args()
+    if args.sink != "postgres" and (args.incremental or args.dedup or args.resume or args.download_images or args.price_history
+                                    or args.distributed == "worker"):
+        parser.error("--incremental, --dedup, --resume, --download-images, --price-history, and --distributed worker need the database, "
+                     "they can't be used with a file sink.")
+
+    if args.profile:
+        stages = ["fetch", "extract", "write"] if args.profile == "all" else args.profile.split(",")
+        if not set(stages) <= {"fetch", "extract", "write"}:
+            parser.error(f"--profile takes fetch, extract, and write, or all, not {args.profile}")
+        try:
+            profiler.configure(stages, args.profiler, args.profile_dir)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.description_max_length is not None:
+        if args.description_max_length < 1:
+            parser.error("--description-max-length takes a positive number of characters")
+        # set before the extraction processes are started, they inherit it
+        set_stored_max_length(args.description_max_length)
+
+    # Load database credentials from .env file
+    db_info = dotenv_values(".env")
+
+    # Load list of stores to scrape from JSON file
+    with open("stores_to_scrape.json", "r") as f:
+        stores_list = json.load(f)
+
+    preflight_summary = ""
+    if args.preflight:
+        from preflight import Store_Preflight
+        store_preflight = Store_Preflight(args.preflight_cache, args.preflight_ttl)
+        stores_list = store_preflight.run(stores_list)
+        store_preflight.close()
+        preflight_summary = store_preflight.summary()
+        print(preflight_summary)
+
+    if args.distributed == "coordinator":
+        from work_queue import Work_Queue
+        work_queue = Work_Queue(db_info["db_user_name"], db_info["db_password"], db_info["db_port"], db_info["db_name"],
+                                host=db_info.get("db_host", "localhost"))
+        print(f"queued {work_queue.enqueue(stores_list)} stores, start the workers with: python main.py --distributed worker")
+        work_queue.terminate_connection()
+        raise SystemExit
+
+    # Initialize instances for data extraction, request handling, and database insertion
+    p_d_extractors = Products_Data_Extractors()
+    http_cache = Http_Cache(args.http_cache) if args.http_cache else None
+    req_handler = Requests_Handler(Host_Rate_Limiter(max_rate=args.max_rate), max_retries=args.max_retries, http_cache=http_cache,
+                                   stream=args.stream, stream_content_hashes=args.dedup)
+    variant_history = Variant_History(args.price_history_cache_size) if args.price_history else None
+    if args.sink != "postgres":
+        try:
+            write_to_db = get_sink(args.sink, args.output_dir or os.path.join("crawl output", args.sink), **({"row_group_size": args.row_group_size} if args.sink == "parquet" else {}))
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.db_pool_size > 1:
+        write_to_db = Pooled_Writer(
+            db_info["db_user_name"],
+            db_info["db_password"],
+            db_info["db_port"],
+            db_info["db_name"],
+            pool_size=args.db_pool_size,
+            bulk=args.bulk,
+            incremental=args.incremental,
+            host=db_info.get("db_host", "localhost"),
+            batch_pages=args.batch_pages,
+            batch_seconds=args.batch_seconds,
+            variant_history=variant_history
+            )
+    else:
+        write_to_db = Write_to_DB(
+            db_info["db_user_name"],
+            db_info["db_password"],
+            db_info["db_port"],
+            db_info["db_name"],
+            bulk=args.bulk,
+            incremental=args.incremental,
+            host=db_info.get("db_host", "localhost"),
+            batch_pages=args.batch_pages,
+            batch_seconds=args.batch_seconds,
+            variant_history=variant_history
+            )
+
+    content_hash_index = Content_Hash_Index(write_to_db.engine, args.dedup_cache_size) if args.dedup else None
+
+    # creating a store's partition waits for the open transactions of the other connections, so it is done before they start,
+    # the workers create the partitions of the stores they claim from the queue when they start their checkpoints
+    if args.sink == "postgres" and args.distributed != "worker":
+        Schema_Manager(write_to_db.engine).create_partitions([req_handler.config_store_url_and_name(store)[0] for store in stores_list])
+
+    def crawl(stores_list: list, resume: bool, stop: Optional[Event] = None) -> str:
+        """Crawls the stores with the chosen engine and returns the scraping summary."""
+        if args.engine == "async":
+            from async_crawler import Async_Crawl_Engine
+            engine = Async_Crawl_Engine(write_to_db, max_concurrency=args.concurrency, per_host_limit=args.per_host,
+                                        req_handler=req_handler, extract_workers=args.extract_workers, resume=resume,
+                                        content_hash_index=content_hash_index, stop=stop)
+            return engine.run(stores_list)
+        elif args.engine == "pipeline":
+            from pipeline import Page_Pipeline
+            pipeline = Page_Pipeline(req_handler, write_to_db, queue_size=args.queue_size, extract_workers=args.extract_workers,
+                                     pagination=args.pagination, prefetch=args.prefetch, resume=resume,
+                                     content_hash_index=content_hash_index, stop=stop)
+            return pipeline.run(stores_list)
+        return crawl_stores_serially(stores_list, req_handler, p_d_extractors, write_to_db,
+                                     args.pagination, args.prefetch, resume, content_hash_index, stop)
+
+    def crawl_claimed_store(store: str, resume: bool, stop: Event) -> tuple:
+        """Crawls a store claimed from the work queue, returns its scraping summary and whether it is done."""
+        summary = crawl([store], resume or args.resume, stop)
+        checkpoint = write_to_db.get_checkpoints().get(req_handler.config_store_url_and_name(store)[0], {})
+        return summary, checkpoint.get("status") == "done"
+
+    metrics_server = Metrics_Server(registry, args.metrics_port, args.metrics_host) if args.metrics_port is not None else None
+    if metrics_server is not None:
+        metrics_server.start()
+        print(f"serving the metrics on http://{args.metrics_host}:{metrics_server.port}/metrics")
+    metrics_dumper = Metrics_Dumper(registry, args.metrics_file, args.metrics_interval) if args.metrics_file else None
+    if metrics_dumper is not None:
+        metrics_dumper.start()
+
+    if args.distributed == "worker":
+        from work_queue import Work_Queue, run_worker, default_worker_id
+        work_queue = Work_Queue(db_info["db_user_name"], db_info["db_password"], db_info["db_port"], db_info["db_name"],
+                                host=db_info.get("db_host", "localhost"), lease_seconds=args.lease_seconds)
+        # a store taken over from a dead worker, or given back after a failure, resumes from its checkpoint
+        all_stores_scraping_summary = run_worker(work_queue, args.worker_id or default_worker_id(), crawl_claimed_store)
+        work_queue.terminate_connection()
+    else:
+        all_stores_scraping_summary = crawl(stores_list, args.resume)
+    all_stores_scraping_summary += preflight_summary
+    if content_hash_index is not None:
+        all_stores_scraping_summary += content_hash_index.summary()
+    if variant_history is not None:
+        all_stores_scraping_summary += variant_history.summary()
+    if http_cache is not None:
+        all_stores_scraping_summary += http_cache.summary()
+        http_cache.close()
+    if args.download_images:
+        from image_assets import Image_Downloader
+        image_downloader = Image_Downloader(write_to_db.engine, args.download_images, args.image_concurrency, args.image_per_host)
+        all_stores_scraping_summary += image_downloader.run([req_handler.config_store_url_and_name(store)[0] for store in stores_list])
+
     # Terminate database connection and end HTTP session
     write_to_db.terminate_connection()
+    all_stores_scraping_summary += write_to_db.summary()
     req_handler.end_session()
-    
+
+    all_stores_scraping_summary += registry.summary() + profiler.dump()
+    if metrics_dumper is not None:
+        metrics_dumper.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+
     print('scraping is concluded successfully.')
     print(f"scraping summary:\n{all_stores_scraping_summary}")
-    print('*please empty the .jsonl files in the "filed items" folder before the running the scraper again.')
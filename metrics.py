@@ -0,0 +1,541 @@
+"""counts and times the fetch, extract, and write stages of a crawl.
+
+through the Metrics_Registry class every stage records its counters and
+latencies, labelled by status code or table, in the process-wide
+`registry`:
+
+    shopify_fetch_seconds                histogram of the requests latency
+    shopify_fetch_responses_total        responses by status code
+    shopify_fetch_decoded_bytes_total    bytes of the decoded bodies
+    shopify_fetch_errors_total           connection and decoding errors
+    shopify_extract_seconds              histogram of the pages extraction time
+    shopify_extract_records_total        records extracted by table
+    shopify_write_seconds                histogram of the pages write time
+    shopify_write_rows_total             rows committed by table
+    shopify_write_failures_total         rows saved to "failed items/" by table
+    shopify_commit_seconds               histogram of the commits latency
+    shopify_image_downloads_total        image downloads by status code
+    shopify_image_bytes_total            bytes of the images downloaded
+
+the metrics are served in the prometheus text format by a
+Metrics_Server, `/metrics`, and as JSON, `/metrics.json`, or dumped to
+a JSON file every few seconds by a Metrics_Dumper, where the counters
+also carry their average rate per second since the start, e.g. the
+records/sec of the extraction.
+
+the Stage_Profiler runs the calls of the chosen stages under cProfile,
+or pyinstrument when installed, and writes one report per stage when
+dumped. it is off until configured, the `profiled` decorator adds the
+profiling to a stage's function and `timed` its latency histogram too. the
+pages extracted by worker processes are timed and counted by the
+parent process but not profiled.
+
+Typical usage example:
+
+    profiler.configure(["fetch", "write"], "cprofile", "profiles")
+    metrics_server = Metrics_Server(registry, port=9100)
+    metrics_server.start()
+
+    @timed("write")
+    def write_page(self, store: str, extracted_lists: tuple) -> dict:
+        ...
+        registry.increment("shopify_write_rows_total", len(items), table=table_name)
+
+    print(profiler.dump())
+    metrics_server.stop()
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Event, get_ident, local
+from time import perf_counter, monotonic
+from functools import wraps
+from typing import Optional
+import cProfile
+import io
+import json
+import os
+import pstats
+
+try:
+    import pyinstrument
+except ImportError:
+    # the pyinstrument profiler is only available with pyinstrument installed
+    pyinstrument = None
+
+# the upper bounds of the histograms buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRICS_HELP = {
+    "shopify_fetch_seconds": "Latency of the products pages requests.",
+    "shopify_fetch_responses_total": "Responses received, by status code.",
+    "shopify_fetch_decoded_bytes_total": "Bytes of the response bodies once decompressed, not the bytes received.",
+    "shopify_fetch_errors_total": "Requests failed on a connection or decoding error.",
+    "shopify_extract_seconds": "Time spent extracting the pages into records.",
+    "shopify_extract_records_total": "Records extracted, by table.",
+    "shopify_write_seconds": "Time spent writing the pages.",
+    "shopify_write_rows_total": "Rows committed, by table, without the rows that failed.",
+    "shopify_write_failures_total": "Rows that failed to write and were saved to the failed items files, by table.",
+    "shopify_commit_seconds": "Latency of the write transactions commits.",
+    "shopify_image_downloads_total": "Image downloads, by status code.",
+    "shopify_image_bytes_total": "Bytes of the images downloaded.",
+}
+
+
+class Histogram:
+    """
+    The cumulative buckets, count, sum, and maximum of observed values.
+
+    Attributes:
+        buckets (list): The count of the values under or at every bound of LATENCY_BUCKETS.
+        count (int): The number of values observed.
+        sum (float): Their sum.
+        max (float): The largest one.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the Histogram class.
+        """
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Adds a value.
+
+        Args:
+            value (float): The value, in seconds.
+        """
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+
+class Metrics_Registry:
+    """
+    Holds the counters and histograms of the process, safe to update from any thread.
+
+    Attributes:
+        started_at (float): The `monotonic` time the registry was created, for the rates.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the Metrics_Registry class.
+        """
+        self.started_at = monotonic()
+        self.__counters = {}
+        self.__histograms = {}
+        self.__lock = Lock()
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): The counter's name.
+            value (float): The amount added.
+            **labels: The labels of the counter, e.g. status=200.
+        """
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Adds a value to a histogram.
+
+        Args:
+            name (str): The histogram's name.
+            value (float): The value, in seconds.
+            **labels: The labels of the histogram.
+        """
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self.__lock:
+            if key not in self.__histograms:
+                self.__histograms[key] = Histogram()
+            self.__histograms[key].observe(value)
+
+    def as_dict(self) -> dict:
+        """
+        Takes a snapshot of the metrics.
+
+        Returns:
+            dict: The uptime, the counters with their rate per second, and the histograms count, sum, average, and maximum.
+        """
+        uptime = monotonic() - self.started_at
+        with self.__lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value, "per_sec": round(value / uptime, 2) if uptime else 0.0}
+                for (name, labels), value in sorted(self.__counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(labels), "count": histogram.count, "sum": round(histogram.sum, 6),
+                    "avg": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0, "max": round(histogram.max, 6),
+                }
+                for (name, labels), histogram in sorted(self.__histograms.items())
+            ]
+        return {"uptime_seconds": round(uptime, 3), "counters": counters, "histograms": histograms}
+
+    def prometheus_text(self) -> str:
+        """
+        Formats the metrics in the prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        lines = []
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            histograms = sorted((key, (list(histogram.buckets), histogram.count, histogram.sum)) for key, histogram in self.__histograms.items())
+        described = set()
+        for (name, labels), value in counters:
+            if name not in described:
+                lines += [f"# HELP {name} {METRICS_HELP.get(name, name)}", f"# TYPE {name} counter"]
+                described.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, count, total) in histograms:
+            if name not in described:
+                lines += [f"# HELP {name} {METRICS_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                described.add(name)
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the metrics.
+
+        Returns:
+            str: Every counter with its rate, and every histogram's count, average, and maximum.
+        """
+        snapshot = self.as_dict()
+        lines = [f"{'-'*50}", "metrics", f"uptime: {snapshot['uptime_seconds']:.1f} s"]
+        for counter in snapshot["counters"]:
+            lines.append(f"{counter['name']}{format_labels(tuple(counter['labels'].items()))}: {counter['value']:.15g} ({counter['per_sec']}/s)")
+        for histogram in snapshot["histograms"]:
+            lines.append(
+                f"{histogram['name']}{format_labels(tuple(histogram['labels'].items()))}: {histogram['count']} calls, "
+                f"{histogram['avg'] * 1000:.1f} ms average, {histogram['max'] * 1000:.1f} ms max"
+            )
+        return "\n".join(lines) + f"\n{'-'*50}\n"
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Formats labels the prometheus way.
+
+    Args:
+        labels (tuple): The (label, value) pairs.
+
+    Returns:
+        str: The labels in braces, empty if there are none.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def record_extraction(extracted_lists: tuple, seconds: Optional[float] = None) -> None:
+    """
+    Counts the records of an extracted page.
+
+    Args:
+        extracted_lists (tuple): The products, variants, and images lists of the page.
+        seconds (Optional[float]): The time the extraction took, None if it was done while the page was downloaded.
+    """
+    for table_name, items_list in zip(("products", "variants", "images"), extracted_lists):
+        registry.increment("shopify_extract_records_total", len(items_list), table=table_name)
+    if seconds is not None:
+        registry.observe("shopify_extract_seconds", seconds)
+
+
+class Metrics_Server:
+    """
+    Serves the metrics over HTTP from a background thread.
+
+    `/metrics` answers in the prometheus text format, `/metrics.json` with the JSON snapshot.
+
+    Attributes:
+        registry (Metrics_Registry): The metrics served.
+        port (int): The port listened on.
+    """
+
+    def __init__(self, registry: Metrics_Registry, port: int = 9100, host: str = "127.0.0.1") -> None:
+        """
+        Initializes the Metrics_Server class.
+
+        Args:
+            registry (Metrics_Registry): The metrics served.
+            port (int): The port to listen on, 0 for a free one.
+            host (str): The interface to listen on, the local one by default, "0.0.0.0" for all of them.
+        """
+        self.registry = registry
+        self.__httpd = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.port = self.__httpd.server_address[1]
+        self.__thread = None
+
+    def start(self) -> None:
+        """Starts serving in a background daemon thread."""
+        self.__thread = Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stops the server and releases its socket."""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __make_handler(self) -> type:
+        """
+        Builds the request handler class bound to this server.
+
+        Returns:
+            type: A `BaseHTTPRequestHandler` subclass.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == "/metrics":
+                    body = server.registry.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(server.registry.as_dict()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+class Metrics_Dumper(Thread):
+    """
+    Writes the JSON snapshot of the metrics to a file every `interval` seconds, replacing the previous one.
+
+    Attributes:
+        registry (Metrics_Registry): The metrics dumped.
+        path (str): The JSON file.
+        interval (float): Seconds between two dumps.
+    """
+
+    def __init__(self, registry: Metrics_Registry, path: str, interval: float = 10) -> None:
+        """
+        Initializes the Metrics_Dumper class.
+
+        Args:
+            registry (Metrics_Registry): The metrics dumped.
+            path (str): The JSON file.
+            interval (float): Seconds between two dumps.
+        """
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.__stopped = Event()
+
+    def run(self) -> None:
+        """Dumps the metrics until stopped."""
+        while not self.__stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self) -> None:
+        """Writes the snapshot, through a temporary file so a reader never sees half of it."""
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.registry.as_dict(), f, indent=4)
+        os.replace(self.path + ".tmp", self.path)
+
+    def stop(self) -> None:
+        """Stops the thread after a last dump."""
+        self.__stopped.set()
+        self.join()
+        self.dump()
+
+
+class Stage_Profiler:
+    """
+    Profiles the calls of the chosen stages, one profiler per stage and thread.
+
+    Attributes:
+        stages (set): The names of the stages profiled, empty when profiling is off.
+        backend (str): "cprofile" or "pyinstrument".
+        output_dir (str): The directory the reports are written to.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the Stage_Profiler class, off until configured.
+        """
+        self.stages = set()
+        self.backend = "cprofile"
+        self.output_dir = "profiles"
+        self.__profilers = {}
+        self.__lock = Lock()
+        # the stage a thread is profiling, a call nested in it isn't profiled on its own
+        self.__active = local()
+
+    def configure(self, stages: list, backend: str = "cprofile", output_dir: str = "profiles") -> None:
+        """
+        Chooses the stages to profile.
+
+        Args:
+            stages (list): The stages names, "fetch", "extract", and "write".
+            backend (str): "cprofile" or "pyinstrument".
+            output_dir (str): The directory the reports are written to.
+
+        Raises:
+            ValueError: If pyinstrument is asked for but isn't installed.
+        """
+        if backend == "pyinstrument" and pyinstrument is None:
+            raise ValueError("the pyinstrument profiler needs the pyinstrument package")
+        self.stages = set(stages)
+        self.backend = backend
+        self.output_dir = output_dir
+
+    def start(self, stage: str):
+        """
+        Starts profiling a call of a stage in this thread.
+
+        Args:
+            stage (str): The stage's name.
+
+        Returns:
+            The started profiler, None if the stage isn't profiled or this thread is already profiling a call.
+        """
+        if stage not in self.stages or getattr(self.__active, "stage", None) is not None:
+            return None
+        key = (stage, get_ident())
+        with self.__lock:
+            if key not in self.__profilers:
+                self.__profilers[key] = cProfile.Profile() if self.backend == "cprofile" else pyinstrument.Profiler()
+            stage_profiler = self.__profilers[key]
+        self.__active.stage = stage
+        if self.backend == "cprofile":
+            stage_profiler.enable()
+        else:
+            stage_profiler.start()
+        return stage_profiler
+
+    def stop(self, stage_profiler) -> None:
+        """
+        Stops profiling the call started with `start`.
+
+        Args:
+            stage_profiler: The profiler `start` returned.
+        """
+        if stage_profiler is None:
+            return
+        if self.backend == "cprofile":
+            stage_profiler.disable()
+        else:
+            stage_profiler.stop()
+        self.__active.stage = None
+
+    def dump(self) -> str:
+        """
+        Writes the report of every profiled stage, merging its threads.
+
+        cProfile writes `{stage}.pstats`, for pstats or snakeviz, and `{stage}.txt`
+        with the 30 functions of highest cumulative time. pyinstrument writes
+        `{stage}.html` and `{stage}.txt` for every thread.
+
+        Returns:
+            str: The summary of the reports written.
+        """
+        with self.__lock:
+            profilers = dict(self.__profilers)
+        if not profilers:
+            return ""
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = []
+        for stage in sorted({stage for stage, _ in profilers}):
+            stage_profilers = [stage_profiler for (profiled_stage, _), stage_profiler in profilers.items() if profiled_stage == stage]
+            if self.backend == "cprofile":
+                stats = pstats.Stats(stage_profilers[0])
+                for stage_profiler in stage_profilers[1:]:
+                    stats.add(stage_profiler)
+                stats.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+                text = io.StringIO()
+                stats.stream = text
+                stats.sort_stats("cumulative").print_stats(30)
+                with open(os.path.join(self.output_dir, f"{stage}.txt"), "w", encoding="utf-8") as f:
+                    f.write(text.getvalue())
+                paths += [os.path.join(self.output_dir, f"{stage}.pstats"), os.path.join(self.output_dir, f"{stage}.txt")]
+            else:
+                for index, stage_profiler in enumerate(stage_profilers):
+                    name = stage if len(stage_profilers) == 1 else f"{stage}-{index}"
+                    with open(os.path.join(self.output_dir, f"{name}.html"), "w", encoding="utf-8") as f:
+                        f.write(stage_profiler.output_html())
+                    with open(os.path.join(self.output_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                        f.write(stage_profiler.output_text())
+                    paths += [os.path.join(self.output_dir, f"{name}.html"), os.path.join(self.output_dir, f"{name}.txt")]
+        return f"{'-'*50}\nprofiles\n" + "\n".join(paths) + f"\n{'-'*50}\n"
+
+
+def profiled(stage: str):
+    """
+    Decorates a stage's function to profile its calls when the stage is profiled.
+
+    Args:
+        stage (str): The stage's name, "fetch", "extract", or "write".
+
+    Returns:
+        The decorator.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stage_profiler = profiler.start(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.stop(stage_profiler)
+        return wrapper
+    return decorator
+
+
+def timed(stage: str):
+    """
+    Decorates a stage's function to time its calls in `shopify_{stage}_seconds`, and profile them when the stage is profiled.
+
+    Args:
+        stage (str): The stage's name, "extract" or "write".
+
+    Returns:
+        The decorator.
+    """
+    histogram = f"shopify_{stage}_seconds"
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stage_profiler = profiler.start(stage)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.observe(histogram, perf_counter() - start)
+                profiler.stop(stage_profiler)
+        return wrapper
+    return decorator
+
+
+registry = Metrics_Registry()
+profiler = Stage_Profiler()
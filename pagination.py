@@ -0,0 +1,252 @@
+"""walks the pages of a store's `products.json` endpoint.
+
+through the Page_Number_Pagination and Since_Id_Pagination classes it
+will yield the pages of products of a store one after another, stopping
+as soon as a page comes back with fewer products than the `limit` asked
+for, instead of requesting one extra empty page per store.
+
+Page_Number_Pagination follows `?limit=250&page=N`. Since_Id_Pagination
+follows `?limit=250&since_id=<last id>`, which doesn't get slower for
+deep pages, and falls back to page numbers on the first page that shows
+the store ignores `since_id`. pages answered with a 304 by a
+Requests_Handler with an `http_cache` are not yielded, the pagination
+moves past them with their cached products count and last product id.
+wrapping either in prefetch_pages fetches
+page N+1 in a background thread while page N is being processed. both
+can start after a given page, to resume a store from its checkpoint.
+
+Typical usage example:
+
+    pages = paginate(req_handler, store_products_API, strategy="since_id", prefetch=True)
+    for page_number, row_products_list in pages:
+        ...
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from crawler import Requests_Handler
+
+
+class Page_Number_Pagination:
+    """
+    Yields the pages of a store following page numbers.
+
+    Attributes:
+        req_handler (Requests_Handler): Makes the requests.
+        store_products_API (str): The store URL.
+        limit (int): The number of products asked per page.
+        requests_count (int): The number of requests made.
+        last_page (int): The last page already crawled, the pages start after it.
+    """
+
+    def __init__(self, req_handler: Requests_Handler, store_products_API: str, limit: int = 250, last_page: int = 0) -> None:
+        """
+        Initializes the Page_Number_Pagination class.
+
+        Args:
+            req_handler (Requests_Handler): Makes the requests.
+            store_products_API (str): The store URL.
+            limit (int): The number of products asked per page.
+            last_page (int): The last page already crawled, 0 starts from the first page.
+        """
+        self.req_handler = req_handler
+        self.store_products_API = store_products_API
+        self.limit = limit
+        self.last_page = last_page
+        self.requests_count = 0
+
+    def __iter__(self):
+        """
+        Yields the pages of the store.
+
+        Yields:
+            tuple: The page number, starting after `last_page`, and the list of raw product dictionaries.
+        """
+        yield from self._pages_by_number(self.last_page + 1)
+
+    def _fetch(self, url: str) -> dict:
+        """
+        Fetches a page of products.
+
+        Args:
+            url (str): The page URL.
+
+        Returns:
+            dict: The json response, flagged `not_modified` for a page answered with a 304.
+        """
+        self.requests_count += 1
+        return self.req_handler.fetch_products_list(url)
+
+    def is_last_page(self, row_products_list: list) -> bool:
+        """
+        Tells whether a page is the last one.
+
+        Args:
+            row_products_list (list): The page of products.
+
+        Returns:
+            bool: True if the page has fewer products than `limit`.
+        """
+        return len(row_products_list) < self.limit
+
+    def _pages_by_number(self, page_number: int):
+        """
+        Yields the pages of the store from a page number on.
+
+        Args:
+            page_number (int): The first page to fetch.
+
+        Yields:
+            tuple: The page number and the list of raw product dictionaries.
+        """
+        while True:
+            json_response = self._fetch(self.req_handler.config_store_products_url(self.store_products_API, page_number, self.limit))
+            if json_response.get("not_modified"):
+                # unchanged since it was written, the page is skipped
+                if json_response["products_count"] < self.limit:
+                    return
+                page_number += 1
+                continue
+            row_products_list = json_response["products"]
+            if len(row_products_list) == 0:
+                return
+            yield page_number, row_products_list
+            if self.is_last_page(row_products_list):
+                return
+            page_number += 1
+
+
+class Since_Id_Pagination(Page_Number_Pagination):
+    """
+    Yields the pages of a store following `since_id` cursors, falling back to page numbers.
+
+    a page answers the cursor when all its ids are ascending and greater
+    than the `since_id` asked, otherwise the store ignored the parameter
+    and the remaining pages are walked by page number.
+
+    Attributes:
+        since_id (int): The id of the last product already crawled.
+        cursor_supported (bool): None until known, then whether the store honors `since_id`.
+    """
+
+    def __init__(
+        self,
+        req_handler: Requests_Handler,
+        store_products_API: str,
+        limit: int = 250,
+        last_page: int = 0,
+        since_id: int = 0,
+    ) -> None:
+        """
+        Initializes the Since_Id_Pagination class.
+
+        Args:
+            req_handler (Requests_Handler): Makes the requests.
+            store_products_API (str): The store URL.
+            limit (int): The number of products asked per page.
+            last_page (int): The last page already crawled, 0 starts from the first page.
+            since_id (int): The id of the last product of that page.
+        """
+        super().__init__(req_handler, store_products_API, limit, last_page)
+        self.since_id = since_id
+        self.cursor_supported = None
+
+    def __iter__(self):
+        """
+        Yields the pages of the store.
+
+        Yields:
+            tuple: The page number, starting after `last_page`, and the list of raw product dictionaries.
+        """
+        since_id = self.since_id
+        page_number = self.last_page + 1
+        if since_id == 0 and page_number > 1:
+            # no cursor to resume from
+            yield from self._pages_by_number(page_number)
+            return
+        while True:
+            json_response = self._fetch(self.req_handler.config_store_products_cursor_url(self.store_products_API, since_id, self.limit))
+            if json_response.get("not_modified"):
+                # unchanged since it was written, the page is skipped
+                if json_response["products_count"] < self.limit:
+                    return
+                if json_response["last_product_id"] <= since_id:
+                    # the cached page didn't move the cursor, the store ignores since_id
+                    self.cursor_supported = False
+                    break
+                since_id = json_response["last_product_id"]
+                page_number += 1
+                continue
+            row_products_list = json_response["products"]
+            if len(row_products_list) == 0:
+                return
+            ids = [product["id"] for product in row_products_list]
+            if ids[0] <= since_id or any(a >= b for a, b in zip(ids, ids[1:])):
+                self.cursor_supported = False
+                break
+            if since_id > 0:
+                self.cursor_supported = True
+            yield page_number, row_products_list
+            if self.is_last_page(row_products_list):
+                return
+            since_id = ids[-1]
+            page_number += 1
+
+        # the store ignores since_id, so this page is the store's first page
+        if since_id == 0:
+            yield page_number, row_products_list
+            if self.is_last_page(row_products_list):
+                return
+            page_number += 1
+        yield from self._pages_by_number(page_number)
+
+
+def prefetch_pages(pages):
+    """
+    Fetches the next page in a background thread while the current one is processed.
+
+    Args:
+        pages: An iterator of pages.
+
+    Yields:
+        The pages of the iterator, in order.
+    """
+    pages = iter(pages)
+    executor = ThreadPoolExecutor(1)
+    try:
+        future = executor.submit(next, pages, None)
+        while (page := future.result()) is not None:
+            future = executor.submit(next, pages, None)
+            yield page
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def paginate(
+    req_handler: Requests_Handler,
+    store_products_API: str,
+    strategy: str = "page",
+    prefetch: bool = False,
+    limit: int = 250,
+    last_page: int = 0,
+    last_product_id: int = None,
+):
+    """
+    Builds the pages iterator of a store.
+
+    Args:
+        req_handler (Requests_Handler): Makes the requests.
+        store_products_API (str): The store URL.
+        strategy (str): "page" for page numbers, "since_id" for cursors.
+        prefetch (bool): Fetch page N+1 while page N is being processed.
+        limit (int): The number of products asked per page.
+        last_page (int): The last page already crawled, 0 starts from the first page.
+        last_product_id (int): The id of the last product of that page, the cursor to resume from.
+
+    Returns:
+        An iterator of (page number, list of raw product dictionaries) tuples.
+    """
+    if strategy == "since_id":
+        pages = Since_Id_Pagination(req_handler, store_products_API, limit, last_page, last_product_id or 0)
+    else:
+        pages = Page_Number_Pagination(req_handler, store_products_API, limit, last_page)
+    return prefetch_pages(pages) if prefetch else iter(pages)
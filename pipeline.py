@@ -0,0 +1,462 @@
+"""overlaps fetching, extraction, and database writes with a three-stage pipeline.
+
+through the Page_Pipeline class it will run a fetch stage, a transform
+stage, and a write stage in their own threads, connected by bounded
+queues. a full queue blocks the stage feeding it, so a slow database
+throttles fetching instead of piling pages up in memory. an error in
+any stage stops the whole pipeline and is raised again by `run`.
+
+the transform stage extracts the pages itself, or hands them to a pool
+of `extract_workers` processes and keeps up to twice that many pages in
+flight, so the JSON to records transformation runs on all the cores.
+
+every page is written together with its store's checkpoint, and with
+`resume` the stores already done are skipped and the others are fetched
+from the page after their last stored one. once `stop` is set no other
+page is fetched or written, and the store being crawled is left in
+progress.
+
+with a `content_hash_index` the transform stage drops the products whose
+content didn't change since they were written before extracting them.
+the pages of a streaming `req_handler` were already extracted by the
+fetch stage while they were downloaded, and are only filtered here.
+
+the throughput of every stage and the depth of every queue are kept in
+Stage_Stats objects, printed every `stats_interval` seconds and added to
+the scraping summary, so the bottleneck stage can be spotted.
+
+Typical usage example:
+
+    pipeline = Page_Pipeline(req_handler, write_to_db, queue_size=4, extract_workers=4)
+    all_stores_scraping_summary = pipeline.run(stores_list)
+"""
+
+from crawler import Requests_Handler
+from scraper import extract_page
+from streaming import Streamed_Page
+from save_to_sql_db import Write_to_DB
+from incremental_filter import Incremental_Filter
+from rate_limiting import Fetch_Error
+from pagination import paginate
+from dedup import Content_Hash_Index
+from metrics import record_extraction
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+from queue import Queue, Empty, Full
+from threading import Thread, Event, current_thread
+from time import perf_counter
+from typing import Optional
+
+
+def timed_extract_page(row_products_list: list) -> tuple:
+    """
+    Extracts a page in a worker process and measures how long it took.
+
+    Args:
+        row_products_list (list): List of raw product dictionaries.
+
+    Returns:
+        tuple: The `extract_page` tuple of the page and the seconds spent extracting it.
+    """
+    start = perf_counter()
+    extracted_lists = extract_page(row_products_list)
+    return extracted_lists, perf_counter() - start
+
+
+class Stage_Stats:
+    """
+    Throughput counters of a pipeline stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        items (int): The number of pages processed.
+        busy_seconds (float): The time spent processing, excluding waits on the queues.
+        queue (Queue): The input queue of the stage, None for the first stage.
+    """
+
+    def __init__(self, name: str, queue: Queue = None) -> None:
+        """
+        Initializes the Stage_Stats class.
+
+        Args:
+            name (str): The name of the stage.
+            queue (Queue): The input queue of the stage.
+        """
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.queue = queue
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the stage.
+
+        Returns:
+            dict: The pages processed, busy time, pages per busy second, and input queue depth.
+        """
+        return {
+            "stage": self.name,
+            "pages": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "pages_per_sec": round(self.items / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+        }
+
+    def __str__(self) -> str:
+        stats = self.as_dict()
+        return f"{stats['stage']:<9} pages: {stats['pages']:<6} pages/sec: {stats['pages_per_sec']:<8} queue depth: {stats['queue_depth']}"
+
+
+class Page_Pipeline:
+    """
+    Crawls stores through concurrent fetch, transform, and write stages.
+
+    Attributes:
+        req_handler (Requests_Handler): Makes the requests to the stores, used by the fetch stage only apart from its `http_cache`.
+        write_to_db (Write_to_DB): Writes the pages, used by the write stage only.
+        queue_size (int): The maximum number of pages waiting between two stages.
+        stats_interval (float): Seconds between two stats printouts, 0 disables them.
+        extract_workers (int): Number of processes extracting the pages, 0 extracts them in the transform thread.
+        pagination (str): "page" to follow page numbers, "since_id" to follow cursors.
+        prefetch (bool): Whether the fetch stage fetches the next page in the background.
+        resume (bool): Whether the stores continue from their checkpoints instead of starting over.
+        content_hash_index (Content_Hash_Index): Skips the unchanged products in the transform stage, None keeps them all.
+        stop (Optional[Event]): Stops the crawl once set, e.g. when the lease of a distributed worker is lost.
+        stats (list): The Stage_Stats of the fetch, transform, and write stages.
+    """
+
+    def __init__(
+        self,
+        req_handler: Requests_Handler,
+        write_to_db: Write_to_DB,
+        queue_size: int = 4,
+        stats_interval: float = 10,
+        extract_workers: int = 0,
+        pagination: str = "page",
+        prefetch: bool = False,
+        resume: bool = False,
+        content_hash_index: Content_Hash_Index = None,
+        stop: Optional[Event] = None,
+    ) -> None:
+        """
+        Initializes the Page_Pipeline class.
+
+        Args:
+            req_handler (Requests_Handler): Makes the requests to the stores.
+            write_to_db (Write_to_DB): Writes the pages.
+            queue_size (int): The maximum number of pages waiting between two stages.
+            stats_interval (float): Seconds between two stats printouts, 0 disables them.
+            extract_workers (int): Number of processes extracting the pages, 0 extracts them in the transform thread.
+            pagination (str): "page" to follow page numbers, "since_id" to follow cursors.
+            prefetch (bool): Fetch the next page in the background while the current one is queued.
+            resume (bool): Continue from the stores checkpoints instead of starting over.
+            content_hash_index (Content_Hash_Index): Skips the products unchanged since they were written, None keeps them all.
+            stop (Optional[Event]): Stops the crawl once set.
+        """
+        self.req_handler = req_handler
+        self.write_to_db = write_to_db
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+        self.extract_workers = extract_workers
+        self.pagination = pagination
+        self.prefetch = prefetch
+        self.resume = resume
+        self.content_hash_index = content_hash_index
+        self.stop = stop
+        self.stats = []
+        self.__stop = Event()
+        self.__errors = []
+        self.__summaries = []
+        self.__checkpoints = {}
+
+    def run(self, stores_list: list) -> str:
+        """
+        Crawls all the stores and returns the scraping summary.
+
+        Args:
+            stores_list (list): List of store URLs.
+
+        Returns:
+            str: The scraping summary of all the stores followed by the stages stats.
+
+        Raises:
+            Exception: The first error raised by any of the stages.
+        """
+        self.__stop.clear()
+        self.__errors = []
+        self.__summaries = []
+        # read before the stages start, the write stage owns the connection afterwards
+        self.__checkpoints = self.write_to_db.get_checkpoints() if self.resume else {}
+        fetched_queue = Queue(self.queue_size)
+        extracted_queue = Queue(self.queue_size)
+        self.stats = [Stage_Stats("fetch"), Stage_Stats("transform", fetched_queue), Stage_Stats("write", extracted_queue)]
+
+        threads = [
+            Thread(target=self.__run_stage, args=(self.__fetch_stage, stores_list, fetched_queue), name="fetch"),
+            Thread(target=self.__run_stage, args=(self.__transform_stage, fetched_queue, extracted_queue), name="transform"),
+            Thread(target=self.__run_stage, args=(self.__write_stage, extracted_queue), name="write"),
+        ]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            threads[-1].join(self.stats_interval or None)
+            if self.stats_interval and threads[-1].is_alive():
+                self.print_stats()
+        for thread in threads:
+            thread.join()
+
+        if self.__errors:
+            raise self.__errors[0]
+        return "".join(self.__summaries) + "stages:\n" + "\n".join(str(stats) for stats in self.stats) + "\n"
+
+    def print_stats(self) -> None:
+        """Prints the throughput and queue depth of every stage."""
+        for stats in self.stats:
+            print(stats)
+
+    def __run_stage(self, stage, *args) -> None:
+        """
+        Runs a stage, stopping the whole pipeline if it fails.
+
+        Args:
+            stage: The stage method.
+            *args: The arguments of the stage.
+        """
+        try:
+            stage(*args)
+        except Exception as e:
+            print(f"pipeline stopped, the {current_thread().name} stage failed: {e!r}")
+            self.__errors.append(e)
+            self.__stop.set()
+
+    def __stopped(self) -> bool:
+        """
+        Checks whether the crawl was asked to stop.
+
+        Returns:
+            bool: True once `stop` is set.
+        """
+        return self.stop is not None and self.stop.is_set()
+
+    def __put(self, queue: Queue, message: tuple) -> bool:
+        """
+        Puts a message on a queue, waiting while it is full unless the pipeline stops.
+
+        Args:
+            queue (Queue): The queue.
+            message (tuple): The message.
+
+        Returns:
+            bool: False if the pipeline stopped before the message could be put.
+        """
+        while not self.__stop.is_set():
+            try:
+                queue.put(message, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def __get(self, queue: Queue):
+        """
+        Gets a message from a queue, waiting while it is empty unless the pipeline stops.
+
+        Args:
+            queue (Queue): The queue.
+
+        Returns:
+            The message, None once the pipeline stopped or the previous stage finished.
+        """
+        while not self.__stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+        return None
+
+    def __fetch_stage(self, stores_list: list, output_queue: Queue) -> None:
+        """
+        Fetches the pages of every store and puts them on the output queue.
+
+        Args:
+            stores_list (list): List of store URLs.
+            output_queue (Queue): The queue of the transform stage.
+        """
+        stats = self.stats[0]
+        for store_index, store in enumerate(stores_list):
+            if self.__stopped():
+                break
+            store_products_API, store_name = self.req_handler.config_store_url_and_name(store)
+            print(f"\nstores index: <<{store_index+1}: {len(stores_list)}>>\nstore: {store_name}\nurl: {store_products_API}")
+            checkpoint = self.__checkpoints.get(store_products_API, {"last_page": 0, "last_product_id": None, "status": "in_progress"})
+            if checkpoint["status"] == "done":
+                if not self.__put(output_queue, ("store_skipped", store_products_API, checkpoint["last_page"])):
+                    return
+                continue
+            if not self.__put(output_queue, ("store_start", store_products_API, checkpoint)):
+                return
+            pages = paginate(self.req_handler, store_products_API, self.pagination, self.prefetch,
+                             last_page=checkpoint["last_page"], last_product_id=checkpoint["last_product_id"])
+            pages_scraped = checkpoint["last_page"]
+            end_message = None
+            while True:
+                if self.__stopped():
+                    # the store is resumed from its checkpoint by whoever crawls it next
+                    pages.close()
+                    end_message = ("store_stopped", store_products_API, f"stopped before page {pages_scraped + 1}")
+                    break
+                start = perf_counter()
+                try:
+                    page_number, row_products_list = next(pages)
+                except StopIteration:
+                    end_message = ("store_end", store_products_API, pages_scraped)
+                    break
+                except Fetch_Error as e:
+                    # give up on this store, it is crawled again on the next run
+                    print(e)
+                    end_message = ("store_failed", store_products_API, f"failed at page {pages_scraped + 1}: {e}")
+                    break
+                finally:
+                    stats.busy_seconds += perf_counter() - start
+                stats.items += 1
+                pages_scraped = page_number
+                if not self.__put(output_queue, ("page", store_products_API, (page_number, row_products_list))):
+                    return
+            if not self.__put(output_queue, end_message):
+                return
+        self.__put(output_queue, None)
+
+    def __transform_stage(self, input_queue: Queue, output_queue: Queue) -> None:
+        """
+        Extracts the products, variants, and images of the fetched pages.
+
+        Args:
+            input_queue (Queue): The queue filled by the fetch stage.
+            output_queue (Queue): The queue of the write stage.
+        """
+        if not self.extract_workers:
+            self.__transform_pages(input_queue, output_queue, None)
+            return
+        with ProcessPoolExecutor(self.extract_workers) as executor:
+            self.__transform_pages(input_queue, output_queue, executor)
+
+    def __transform_pages(self, input_queue: Queue, output_queue: Queue, executor: ProcessPoolExecutor) -> None:
+        """
+        Extracts the fetched pages in this thread, or in the executor's processes keeping the pages order.
+
+        Args:
+            input_queue (Queue): The queue filled by the fetch stage.
+            output_queue (Queue): The queue of the write stage.
+            executor (ProcessPoolExecutor): The extraction processes, None to extract in this thread.
+        """
+        stats = self.stats[1]
+        # messages waiting for their page, or an earlier page, to be extracted
+        pending = deque()
+        max_pending = 2 * self.extract_workers
+        while True:
+            message = self.__get(input_queue)
+            if message is not None:
+                kind, store_products_API, payload = message
+                if kind == "page":
+                    page_number, row_products_list = payload
+                    start = perf_counter()
+                    # the products count and the last id of the fetched page, and the hashes of the products kept
+                    page_info = (len(row_products_list), row_products_list[-1]["id"], None)
+                    if isinstance(row_products_list, Streamed_Page):
+                        # a streamed page was extracted while it was downloaded
+                        extracted_lists, content_hashes = row_products_list.extracted_lists(self.content_hash_index)
+                        payload = (page_number, extracted_lists, page_info[:2] + (content_hashes,))
+                        stats.items += 1
+                    else:
+                        if self.content_hash_index is not None:
+                            row_products_list, content_hashes = self.content_hash_index.filter_page(row_products_list)
+                            page_info = page_info[:2] + (content_hashes,)
+                        if executor is None:
+                            payload = (page_number, extract_page(row_products_list), page_info)
+                            stats.items += 1
+                        else:
+                            payload = (page_number, executor.submit(timed_extract_page, row_products_list), page_info)
+                    stats.busy_seconds += perf_counter() - start
+                pending.append((kind, store_products_API, payload))
+
+            # forward the messages in order, waiting on the oldest page once enough are in flight
+            while pending:
+                kind, store_products_API, payload = pending[0]
+                if kind == "page" and isinstance(payload[1], Future):
+                    page_number, future, page_info = payload
+                    if not future.done() and len(pending) <= max_pending and message is not None:
+                        break
+                    extracted_lists, seconds = future.result()
+                    payload = (page_number, extracted_lists, page_info)
+                    # the worker counted the page in its own process
+                    record_extraction(extracted_lists, seconds)
+                    # the workers extract in parallel, so the stage is busy for a share of each page's time
+                    stats.busy_seconds += seconds / self.extract_workers
+                    stats.items += 1
+                if not self.__put(output_queue, (kind, store_products_API, payload)):
+                    return
+                pending.popleft()
+            if message is None:
+                break
+        self.__put(output_queue, None)
+
+    def __write_stage(self, input_queue: Queue) -> None:
+        """
+        Writes the extracted pages to the database and builds the stores summaries.
+
+        Args:
+            input_queue (Queue): The queue filled by the transform stage.
+        """
+        stats = self.stats[2]
+        total_products = 0
+        resumed_after = 0
+        incremental_filter = None
+        while (message := self.__get(input_queue)) is not None:
+            kind, store_products_API, payload = message
+            if self.__stopped() and kind in ("page", "store_end"):
+                # the pages fetched before the stop are left to whoever crawls the store next
+                if kind == "page":
+                    continue
+                kind, payload = "store_stopped", "stopped before its last pages were written"
+            if kind == "store_start":
+                total_products = 0
+                resumed_after = payload["last_page"]
+                self.write_to_db.start_checkpoint(store_products_API, payload["last_page"], payload["last_product_id"])
+                if self.write_to_db.incremental:
+                    incremental_filter = Incremental_Filter(self.write_to_db.get_watermark(store_products_API))
+            elif kind == "page":
+                start = perf_counter()
+                page_number, (products_list, variants_list, images_list), (products_count, last_product_id, content_hashes) = payload
+                total_products += products_count
+                if incremental_filter is not None:
+                    products_list, variants_list, images_list = incremental_filter.filter_page(products_list, variants_list, images_list)
+                stored_hashes = self.write_to_db.write_page(products_list, variants_list, images_list, store_products_API, page_number,
+                                                            last_product_id, content_hashes)
+                if self.content_hash_index is not None:
+                    self.content_hash_index.remember(stored_hashes)
+                stats.busy_seconds += perf_counter() - start
+                stats.items += 1
+                print(f"current page: {page_number}")
+            elif kind == "store_end":
+                self.write_to_db.finish_checkpoint(store_products_API, "done")
+                if self.req_handler.http_cache is not None:
+                    self.req_handler.http_cache.flush(store_products_API)
+                summary = f"{'-'*50}\n{store_products_API}\n"
+                if resumed_after:
+                    summary += f"resumed after page: {resumed_after}\n"
+                summary += f"pages scraped: {payload}\nproducts scraped: {total_products}\n"
+                if incremental_filter is not None:
+                    summary += f"products unchanged: {incremental_filter.unchanged_products}\n"
+                    if incremental_filter.new_high_water_mark is not None:
+                        self.write_to_db.set_watermark(store_products_API, incremental_filter.new_high_water_mark)
+                self.__summaries.append(summary + f"{'-'*50}\n")
+            elif kind == "store_skipped":
+                self.__summaries.append(f"{'-'*50}\n{store_products_API}\nalready crawled: {payload} pages\n{'-'*50}\n")
+            elif kind == "store_stopped":
+                print(f"crawl {payload}.")
+                self.__summaries.append(f"{'-'*50}\n{store_products_API}\n{payload}\n{'-'*50}\n")
+            elif kind == "store_failed":
+                self.write_to_db.finish_checkpoint(store_products_API, "failed")
+                if self.req_handler.http_cache is not None:
+                    self.req_handler.http_cache.discard(store_products_API)
+                self.__summaries.append(f"{'-'*50}\n{store_products_API}\n{payload}\n{'-'*50}\n")
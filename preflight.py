@@ -0,0 +1,340 @@
+"""checks the stores list before a crawl, so no crawl is wasted on a dead or moved store.
+
+through the Store_Preflight class it will normalize every URL of the
+stores list (scheme, case, default port, trailing `products.json`) and
+drop the duplicates, then check the stores concurrently with asyncio
+and aiohttp: a HEAD request to the store's root, following the
+redirects, resolves its canonical domain, e.g. a store that moved to a
+new domain, and a one-product request to its `products.json` confirms
+it is a shopify store serving its products. the canonical URLs are
+deduplicated again, as two listed domains may be the same store.
+
+a store is dead only on a definitive answer: its domain doesn't exist
+(NXDOMAIN), or its `products.json` is missing (404, 410), password
+protected (401, 403), or not a products list. the stores that refused
+the connection, failed to resolve for another reason, answered with a
+throttling, server, or other client error, or timed out, are "unknown":
+they are crawled anyway and checked again on the next run.
+
+the results are kept in a SQLite Preflight_Cache for `ttl_hours`, so
+the next runs neither request the stores checked recently nor crawl
+the ones known to be dead.
+
+Typical usage example:
+
+    store_preflight = Store_Preflight("preflight_cache.sqlite", ttl_hours=24)
+    stores_list = store_preflight.run(stores_list)
+    print(store_preflight.summary())
+
+    or from the command line:
+
+    python preflight.py --stores stores_to_scrape.json --output stores_checked.json
+"""
+
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+from json_backend import loads
+from threading import Lock
+from time import time
+from typing import Optional
+import argparse
+import json
+import socket
+import sqlite3
+
+# the ports left out of the normalized URLs
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# the resolver errors telling the domain doesn't exist, other resolver errors may be temporary
+NXDOMAIN_ERRORS = {socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)}
+# the products.json statuses telling the store is gone
+MISSING_STATUSES = {404, 410}
+
+
+def connection_failure_status(os_error: Optional[OSError]) -> str:
+    """
+    Classifies the error of a connection that couldn't be made.
+
+    Args:
+        os_error (Optional[OSError]): The error raised by the resolver or the socket.
+
+    Returns:
+        str: "dead" if the domain doesn't exist, "unknown" for the errors that may be temporary.
+    """
+    if isinstance(os_error, socket.gaierror) and os_error.errno in NXDOMAIN_ERRORS:
+        return "dead"
+    return "unknown"
+
+
+def normalize_store_url(store: str) -> Optional[str]:
+    """
+    Normalizes a store URL of the stores list.
+
+    Args:
+        store (str): The store as listed, with or without its scheme, e.g. "Example.com/products.json".
+
+    Returns:
+        Optional[str]: The URL in the format of `Requests_Handler.config_store_url_and_name`, e.g. "https://example.com/", None if it has no host.
+    """
+    store = store.strip()
+    if "://" not in store:
+        store = "https://" + store
+    try:
+        url = urlsplit(store)
+        host, port = url.hostname, url.port
+    except ValueError:
+        return None
+    if not host:
+        return None
+    scheme = url.scheme.lower()
+    netloc = host if port is None or port == DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+    path = url.path.rstrip("/")
+    if path.endswith("/products.json"):
+        path = path[:-len("/products.json")]
+    return f"{scheme}://{netloc}{path}/"
+
+
+class Preflight_Cache:
+    """
+    A persistent cache of the stores checks.
+
+    Attributes:
+        path (str): The SQLite file of the cache.
+        ttl_seconds (float): How long a check stays valid.
+    """
+
+    def __init__(self, path: str = "preflight_cache.sqlite", ttl_hours: float = 24) -> None:
+        """
+        Initializes the Preflight_Cache class.
+
+        Args:
+            path (str): The SQLite file of the cache, created if missing.
+            ttl_hours (float): How long a check stays valid, in hours.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS stores (
+                    url TEXT PRIMARY KEY,
+                    canonical_url TEXT,
+                    status TEXT NOT NULL,
+                    reason TEXT,
+                    checked_at REAL NOT NULL
+                );
+            """)
+
+    def get(self, url: str) -> Optional[tuple]:
+        """
+        Reads the check of a store if it is still valid.
+
+        Args:
+            url (str): The normalized store URL.
+
+        Returns:
+            Optional[tuple]: The (canonical URL, status, reason) of the check, None if it expired or was never made.
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT canonical_url, status, reason FROM stores WHERE url = ? AND checked_at > ?;", (url, time() - self.ttl_seconds)
+            ).fetchone()
+        return row
+
+    def put(self, results: dict) -> None:
+        """
+        Saves the checks of stores.
+
+        Args:
+            results (dict): The (canonical URL, status, reason) of the checks by normalized store URL.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO stores (url, canonical_url, status, reason, checked_at) VALUES (?, ?, ?, ?, ?);",
+                [(url, canonical_url, status, reason, time()) for url, (canonical_url, status, reason) in results.items()]
+            )
+
+    def close(self) -> None:
+        """Closes the cache file."""
+        self.__connection.close()
+
+
+class Store_Preflight:
+    """
+    Normalizes, deduplicates, and checks a stores list.
+
+    Attributes:
+        cache (Preflight_Cache): The checks of the previous runs.
+        concurrency (int): The maximum number of requests at once.
+        per_host_limit (int): The maximum number of connections per host.
+        timeout (float): The timeout of one request in seconds.
+        results (dict): The (canonical URL, status, reason) of every store of the last run by normalized URL.
+    """
+
+    def __init__(
+        self,
+        cache_path: str = "preflight_cache.sqlite",
+        ttl_hours: float = 24,
+        concurrency: int = 20,
+        per_host_limit: int = 4,
+        timeout: float = 15,
+    ) -> None:
+        """
+        Initializes the Store_Preflight class.
+
+        Args:
+            cache_path (str): The SQLite file of the cache.
+            ttl_hours (float): How long a check is reused before the store is checked again, in hours.
+            concurrency (int): The maximum number of requests at once.
+            per_host_limit (int): The maximum number of connections per host.
+            timeout (float): The timeout of one request in seconds.
+        """
+        self.cache = Preflight_Cache(cache_path, ttl_hours)
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.results = {}
+        self.__listed = 0
+        self.__invalid = []
+        self.__duplicates = 0
+        self.__cached = 0
+        self.__crawled = []
+
+    def run(self, stores_list: list) -> list:
+        """
+        Checks the stores of a list and returns the ones to crawl.
+
+        Args:
+            stores_list (list): List of store URLs, as listed in "stores_to_scrape.json".
+
+        Returns:
+            list: The canonical URLs of the stores that aren't dead, without duplicates, in the order of `stores_list`.
+        """
+        self.__listed = len(stores_list)
+        self.__invalid = [store for store in stores_list if normalize_store_url(store) is None]
+        urls = list(dict.fromkeys(url for url in map(normalize_store_url, stores_list) if url is not None))
+        self.__duplicates = self.__listed - len(self.__invalid) - len(urls)
+
+        self.results = {}
+        for url in urls:
+            cached = self.cache.get(url)
+            if cached is not None:
+                self.results[url] = cached
+        self.__cached = len(self.results)
+        unchecked = [url for url in urls if url not in self.results]
+        if unchecked:
+            checked = asyncio.run(self.check_all(unchecked))
+            # the temporary failures are checked again on the next run
+            self.cache.put({url: result for url, result in checked.items() if result[1] != "unknown"})
+            self.results.update(checked)
+
+        alive = [url for url in urls if self.results[url][1] != "dead"]
+        self.__crawled = list(dict.fromkeys(self.results[url][0] for url in alive))
+        # the listed domains resolving to the same store
+        self.__duplicates += len(alive) - len(self.__crawled)
+        return self.__crawled
+
+    async def check_all(self, urls: list) -> dict:
+        """
+        Checks stores concurrently.
+
+        Args:
+            urls (list): The normalized store URLs.
+
+        Returns:
+            dict: The (canonical URL, status, reason) of the checks by store URL.
+        """
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            results = await asyncio.gather(*(self.check(session, url) for url in urls))
+        return dict(zip(urls, results))
+
+    async def check(self, session: aiohttp.ClientSession, url: str) -> tuple:
+        """
+        Resolves the canonical URL of a store and checks its `products.json`.
+
+        A storefront moved to a new domain redirects its root there, and keeps
+        its path, so the canonical URL is the final origin of the redirects
+        with the store's path.
+
+        Args:
+            session (aiohttp.ClientSession): The shared HTTP session.
+            url (str): The normalized store URL.
+
+        Returns:
+            tuple: The canonical URL, the status, "ok", "redirected", "dead", or "unknown", and the reason of a dead or unknown store.
+        """
+        canonical_url = url
+        try:
+            async with session.head(url, allow_redirects=True) as response:
+                origin = response.url.origin()
+            canonical_url = normalize_store_url(f"{origin}{urlsplit(url).path}") or url
+            async with session.get(canonical_url + "products.json?limit=1") as response:
+                status = response.status
+                body = await response.read() if status == 200 else b""
+        except aiohttp.ClientConnectorError as e:
+            return canonical_url, connection_failure_status(e.os_error), f"connection failed: {e.os_error!r}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return canonical_url, "unknown", f"request failed: {e!r}"
+        if status == 429 or status >= 500:
+            return canonical_url, "unknown", f"products.json answered {status}"
+        if status in (401, 403):
+            return canonical_url, "dead", f"products.json is password protected ({status})"
+        if status in MISSING_STATUSES:
+            return canonical_url, "dead", f"products.json answered {status}"
+        if status != 200:
+            return canonical_url, "unknown", f"products.json answered {status}"
+        try:
+            if not isinstance(loads(body)["products"], list):
+                raise ValueError("products isn't a list")
+        except (ValueError, KeyError, TypeError) as e:
+            return canonical_url, "dead", f"products.json isn't a products list: {e!r}"
+        return canonical_url, "ok" if canonical_url == url else "redirected", None
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the last run.
+
+        Returns:
+            str: The stores listed, removed, and moved, and the dead stores with their reasons.
+        """
+        statuses = [status for _, status, _ in self.results.values()]
+        summary = (
+            f"{'-'*50}\npreflight\nstores listed: {self.__listed}\ninvalid URLs: {len(self.__invalid)}\n"
+            f"duplicates removed: {self.__duplicates}\n"
+            f"checks from cache: {self.__cached}\nstores checked: {len(self.results) - self.__cached}\n"
+            f"redirected: {statuses.count('redirected')}\nunknown (crawled anyway): {statuses.count('unknown')}\n"
+            f"dead: {statuses.count('dead')}\nstores to crawl: {len(self.__crawled)}\n"
+        )
+        for url, (canonical_url, status, reason) in self.results.items():
+            if status == "redirected":
+                summary += f"{url} -> {canonical_url}\n"
+            elif status in ("dead", "unknown"):
+                summary += f"{status}: {url}: {reason}\n"
+        return summary + f"{'-'*50}\n"
+
+    def close(self) -> None:
+        """Closes the cache file."""
+        self.cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="normalize, deduplicate, and check the stores list.")
+    parser.add_argument("--stores", default="stores_to_scrape.json", help="the JSON list of the stores.")
+    parser.add_argument("--output", default=None, help="write the stores to crawl to this JSON file.")
+    parser.add_argument("--cache", default="preflight_cache.sqlite", help="the SQLite file of the checks.")
+    parser.add_argument("--ttl", type=float, default=24, help="hours a check is reused.")
+    parser.add_argument("--concurrency", type=int, default=20, help="the maximum number of requests at once.")
+    args = parser.parse_args()
+
+    with open(args.stores, "r") as f:
+        stores_list = json.load(f)
+    store_preflight = Store_Preflight(args.cache, args.ttl, args.concurrency)
+    stores_list = store_preflight.run(stores_list)
+    store_preflight.close()
+    print(store_preflight.summary())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stores_list, f, indent=4)
@@ -0,0 +1,277 @@
+"""records the price and availability changes of the variants, one row per change.
+
+through the Variant_History class it will compare every variant written
+by `Write_to_DB.write_page` with its last known state, its price,
+compare at price, and availability, and append only the variants that
+are new or changed to the variant_history table, in the same transaction
+as the page. the variants that failed to insert, or whose product did,
+are left out, so the history only holds states that were stored. the
+table is partitioned by month of `observed_at`, so the history of
+thousands of stores stays compact and old months can be detached or
+dropped as a whole.
+
+the last known states are read through a bounded LRU cache, keyed by
+store and variant id, and the variants missing from it are looked up in
+bulk in the latest rows of variant_history, which is the on-disk index,
+so a crawl never scans the variants snapshots.
+
+when the transaction of a page is rolled back, the states it cached are
+forgotten, and read again from the table.
+
+price_series reads the history of one variant back.
+
+Typical usage example:
+
+    variant_history = Variant_History(cache_size=1_000_000)
+    write_to_db = Write_to_DB("admin", "12345", "5555", "shopify", variant_history=variant_history)
+    write_to_db.write_page(products_list, variants_list, images_list, store_products_API)
+    print(variant_history.summary())
+
+    for observed_at, price, compare_at_price, available in price_series(write_to_db.engine, variant_id):
+        print(observed_at, price)
+
+    or from the command line:
+
+    python price_history.py 40123456789012 --since 2024-11-01
+"""
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional
+import argparse
+
+# the columns of a variant whose changes are recorded
+TRACKED_COLUMNS = ("variant_price", "variant_compare_at_price", "variant_available")
+
+
+def variant_state(variant: dict) -> tuple:
+    """
+    Builds the state of a variant compared between crawls.
+
+    Args:
+        variant (dict): The extracted variant, its prices as strings or numbers.
+
+    Returns:
+        tuple: The price and compare at price as the REAL stored, and the availability.
+    """
+    price, compare_at_price, available = (variant.get(column) for column in TRACKED_COLUMNS)
+    return (
+        round(float(price), 2) if price is not None else None,
+        round(float(compare_at_price), 2) if compare_at_price is not None else None,
+        available,
+    )
+
+
+class Variant_History:
+    """
+    Appends the variants whose price or availability changed to the variant_history table.
+
+    Attributes:
+        cache_size (int): The maximum number of variant states kept in memory.
+        variants_seen (int): The number of variants compared.
+        changes (int): The number of rows appended, the variants new or changed.
+        cache_hits (int): The number of states found in the cache instead of the database.
+    """
+
+    def __init__(self, cache_size: int = 1_000_000) -> None:
+        """
+        Initializes the Variant_History class.
+
+        Args:
+            cache_size (int): The maximum number of variant states kept in memory.
+        """
+        self.cache_size = cache_size
+        self.variants_seen = 0
+        self.changes = 0
+        self.cache_hits = 0
+        self.__cache = OrderedDict()
+        self.__lock = Lock()
+
+    def capture(self, connection: Connection, variants_list: list, store: str, observed_at: Optional[datetime] = None) -> int:
+        """
+        Appends the variants of a page that are new or changed, in the connection's transaction.
+
+        Args:
+            connection (Connection): The connection writing the page.
+            variants_list (list): List of extracted variants.
+            store (str): The URL of the store the variants were crawled from.
+            observed_at (Optional[datetime]): The time of the changes, now if None.
+
+        Returns:
+            int: The number of rows appended.
+        """
+        states = {variant["id"]: (variant.get("product_id"), variant_state(variant)) for variant in variants_list}
+        if not states:
+            return 0
+        known_states = self.__lookup(connection, store, list(states))
+        changed = {variant_id: state for variant_id, state in states.items() if known_states.get(variant_id) != state[1]}
+        if changed:
+            connection.execute(text("""
+                INSERT INTO variant_history (store, variant_id, product_id, observed_at, variant_price, variant_compare_at_price, variant_available)
+                SELECT :store, variant_id, product_id, :observed_at, variant_price, variant_compare_at_price, variant_available
+                FROM unnest(
+                    CAST(:variant_ids AS BIGINT[]), CAST(:product_ids AS BIGINT[]),
+                    CAST(:prices AS REAL[]), CAST(:compare_at_prices AS REAL[]), CAST(:availabilities AS BOOLEAN[])
+                ) AS changes (variant_id, product_id, variant_price, variant_compare_at_price, variant_available);
+            """), {
+                "store": store,
+                "observed_at": observed_at or datetime.now(timezone.utc),
+                "variant_ids": list(changed),
+                "product_ids": [product_id for product_id, _ in changed.values()],
+                "prices": [state[0] for _, state in changed.values()],
+                "compare_at_prices": [state[1] for _, state in changed.values()],
+                "availabilities": [state[2] for _, state in changed.values()],
+            })
+        self.__remember(store, {variant_id: state for variant_id, (_, state) in changed.items()})
+        with self.__lock:
+            self.variants_seen += len(states)
+            self.changes += len(changed)
+        return len(changed)
+
+    def forget(self, store: str, variant_ids: list) -> None:
+        """
+        Drops cached states, when the transaction that recorded them was rolled back.
+
+        Args:
+            store (str): The store URL.
+            variant_ids (list): The ids of the variants captured in the transaction.
+        """
+        with self.__lock:
+            for variant_id in variant_ids:
+                self.__cache.pop((store, variant_id), None)
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the changes captured.
+
+        Returns:
+            str: The variants compared, the changes appended, and the cache hits.
+        """
+        unchanged = self.variants_seen - self.changes
+        return (
+            f"{'-'*50}\nvariant history\n"
+            f"variants compared: {self.variants_seen}\nvariants new or changed (rows appended): {self.changes}\n"
+            f"variants unchanged: {unchanged}\nstates read from the cache: {self.cache_hits}\n{'-'*50}\n"
+        )
+
+    def __remember(self, store: str, states: dict) -> None:
+        """
+        Caches the last states of variants.
+
+        Args:
+            store (str): The store URL.
+            states (dict): The states by variant id.
+        """
+        with self.__lock:
+            for variant_id, state in states.items():
+                self.__cache[(store, variant_id)] = state
+                self.__cache.move_to_end((store, variant_id))
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+
+    def __lookup(self, connection: Connection, store: str, variant_ids: list) -> dict:
+        """
+        Reads the last states of variants, from the cache or else the latest rows of their history.
+
+        Args:
+            connection (Connection): The connection writing the page.
+            store (str): The store URL.
+            variant_ids (list): The variant ids.
+
+        Returns:
+            dict: The states by variant id, the variants never recorded are missing.
+        """
+        known_states = {}
+        with self.__lock:
+            for variant_id in variant_ids:
+                if (store, variant_id) in self.__cache:
+                    self.__cache.move_to_end((store, variant_id))
+                    known_states[variant_id] = self.__cache[(store, variant_id)]
+            self.cache_hits += len(known_states)
+        missing_ids = [variant_id for variant_id in variant_ids if variant_id not in known_states]
+        if missing_ids:
+            rows = connection.execute(text("""
+                SELECT DISTINCT ON (variant_id) variant_id, variant_price, variant_compare_at_price, variant_available
+                FROM variant_history WHERE variant_id = ANY(:ids) AND store = :store
+                ORDER BY variant_id, observed_at DESC;
+            """), {"ids": missing_ids, "store": store}).all()
+            found = {
+                variant_id: (
+                    round(price, 2) if price is not None else None,
+                    round(compare_at_price, 2) if compare_at_price is not None else None,
+                    available,
+                )
+                for variant_id, price, compare_at_price, available in rows
+            }
+            self.__remember(store, found)
+            known_states.update(found)
+        return known_states
+
+
+def price_series(
+    engine: Engine,
+    variant_id: int,
+    store: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> list:
+    """
+    Reads the price series of a variant.
+
+    Every row holds the state of the variant from its `observed_at` until the
+    next row's, the months outside `since` and `until` are not scanned.
+
+    Args:
+        engine (Engine): The engine of the database.
+        variant_id (int): The variant id.
+        store (Optional[str]): The store URL, every store if None.
+        since (Optional[datetime]): The first time of the series, the beginning if None.
+        until (Optional[datetime]): The time the series ends before, now if None.
+
+    Returns:
+        list: The (observed_at, price, compare at price, available) tuples of the changes, oldest first.
+    """
+    conditions = ["variant_id = :variant_id"]
+    if store is not None:
+        conditions.append("store = :store")
+    if since is not None:
+        conditions.append("observed_at >= :since")
+    if until is not None:
+        conditions.append("observed_at < :until")
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT observed_at, variant_price, variant_compare_at_price, variant_available FROM variant_history "
+            f"WHERE {' AND '.join(conditions)} ORDER BY observed_at;"
+        ), {"variant_id": variant_id, "store": store, "since": since, "until": until}).all()
+    return [tuple(row) for row in rows]
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+    from save_to_sql_db import Write_to_DB
+
+    parser = argparse.ArgumentParser(description="print the price series of a variant.")
+    parser.add_argument("variant_id", type=int, help="the id of the variant.")
+    parser.add_argument("--store", default=None, help="the store URL, every store if omitted.")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="the first time of the series, e.g. 2024-11-01.")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="the time the series ends before.")
+    args = parser.parse_args()
+
+    db_info = dotenv_values(".env")
+    # connecting the writer applies the pending migrations
+    write_to_db = Write_to_DB(
+        db_info["db_user_name"],
+        db_info["db_password"],
+        db_info["db_port"],
+        db_info["db_name"],
+        host=db_info.get("db_host", "localhost")
+        )
+    series = price_series(write_to_db.engine, args.variant_id, args.store, args.since, args.until)
+    print(f"{'-'*50}\nvariant {args.variant_id}: {len(series)} changes")
+    for observed_at, price, compare_at_price, available in series:
+        print(f"{observed_at.isoformat()}  price: {price}  compare at: {compare_at_price}  available: {available}")
+    print(f"{'-'*50}")
+    write_to_db.terminate_connection()
@@ -0,0 +1,324 @@
+"""rate limits, backs off, and cuts off the requests made to shopify stores.
+
+through the Host_Rate_Limiter class it will keep a token bucket per
+host whose rate adapts to what the store accepts: it grows a little
+after every successful request and is halved on every throttled one
+(HTTP 429/503), and a `Retry-After` header pauses the host until it
+expires. the Circuit_Breaker class stops requesting a store after a run
+of consecutive failures, so one dead store can't hold up the whole run,
+and lets a trial request through once `reset_timeout` has passed.
+
+Typical usage example:
+
+    rate_limiter = Host_Rate_Limiter(initial_rate=2, max_rate=10)
+    circuit_breaker = Circuit_Breaker(failure_threshold=5, reset_timeout=300)
+
+    for attempt in range(max_retries):
+        if not circuit_breaker.allow():
+            raise Circuit_Open_Error(url)
+        rate_limiter.acquire(host)
+        response = session.get(url)
+        if response.status_code in THROTTLE_STATUSES:
+            rate_limiter.on_throttle(host, retry_after_seconds(response.headers.get("Retry-After")))
+            sleep(backoff_delay(attempt, retry_after=...))
+        ...
+"""
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Optional
+import asyncio
+import random
+
+# statuses telling the client to slow down, retried after a backoff
+THROTTLE_STATUSES = {429, 503}
+# statuses of server errors, retried after a backoff and counted by the circuit breaker
+SERVER_ERROR_STATUSES = {500, 502, 504, 520, 522, 524}
+
+
+class Fetch_Error(ConnectionError):
+    """Raised when a page can't be fetched after all the retries."""
+
+
+class Circuit_Open_Error(Fetch_Error):
+    """Raised when a store's circuit breaker is open and requests to it are cut off."""
+
+
+def retry_after_seconds(retry_after: Optional[str]) -> Optional[float]:
+    """
+    Parses a `Retry-After` header.
+
+    Args:
+        retry_after (Optional[str]): The header, either a number of seconds or an HTTP date.
+
+    Returns:
+        Optional[float]: The seconds to wait, None if the header is missing or malformed.
+    """
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt: int, base: float = 1, cap: float = 60, retry_after: Optional[float] = None) -> float:
+    """
+    Computes the wait before a retry with exponential backoff and full jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+        base (float): The backoff of the first retry in seconds.
+        cap (float): The maximum backoff in seconds.
+        retry_after (Optional[float]): The wait asked by the server, never waited less than.
+
+    Returns:
+        float: The seconds to wait.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class Token_Bucket:
+    """
+    A token bucket refilled at `rate` tokens per second up to `capacity` tokens.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): The maximum number of tokens.
+        tokens (float): The tokens available, negative when requests are already queued.
+        blocked_until (float): The monotonic time before which no token is handed out.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Initializes the Token_Bucket class.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): The maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self.__updated_at = monotonic()
+        self.__lock = Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, possibly one that will only be available later.
+
+        Returns:
+            float: The seconds to wait before using the token.
+        """
+        with self.__lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.__updated_at) * self.rate)
+            self.__updated_at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def set_rate(self, change: Callable[[float], float], blocked_until: float = 0.0) -> None:
+        """
+        Changes the rate, the tokens refilled until now are counted at the previous one.
+
+        Args:
+            change (Callable[[float], float]): Builds the new rate from the current one, called under the bucket's lock.
+            blocked_until (float): The monotonic time before which no token is handed out, if later than the current one.
+        """
+        with self.__lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.__updated_at) * self.rate)
+            self.__updated_at = now
+            self.rate = change(self.rate)
+            self.blocked_until = max(self.blocked_until, blocked_until)
+
+
+class Host_Rate_Limiter:
+    """
+    Adaptive per-host rate limiting with token buckets.
+
+    the rate of a host grows by `increase_step` requests/sec after every
+    successful request up to `max_rate`, and is multiplied by
+    `decrease_factor` down to `min_rate` after every throttled one.
+
+    Attributes:
+        initial_rate (float): The starting rate of every host in requests per second.
+        min_rate (float): The lowest rate a host is slowed down to.
+        max_rate (float): The highest rate a host is sped up to.
+        burst (float): The capacity of the buckets.
+        increase_step (float): Requests/sec added after a successful request.
+        decrease_factor (float): The rate multiplier after a throttled request.
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 2,
+        min_rate: float = 0.2,
+        max_rate: float = 10,
+        burst: float = 2,
+        increase_step: float = 0.05,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        """
+        Initializes the Host_Rate_Limiter class.
+
+        Args:
+            initial_rate (float): The starting rate of every host in requests per second.
+            min_rate (float): The lowest rate a host is slowed down to.
+            max_rate (float): The highest rate a host is sped up to.
+            burst (float): The capacity of the buckets.
+            increase_step (float): Requests/sec added after a successful request.
+            decrease_factor (float): The rate multiplier after a throttled request.
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.__buckets = {}
+        self.__lock = Lock()
+
+    def bucket(self, host: str) -> Token_Bucket:
+        """
+        Returns the bucket of a host, creating it on first use.
+
+        Args:
+            host (str): The host.
+
+        Returns:
+            Token_Bucket: The bucket of the host.
+        """
+        with self.__lock:
+            if host not in self.__buckets:
+                self.__buckets[host] = Token_Bucket(self.initial_rate, self.burst)
+            return self.__buckets[host]
+
+    def rate(self, host: str) -> float:
+        """
+        Returns the current rate of a host.
+
+        Args:
+            host (str): The host.
+
+        Returns:
+            float: The rate in requests per second.
+        """
+        return self.bucket(host).rate
+
+    def acquire(self, host: str) -> None:
+        """
+        Blocks until a request to the host is allowed.
+
+        Args:
+            host (str): The host.
+        """
+        wait = self.bucket(host).reserve()
+        if wait > 0:
+            sleep(wait)
+
+    async def acquire_async(self, host: str) -> None:
+        """
+        Waits, without blocking the event loop, until a request to the host is allowed.
+
+        Args:
+            host (str): The host.
+        """
+        wait = self.bucket(host).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self, host: str) -> None:
+        """
+        Speeds the host up after a successful request.
+
+        Args:
+            host (str): The host.
+        """
+        self.bucket(host).set_rate(lambda rate: min(self.max_rate, rate + self.increase_step))
+
+    def on_throttle(self, host: str, retry_after: Optional[float] = None) -> None:
+        """
+        Slows the host down after a throttled request.
+
+        Args:
+            host (str): The host.
+            retry_after (Optional[float]): The seconds the server asked to wait, the host is paused for them.
+        """
+        self.bucket(host).set_rate(
+            lambda rate: max(self.min_rate, rate * self.decrease_factor),
+            monotonic() + retry_after if retry_after else 0.0,
+        )
+
+
+class Circuit_Breaker:
+    """
+    Cuts a store off after `failure_threshold` consecutive failures.
+
+    the breaker is "closed" while requests flow, "open" while they are
+    cut off, and "half-open" once `reset_timeout` has passed, when one
+    trial request decides whether it closes again or re-opens. a store's
+    breaker is shared by the threads, or coroutines, requesting its pages,
+    so its state changes under a lock.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures opening the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a trial request.
+        failures (int): The current run of consecutive failures.
+        state (str): "closed", "open", or "half-open".
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 300) -> None:
+        """
+        Initializes the Circuit_Breaker class.
+
+        Args:
+            failure_threshold (int): Consecutive failures opening the breaker.
+            reset_timeout (float): Seconds the breaker stays open before a trial request.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self.__opened_at = 0.0
+        self.__lock = Lock()
+
+    def allow(self) -> bool:
+        """
+        Tells whether a request may be made.
+
+        Returns:
+            bool: False while the breaker is open.
+        """
+        with self.__lock:
+            if self.state == "open" and monotonic() - self.__opened_at >= self.reset_timeout:
+                self.state = "half-open"
+            return self.state != "open"
+
+    def record_success(self) -> None:
+        """Closes the breaker after a successful request."""
+        with self.__lock:
+            self.failures = 0
+            self.state = "closed"
+
+    def record_failure(self) -> None:
+        """Counts a failed request, opening the breaker at the threshold or after a failed trial."""
+        with self.__lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.__opened_at = monotonic()
@@ -0,0 +1,470 @@
+"""records the `products.json` pages of stores and replays them offline.
+
+through the Fixture_Archive class the pages are kept in a zip archive,
+one entry per page with the body exactly as it was received (after the
+content encoding was decoded) and a manifest of the recorded stores.
+record_stores fills an archive by crawling the stores page by page the
+way the crawlers do, through the fetch path of a Requests_Handler with
+its rate limits, retries, and circuit breakers, from live stores or from
+a Local_Store_Server, and notes in the manifest why every store stopped.
+
+the Replay_Server serves an archive over HTTP like local_store_server
+does its synthetic stores: every recorded store is served under its
+own `/store{index}.com/` prefix, by page number or, decoded and sorted
+by id, by `since_id` cursor, with the `ETag` and gzip handling of a
+storefront. `latency` and `jitter` delay every response, and
+`error_rate` answers that share of the requests with one of
+`error_statuses` (429 with a `Retry-After`), drawn from a seeded random
+generator so a run can be repeated, to measure the crawlers under a
+slow or failing network without touching the stores.
+
+Typical usage example:
+
+    record_stores(stores_list, "fixtures.zip")
+
+    server = Replay_Server("fixtures.zip", latency=0.05, error_rate=0.02, seed=1)
+    server.start()
+    stores_list = server.stores_urls()
+    ...
+    server.stop()
+
+    or from the command line:
+
+    python replay.py record --archive fixtures.zip --stores stores_to_scrape.json
+    python replay.py serve --archive fixtures.zip --port 8766 --latency 0.05 --error-rate 0.02 --stores-file replay_stores.json
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread, Lock
+from datetime import datetime, timezone
+from email.utils import formatdate
+from time import sleep
+from crawler import Requests_Handler
+from rate_limiting import Fetch_Error
+from json_backend import loads
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import zipfile
+
+MANIFEST = "manifest.json"
+
+
+class Fixture_Archive:
+    """
+    A zip archive of recorded `products.json` pages.
+
+    Attributes:
+        path (str): The archive's path.
+        stores (list): One dict per recorded store, its "url", "pages" and "products" counts, and "stop_reason",
+            "last page", "max pages", or the error that stopped its recording.
+        recorded_at (str): When the recording started, in ISO format.
+        limit (int): The products per page the pages were requested with.
+    """
+
+    def __init__(self, path: str, mode: str = "r", limit: int = 250) -> None:
+        """
+        Initializes the Fixture_Archive class, reading all the pages of an existing archive into memory.
+
+        Args:
+            path (str): The archive's path.
+            mode (str): "r" to read an archive, "w" to record a new one.
+            limit (int): The products per page of a new archive.
+        """
+        self.path = path
+        self.__zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED)
+        self.__pages = {}
+        if mode == "r":
+            manifest = json.loads(self.__zip.read(MANIFEST))
+            self.stores = manifest["stores"]
+            self.recorded_at = manifest["recorded_at"]
+            self.limit = manifest["limit"]
+            for store_index, store in enumerate(self.stores):
+                self.__pages[store_index] = [
+                    self.__zip.read(self.page_entry(store_index, page_number)) for page_number in range(1, store["pages"] + 1)
+                ]
+            self.__zip.close()
+        else:
+            self.stores = []
+            self.recorded_at = datetime.now(timezone.utc).isoformat()
+            self.limit = limit
+
+    def page_entry(self, store_index: int, page_number: int) -> str:
+        """
+        Builds the name of a page's entry in the zip.
+
+        Args:
+            store_index (int): The index of the store in `stores`.
+            page_number (int): The 1-based page number.
+
+        Returns:
+            str: The entry name.
+        """
+        return f"store{store_index}/page-{page_number:05}.json"
+
+    def add_store(self, store_url: str) -> int:
+        """
+        Adds a store to a recorded archive.
+
+        Args:
+            store_url (str): The store URL.
+
+        Returns:
+            int: The index of the store.
+        """
+        self.stores.append({"url": store_url, "pages": 0, "products": 0, "stop_reason": None})
+        return len(self.stores) - 1
+
+    def add_page(self, store_index: int, body: bytes, products_count: int) -> None:
+        """
+        Adds the next page of a store to a recorded archive.
+
+        Args:
+            store_index (int): The index of the store.
+            body (bytes): The decoded response body.
+            products_count (int): The number of products in the page.
+        """
+        store = self.stores[store_index]
+        store["pages"] += 1
+        store["products"] += products_count
+        self.__zip.writestr(self.page_entry(store_index, store["pages"]), body)
+
+    def close(self) -> None:
+        """Writes the manifest of a recorded archive and closes it."""
+        self.__zip.writestr(MANIFEST, json.dumps({"recorded_at": self.recorded_at, "limit": self.limit, "stores": self.stores}, indent=4))
+        self.__zip.close()
+
+    def pages(self, store_index: int) -> list:
+        """
+        Gives the pages of a store.
+
+        Args:
+            store_index (int): The index of the store.
+
+        Returns:
+            list: The bodies of the store's pages, in page order.
+        """
+        return self.__pages[store_index]
+
+
+def record_stores(
+    stores_list: list, path: str, req_handler: Requests_Handler = None, max_pages: int = None, limit: int = 250, verbose: bool = True
+) -> Fixture_Archive:
+    """
+    Records the pages of stores into a new archive.
+
+    every store is crawled by page number until a page has fewer than
+    `limit` products, through `Requests_Handler.fetch_products_list`, so the
+    pages are rate limited and retried like a crawl's. a store whose page
+    can't be fetched after the retries is left with the pages recorded
+    before the error, and its "stop_reason" holds the error.
+
+    Args:
+        stores_list (list): List of store URLs.
+        path (str): The archive to write.
+        req_handler (Requests_Handler): Fetches the pages with its rate limiting, retry, and circuit breaker policy, a default one if None.
+        max_pages (int): Stop every store after that many pages, None records them whole.
+        limit (int): The products per page.
+        verbose (bool): Print every page recorded.
+
+    Returns:
+        Fixture_Archive: The archive written, closed.
+    """
+    req_handler = req_handler or Requests_Handler()
+    archive = Fixture_Archive(path, "w", limit)
+    try:
+        for store in stores_list:
+            store_products_API, store_name = req_handler.config_store_url_and_name(store)
+            store_index = archive.add_store(store_products_API)
+            page_number = 1
+            stop_reason = "max pages"
+            while max_pages is None or page_number <= max_pages:
+                url = req_handler.config_store_products_url(store_products_API, page_number, limit)
+                try:
+                    json_response = req_handler.fetch_products_list(url, keep_body=True)
+                except Fetch_Error as e:
+                    stop_reason = f"failed at page {page_number}: {e}"
+                    print(f"stopped recording {store_name} at page {page_number}: {e!r}")
+                    break
+                products_count = len(json_response["products"])
+                archive.add_page(store_index, json_response["body"], products_count)
+                if verbose:
+                    print(f"{store_name} recorded page: {page_number}")
+                if products_count < limit:
+                    stop_reason = "last page"
+                    break
+                page_number += 1
+            archive.stores[store_index]["stop_reason"] = stop_reason
+    finally:
+        archive.close()
+    return archive
+
+
+class Replay_Server:
+    """
+    A threaded HTTP server replaying the stores of a fixture archive.
+
+    Attributes:
+        archive (Fixture_Archive): The recorded stores.
+        host (str): The interface the server binds to.
+        port (int): The port the server listens on.
+        latency (float): Seconds every response is delayed by.
+        jitter (float): Up to that many more seconds, drawn at random, every response is delayed by.
+        error_rate (float): The share of the products requests answered with an error.
+        error_statuses (tuple): The status codes the errors are drawn from.
+        requests_count (int): The number of requests served so far.
+        statuses_count (dict): The number of responses sent per status code.
+        bytes_sent (int): The bytes of the response bodies sent, compressed.
+    """
+
+    def __init__(
+        self,
+        archive,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        error_statuses: tuple = (429, 500, 503),
+        seed: int = None,
+    ) -> None:
+        """
+        Initializes the Replay_Server class.
+
+        Args:
+            archive: A Fixture_Archive, or the path of one.
+            host (str): The interface to bind to.
+            port (int): The port to listen on, 0 picks a free port.
+            latency (float): Seconds every response is delayed by.
+            jitter (float): Up to that many more seconds every response is delayed by.
+            error_rate (float): The share of the products requests answered with an error, from 0 to 1.
+            error_statuses (tuple): The status codes the errors are drawn from.
+            seed (int): The seed of the jitter and errors draws, None for a different run every time.
+        """
+        self.archive = archive if isinstance(archive, Fixture_Archive) else Fixture_Archive(archive)
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.requests_count = 0
+        self.statuses_count = {}
+        self.bytes_sent = 0
+        self.last_modified = formatdate(usegmt=True)
+        self.__random = random.Random(seed)
+        self.__products_by_id = {}
+        self.__lock = Lock()
+        self.__httpd = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.port = self.__httpd.server_address[1]
+        self.__thread = None
+
+    def stores_urls(self) -> list:
+        """
+        Returns the URLs of the replayed stores in the `stores_to_scrape.json` format, in the archive's order.
+
+        Returns:
+            list: List of store URLs.
+        """
+        return [f"http://{self.host}:{self.port}/store{i}.com" for i in range(len(self.archive.stores))]
+
+    def page_body(self, store_index: int, page_number: int) -> bytes:
+        """
+        Gives a recorded page, as it was received.
+
+        Args:
+            store_index (int): The index of the store.
+            page_number (int): The 1-based page number.
+
+        Returns:
+            bytes: The page's body, an empty products list past the last recorded page.
+        """
+        pages = self.archive.pages(store_index)
+        if 1 <= page_number <= len(pages):
+            return pages[page_number - 1]
+        return b'{"products": []}'
+
+    def body_after(self, store_index: int, since_id: int, limit: int) -> bytes:
+        """
+        Builds the page of a store's products whose ids follow `since_id`.
+
+        Args:
+            store_index (int): The index of the store.
+            since_id (int): The id of the last product already fetched.
+            limit (int): The number of products per page.
+
+        Returns:
+            bytes: The page's body, its products in ascending id order.
+        """
+        with self.__lock:
+            if store_index not in self.__products_by_id:
+                products = [product for body in self.archive.pages(store_index) for product in loads(body)["products"]]
+                self.__products_by_id[store_index] = sorted(products, key=lambda product: product["id"])
+            products = self.__products_by_id[store_index]
+        return json.dumps({"products": [product for product in products if product["id"] > since_id][:limit]}).encode()
+
+    def next_delay(self) -> float:
+        """
+        Draws the delay of a response.
+
+        Returns:
+            float: Seconds to wait before answering.
+        """
+        if not self.jitter:
+            return self.latency
+        with self.__lock:
+            return self.latency + self.__random.uniform(0, self.jitter)
+
+    def next_error(self) -> int:
+        """
+        Decides whether a products request gets an error response.
+
+        Returns:
+            int: The status code of the error, None to serve the page.
+        """
+        if not self.error_rate:
+            return None
+        with self.__lock:
+            if self.__random.random() < self.error_rate:
+                return self.__random.choice(self.error_statuses)
+        return None
+
+    def count_status(self, status: int, body_size: int = 0) -> None:
+        """
+        Counts a response sent.
+
+        Args:
+            status (int): The status code of the response.
+            body_size (int): The bytes of its body, as sent.
+        """
+        with self.__lock:
+            self.requests_count += 1
+            self.statuses_count[status] = self.statuses_count.get(status, 0) + 1
+            self.bytes_sent += body_size
+
+    def start(self) -> None:
+        """Starts serving in a background daemon thread."""
+        self.__thread = Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def serve_forever(self) -> None:
+        """Serves in the calling thread until interrupted."""
+        self.__httpd.serve_forever()
+
+    def stop(self) -> None:
+        """Stops the server and releases its socket."""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __make_handler(self) -> type:
+        """
+        Builds the request handler class bound to this server.
+
+        Returns:
+            type: A `BaseHTTPRequestHandler` subclass.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                delay = server.next_delay()
+                if delay:
+                    sleep(delay)
+                url = urlsplit(self.path)
+                store, _, endpoint = url.path.strip("/").partition("/")
+                store_index = store[len("store"):-len(".com")]
+                if (endpoint != "products.json" or not store.startswith("store") or not store.endswith(".com")
+                        or not store_index.isdigit() or int(store_index) >= len(server.archive.stores)):
+                    server.count_status(404)
+                    self.send_error(404)
+                    return
+                status = server.next_error()
+                if status is not None:
+                    server.count_status(status)
+                    self.send_response(status)
+                    if status == 429:
+                        self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                query = parse_qs(url.query)
+                if "since_id" in query:
+                    limit = int(query.get("limit", [str(server.archive.limit)])[0])
+                    body = server.body_after(int(store_index), int(query["since_id"][0]), limit)
+                else:
+                    body = server.page_body(int(store_index), int(query.get("page", ["1"])[0]))
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    server.count_status(304)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", server.last_modified)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=5)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                server.count_status(200, len(body))
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    from rate_limiting import Host_Rate_Limiter
+
+    parser = argparse.ArgumentParser(description="record stores pages into a fixture archive, or replay one locally.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record the pages of the stores into a fixture archive.")
+    record_parser.add_argument("--archive", required=True, help="the zip archive to write.")
+    record_parser.add_argument("--stores", default="stores_to_scrape.json", help="the JSON list of the stores to record.")
+    record_parser.add_argument("--max-pages", type=int, default=None, help="stop every store after that many pages.")
+    record_parser.add_argument("--max-rate", type=float, default=2, help="the requests per second per store.")
+
+    serve_parser = subparsers.add_parser("serve", help="serve the stores of a fixture archive.")
+    serve_parser.add_argument("--archive", required=True, help="the zip archive to replay.")
+    serve_parser.add_argument("--port", type=int, default=8766)
+    serve_parser.add_argument("--latency", type=float, default=0, help="seconds every response is delayed by.")
+    serve_parser.add_argument("--jitter", type=float, default=0, help="up to that many more seconds every response is delayed by.")
+    serve_parser.add_argument("--error-rate", type=float, default=0, help="the share of the requests answered with an error.")
+    serve_parser.add_argument("--error-statuses", default="429,500,503", help="the comma-separated status codes of the errors.")
+    serve_parser.add_argument("--seed", type=int, default=None, help="the seed of the jitter and errors.")
+    serve_parser.add_argument("--stores-file", default=None, help="also write the replayed stores URLs to this JSON file.")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        with open(args.stores, "r") as f:
+            stores_list = json.load(f)
+        archive = record_stores(
+            stores_list, args.archive, Requests_Handler(Host_Rate_Limiter(initial_rate=args.max_rate, max_rate=args.max_rate)), args.max_pages
+        )
+        print(json.dumps(archive.stores, indent=4))
+    else:
+        server = Replay_Server(
+            args.archive,
+            port=args.port,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            error_statuses=[int(status) for status in args.error_statuses.split(",")],
+            seed=args.seed,
+        )
+        if args.stores_file:
+            with open(args.stores_file, "w") as f:
+                json.dump(server.stores_urls(), f, indent=4)
+        print(json.dumps(server.stores_urls(), indent=4))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
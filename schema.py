@@ -0,0 +1,400 @@
+"""brings the tables created by Write_to_DB up to date, in place.
+
+through the Schema_Manager class it will apply the MIGRATIONS not yet
+applied to the target database, in order, each in its own transaction,
+and record them in the schema_migrations table, so a database created
+by an older version of the scraper is migrated with its data the next
+time a Write_to_DB connects to it:
+
+    1. a `store` column on the products, variants, and images tables,
+       the store URL the rows were crawled from, '' for the rows written
+       before the column existed.
+    2. the JSON columns turned into JSONB, which can be indexed and
+       compared.
+    3. a GIN index on the product tags, and indexes on the store, the
+       variants' product_id, price, and updated_at, and the images'
+       updated_at, so queries like "all the variants in stock for a
+       store under $50" don't scan the whole tables.
+    4. the byte size and SHA-256 of the images downloaded by an
+       image_assets.Image_Downloader, and the src they were downloaded
+       from, so an image whose src changed is downloaded again.
+    5. the variant_history table, the price, compare at price, and
+       availability of the variants each time one of them changed,
+       partitioned by month of `observed_at` with a default partition.
+    6. the extension of the images downloaded, kept next to their
+       SHA-256 since the stored files are named after the digest alone.
+
+partitioning is left to the operator: partition_by_store rebuilds the
+three tables as tables partitioned by list of `store`, one partition
+per store plus a default one, keyed on (store, id), and moves the rows
+into them. the partitions of the new stores are then created by
+Write_to_DB when it starts their checkpoint, under the migrations lock
+so writers starting together don't race, and a store whose rows already
+landed in the default partition is left there and reported. the
+monthly partitions of variant_history are created by
+create_history_partitions, for the current and the next month, by a
+Write_to_DB capturing the history.
+
+Typical usage example:
+
+    schema_manager = Schema_Manager(write_to_db.engine)
+    schema_manager.migrate()
+    schema_manager.partition_by_store()
+    schema_manager.create_partitions([store_products_API])
+    schema_manager.create_history_partitions()
+
+or from the command line, with the database in the .env file:
+
+    python schema.py --partition-by-store
+"""
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from datetime import date
+import argparse
+import hashlib
+
+# the tables holding the scraped rows, in the order their foreign keys allow them to be rebuilt
+DATA_TABLES = ["products", "variants", "images"]
+
+JSON_COLUMNS = {
+    "products": ["product_tags", "product_options", "images_ids"],
+    "images": ["variant_ids"],
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS products_store_idx ON products (store);",
+    "CREATE INDEX IF NOT EXISTS products_tags_idx ON products USING GIN (product_tags);",
+    "CREATE INDEX IF NOT EXISTS variants_product_id_idx ON variants (product_id);",
+    "CREATE INDEX IF NOT EXISTS variants_store_price_idx ON variants (store, variant_price);",
+    "CREATE INDEX IF NOT EXISTS variants_updated_at_idx ON variants (variant_updated_at);",
+    "CREATE INDEX IF NOT EXISTS images_store_idx ON images (store);",
+    "CREATE INDEX IF NOT EXISTS images_updated_at_idx ON images (updated_at);",
+]
+
+# the images whose asset wasn't downloaded, or was downloaded from another src
+ASSET_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS images_pending_assets_idx ON images (store, id) WHERE asset_src IS DISTINCT FROM src;",
+    "CREATE INDEX IF NOT EXISTS images_content_sha256_idx ON images (content_sha256);",
+]
+
+# the price history, partitioned by month, looked up by variant
+HISTORY_TABLE = [
+    """
+    CREATE TABLE IF NOT EXISTS variant_history (
+        store VARCHAR NOT NULL,
+        variant_id BIGINT NOT NULL,
+        product_id BIGINT,
+        observed_at TIMESTAMPTZ NOT NULL,
+        variant_price REAL,
+        variant_compare_at_price REAL,
+        variant_available BOOLEAN
+    ) PARTITION BY RANGE (observed_at);
+    """,
+    "CREATE TABLE IF NOT EXISTS variant_history_default PARTITION OF variant_history DEFAULT;",
+    "CREATE INDEX IF NOT EXISTS variant_history_variant_idx ON variant_history (variant_id, observed_at);",
+]
+
+MIGRATIONS = [
+    (1, "store column", [
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS store VARCHAR NOT NULL DEFAULT '';"
+        for table_name in DATA_TABLES
+    ]),
+    (2, "JSONB columns", [
+        f"ALTER TABLE {table_name} " + ", ".join(f"ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb" for column in columns) + ";"
+        for table_name, columns in JSON_COLUMNS.items()
+    ]),
+    (3, "indexes", INDEXES),
+    (4, "image assets", [
+        "ALTER TABLE images ADD COLUMN IF NOT EXISTS byte_size BIGINT, ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64), "
+        "ADD COLUMN IF NOT EXISTS asset_src VARCHAR;",
+    ] + ASSET_INDEXES),
+    (5, "variant history", HISTORY_TABLE),
+    (6, "image asset extension", ["ALTER TABLE images ADD COLUMN IF NOT EXISTS asset_extension VARCHAR;"]),
+]
+
+# serializes the migrations of the writers connecting at the same time
+MIGRATIONS_LOCK = 72_184_113
+
+
+def partition_name(table_name: str, store: str) -> str:
+    """
+    Builds the name of a store's partition of a table.
+
+    Args:
+        table_name (str): "products", "variants", or "images".
+        store (str): The store URL.
+
+    Returns:
+        str: The partition name, stable for the store and valid whatever characters its URL has.
+    """
+    return f"{table_name}_p_{hashlib.md5(store.encode()).hexdigest()[:16]}"
+
+
+def history_partition_name(month: date) -> str:
+    """
+    Builds the name of a month's partition of the variant_history table.
+
+    Args:
+        month (date): Any day of the month.
+
+    Returns:
+        str: The partition name, e.g. "variant_history_y2024m11".
+    """
+    return f"variant_history_y{month.year}m{month.month:02d}"
+
+
+def quote_literal(value: str) -> str:
+    """
+    Quotes a string as an SQL literal, for the statements that can't take parameters.
+
+    Args:
+        value (str): The string.
+
+    Returns:
+        str: The quoted literal.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+class Schema_Manager:
+    """
+    Applies the schema migrations and manages the partitions by store.
+
+    Attributes:
+        engine (Engine): The engine of the target database, every call takes its own pooled connection.
+        default_stores (list): The stores left in the default partitions by create_partitions.
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        """
+        Initializes the Schema_Manager class.
+
+        Args:
+            engine (Engine): The engine of the target database.
+        """
+        self.engine = engine
+        self.default_stores = []
+
+    def version(self) -> int:
+        """
+        Reads the version of the schema.
+
+        Returns:
+            int: The version of the last migration applied, 0 for a database never migrated.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock);"), {"lock": MIGRATIONS_LOCK})
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """))
+            return connection.execute(text("SELECT coalesce(max(version), 0) FROM schema_migrations;")).scalar()
+
+    def migrate(self) -> list:
+        """
+        Applies the migrations not yet applied, each in its own transaction.
+
+        Returns:
+            list: The descriptions of the migrations applied.
+        """
+        applied = []
+        if self.version() >= MIGRATIONS[-1][0]:
+            return applied
+        for version, description, statements in MIGRATIONS:
+            with self.engine.begin() as connection:
+                connection.execute(text("SELECT pg_advisory_xact_lock(:lock);"), {"lock": MIGRATIONS_LOCK})
+                # another writer may have applied it while this one waited for the lock
+                if connection.execute(text("SELECT 1 FROM schema_migrations WHERE version = :version;"), {"version": version}).first():
+                    continue
+                for statement in statements:
+                    connection.execute(text(statement))
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description);"),
+                    {"version": version, "description": description}
+                )
+            print(f"applied schema migration {version}: {description}")
+            applied.append(description)
+        return applied
+
+    def is_partitioned(self) -> bool:
+        """
+        Checks whether the products table is partitioned by store.
+
+        Returns:
+            bool: True once partition_by_store was run.
+        """
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('products');")
+            ).first() is not None
+
+    def partition_by_store(self) -> int:
+        """
+        Rebuilds the products, variants, and images tables partitioned by list of store, in one transaction.
+
+        The rows are copied into one partition per store, the rows without a
+        store into the default partition, and the primary keys become (store, id).
+        The tables are locked while they are rebuilt.
+
+        Returns:
+            int: The number of stores partitions created per table, 0 if the tables were already partitioned.
+        """
+        if self.is_partitioned():
+            return 0
+        self.migrate()
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock);"), {"lock": MIGRATIONS_LOCK})
+            stores = connection.execute(text(
+                " UNION ".join(f"SELECT DISTINCT store FROM {table_name}" for table_name in DATA_TABLES) + ";"
+            )).scalars().all()
+            stores = [store for store in stores if store]
+            # dropped with the old tables and added back on the new keys
+            for table_name in reversed(DATA_TABLES):
+                connection.execute(text(f"""
+                    CREATE TABLE {table_name}_partitioned (LIKE {table_name} INCLUDING DEFAULTS, PRIMARY KEY (store, id))
+                    PARTITION BY LIST (store);
+                """))
+                connection.execute(text(f"CREATE TABLE {table_name}_default PARTITION OF {table_name}_partitioned DEFAULT;"))
+                for store in stores:
+                    connection.execute(text(
+                        f"CREATE TABLE {partition_name(table_name, store)} PARTITION OF {table_name}_partitioned "
+                        f"FOR VALUES IN ({quote_literal(store)});"
+                    ))
+                connection.execute(text(f"INSERT INTO {table_name}_partitioned SELECT * FROM {table_name};"))
+                connection.execute(text(f"DROP TABLE {table_name} CASCADE;"))
+                connection.execute(text(f"ALTER TABLE {table_name}_partitioned RENAME TO {table_name};"))
+                connection.execute(text(f"ALTER TABLE {table_name} RENAME CONSTRAINT {table_name}_partitioned_pkey TO {table_name}_pkey;"))
+            connection.execute(text(
+                "ALTER TABLE variants ADD FOREIGN KEY (store, product_id) REFERENCES products (store, id);"
+            ))
+            for statement in INDEXES + ASSET_INDEXES:
+                connection.execute(text(statement))
+        print(f"partitioned {', '.join(DATA_TABLES)} by store: {len(stores)} stores")
+        return len(stores)
+
+    def create_partitions(self, stores: list) -> int:
+        """
+        Creates the partitions of the stores that don't have one yet, if the tables are partitioned.
+
+        A store whose rows were written to the default partitions before its
+        partition existed is left there, as they would keep its partition
+        from being created, and reported in `default_stores`.
+
+        Args:
+            stores (list): The store URLs.
+
+        Returns:
+            int: The number of stores whose partitions were created.
+        """
+        if not stores or not self.is_partitioned():
+            return 0
+        stores = list(dict.fromkeys(stores))
+        with self.engine.connect() as connection:
+            missing = set(connection.execute(
+                text("SELECT name FROM unnest(CAST(:names AS VARCHAR[])) AS name WHERE to_regclass(name) IS NULL;"),
+                {"names": [partition_name("images", store) for store in stores]}
+            ).scalars().all())
+        if not missing:
+            return 0
+        created = 0
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock);"), {"lock": MIGRATIONS_LOCK})
+            for store in [store for store in stores if partition_name("images", store) in missing]:
+                # another writer may have created it while this one waited for the lock
+                if connection.execute(text("SELECT to_regclass(:name);"), {"name": partition_name("images", store)}).scalar():
+                    continue
+                if connection.execute(text(
+                    " UNION ALL ".join(f"(SELECT 1 FROM {table_name}_default WHERE store = :store LIMIT 1)" for table_name in DATA_TABLES) + ";"
+                ), {"store": store}).first():
+                    if store not in self.default_stores:
+                        self.default_stores.append(store)
+                        print(f"store left in the default partitions, its rows were written before its partition existed: {store}")
+                    continue
+                for table_name in DATA_TABLES:
+                    connection.execute(text(
+                        f"CREATE TABLE {partition_name(table_name, store)} PARTITION OF {table_name} "
+                        f"FOR VALUES IN ({quote_literal(store)});"
+                    ))
+                created += 1
+        return created
+
+    def create_history_partitions(self, months: int = 2) -> int:
+        """
+        Creates the monthly partitions of the variant_history table that don't exist yet.
+
+        A month whose rows already landed in the default partition is left there,
+        as they would keep its partition from being created.
+
+        Args:
+            months (int): The number of months partitioned, from the current one.
+
+        Returns:
+            int: The number of partitions created.
+        """
+        today = date.today()
+        created = 0
+        with self.engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock);"), {"lock": MIGRATIONS_LOCK})
+            for offset in range(months):
+                year, month = divmod(today.month - 1 + offset, 12)
+                start = date(today.year + year, month + 1, 1)
+                end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+                if connection.execute(text("SELECT to_regclass(:name);"), {"name": history_partition_name(start)}).scalar():
+                    continue
+                if connection.execute(text(
+                    "SELECT 1 FROM variant_history_default WHERE observed_at >= :start AND observed_at < :end LIMIT 1;"
+                ), {"start": start, "end": end}).first():
+                    continue
+                connection.execute(text(
+                    f"CREATE TABLE {history_partition_name(start)} PARTITION OF variant_history "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');"
+                ))
+                created += 1
+        return created
+
+    def status(self) -> str:
+        """
+        Builds the summary of the schema.
+
+        Returns:
+            str: The schema version, whether the tables are partitioned, and the number of stores partitions.
+        """
+        version = self.version()
+        partitioned = self.is_partitioned()
+        with self.engine.connect() as connection:
+            partitions = connection.execute(text(
+                "SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass('products');"
+            )).scalar()
+        return (
+            f"{'-'*50}\nschema\nversion: {version} of {MIGRATIONS[-1][0]}\n"
+            f"partitioned by store: {partitioned}\nstores partitions: {max(partitions - 1, 0)}\n{'-'*50}\n"
+        )
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+    from save_to_sql_db import Write_to_DB
+
+    parser = argparse.ArgumentParser(description="migrate the database schema in place.")
+    parser.add_argument("--partition-by-store", action="store_true",
+                        help="rebuild the products, variants, and images tables partitioned by store, locking them meanwhile.")
+    args = parser.parse_args()
+
+    db_info = dotenv_values(".env")
+    # creating the tables also applies the pending migrations
+    write_to_db = Write_to_DB(
+        db_info["db_user_name"],
+        db_info["db_password"],
+        db_info["db_port"],
+        db_info["db_name"],
+        host=db_info.get("db_host", "localhost")
+        )
+    schema_manager = Schema_Manager(write_to_db.engine)
+    if args.partition_by_store:
+        schema_manager.partition_by_store()
+    print(schema_manager.status())
+    write_to_db.terminate_connection()
@@ -1,18 +1,148 @@
 """separates a products list into products, variants, and images lists.
 
-through Products_Data_Extractors class it will connect to a the products,
-variants, and images tables if they exist or create them and
-stores the scraped products data in them.
+the extract_page function turns one page of raw products into its
+products, variants, and images lists without keeping any state, so
+pages can be extracted from several threads at once, or across all the
+cores with extract_pages_parallel. the Products_Data_Extractors class
+wraps it for the callers that accumulate pages and empty the lists
+themselves.
 
 Typical usage example:
-    
+
     p_d_extractors = Products_Data_Extractors()
     products_list, variants_list, images_list = p_d_extractors.get_products_data_sql(row_products_list)
+
+    or, without any state:
+
+    products_list, variants_list, images_list = extract_page(row_products_list)
+
+    or, to extract many pages across all the cores:
+
+    with ProcessPoolExecutor() as executor:
+        for products_list, variants_list, images_list in extract_pages_parallel(pages, executor):
+            ...
+
+    or, to get whole pages as column-oriented buffers instead of row dicts:
+
+    columns_batch = p_d_extractors.get_products_columns([row_products_list])
 """
 
-import re
-import json
+from concurrent.futures import Executor
 from validation_and_cleansing import Products, Variants, Images
+from columnar import Columnar_Batch, extract_columns
+from metrics import timed, record_extraction
+
+
+def extract_product(product: dict) -> dict:
+    """
+    Extracts the product data of a raw product.
+
+    Args:
+        product (dict): The raw product dictionary.
+
+    Returns:
+        dict: The product dict.
+    """
+    return Products(
+        id = product["id"],
+        product_publish_date = product.get("published_at"),
+        product_vendor = product.get("vendor"),
+        product_type = product.get("product_type"),
+        product_tags = product.get("tags"),
+        product_options = product.get("options"),
+        product_page = product.get("handle"),
+        product_description = product.get("body_html"),
+        product_title = product.get("title"),
+        images_ids = product.get("images")
+    ).as_dict()
+
+
+def extract_variants(product: dict) -> list:
+    """
+    Extracts the variants data of a raw product.
+
+    Args:
+        product (dict): The product dictionary containing variant data.
+
+    Returns:
+        list: List of variant dicts.
+    """
+    return [
+        Variants(
+            id = variant["id"],
+            product_id = variant["product_id"],
+            variant_title = variant.get("title"),
+            variant_price = variant.get("price"),
+            variant_compare_at_price = variant.get("compare_at_price"),
+            variant_sku = variant["sku"],
+            variant_created_at = variant.get("created_at"),
+            variant_updated_at = variant.get("updated_at"),
+            variant_available = variant.get("available")
+        ).as_dict()
+        for variant in product.get("variants")
+    ]
+
+
+def extract_images(product: dict) -> list:
+    """
+    Extracts the images data of a raw product.
+
+    Args:
+        product (dict): The product dictionary containing image data.
+
+    Returns:
+        list: List of image dicts, empty if the product has no images.
+    """
+    images = product.get("images")
+    if images is None:
+        return []
+    return [
+        Images(
+            id = image["id"],
+            created_at = image.get("created_at"),
+            updated_at = image.get("updated_at"),
+            variant_ids = image.get("variant_ids"),
+            src = image.get("src"),
+            width = image.get("width"),
+            height = image.get("height")
+        ).as_dict()
+        for image in images
+    ]
+
+
+@timed("extract")
+def extract_page(row_products_list: list) -> tuple:
+    """
+    Extracts data for products, variants, and images from a page of raw product dictionaries.
+
+    Args:
+        row_products_list (list): List of raw product dictionaries.
+
+    Returns:
+        tuple: A tuple containing three new lists - products, variants, and images.
+    """
+    products_list, variants_list, images_list = [], [], []
+    for product in row_products_list:
+        products_list.append(extract_product(product))
+        variants_list.extend(extract_variants(product))
+        images_list.extend(extract_images(product))
+    record_extraction((products_list, variants_list, images_list))
+    return products_list, variants_list, images_list
+
+
+def extract_pages_parallel(pages, executor: Executor):
+    """
+    Extracts pages in the worker processes of an executor, keeping their order.
+
+    Args:
+        pages: An iterable of pages, each a list of raw product dictionaries.
+        executor (Executor): Usually a `ProcessPoolExecutor`, one page is extracted per task.
+
+    Returns:
+        An iterator of the `extract_page` tuples of the pages.
+    """
+    return executor.map(extract_page, pages)
+
 
 class Products_Data_Extractors:
     """
@@ -23,10 +153,10 @@ class Products_Data_Extractors:
         __variants_list (list): List of extracted variants.
         __images_list (list): List of extracted images.
     """
-    
-    __products_list = []
-    __variants_list = []
-    __images_list = []
+
+    def __init__(self) -> None:
+        """Initializes the extractor with its own empty lists."""
+        self.empty_all_lists()
 
     def extract_variants(self, product: dict) -> None:
         """
@@ -35,21 +165,7 @@ class Products_Data_Extractors:
         Args:
             product (dict): The product dictionary containing variant data.
         """
-        variants = product.get("variants")
-        for variant in variants:
-            self.__variants_list.append(
-                Variants(
-                    id = variant["id"],
-                    product_id = variant["product_id"],
-                    variant_title = variant.get("title"),
-                    variant_price = variant.get("price"),
-                    variant_compare_at_price = variant.get("compare_at_price"),
-                    variant_sku = variant["sku"],
-                    variant_created_at = variant.get("created_at"),
-                    variant_updated_at = variant.get("updated_at"),
-                    variant_available = variant.get("available")
-                ).as_dict()
-            )
+        self.__variants_list.extend(extract_variants(product))
 
     def extract_images(self, product: dict) -> None:
         """
@@ -58,20 +174,7 @@ class Products_Data_Extractors:
         Args:
             product (dict): The product dictionary containing image data.
         """
-        images = product.get("images")
-        if images is not None:
-            for image in images:
-                self.__images_list.append(
-                    Images(
-                        id = image["id"],
-                        created_at = image.get("created_at"),
-                        updated_at = image.get("updated_at"),
-                        variant_ids = image.get("variant_ids"),
-                        src = image.get("src"),
-                        width = image.get("width"),
-                        height = image.get("height")
-                    ).as_dict()
-                )
+        self.__images_list.extend(extract_images(product))
 
     def empty_all_lists(self) -> None:
         """
@@ -91,23 +194,20 @@ class Products_Data_Extractors:
         Returns:
             tuple: A tuple containing three lists - products, variants, and images.
         """
-        for product in row_products_list:
-            self.__products_list.append(
-                Products(
-                    id = product["id"],
-                    product_publish_date = product.get("published_at"),
-                    product_vendor = product.get("vendor"),
-                    product_type = product.get("product_type"),
-                    product_tags = product.get("tags"),
-                    product_options = product.get("options"),
-                    product_page = product.get("handle"),
-                    product_description = product.get("body_html"),
-                    product_title = product.get("title"),
-                    images_ids = product.get("images")
-                ).as_dict()
-            )
-            
-            self.extract_variants(product)
-            self.extract_images(product)
-            
+        products_list, variants_list, images_list = extract_page(row_products_list)
+        self.__products_list.extend(products_list)
+        self.__variants_list.extend(variants_list)
+        self.__images_list.extend(images_list)
         return self.__products_list, self.__variants_list, self.__images_list
+
+    def get_products_columns(self, pages: list) -> Columnar_Batch:
+        """
+        Extracts data for products, variants, and images from pages of raw product dictionaries into columns.
+
+        Args:
+            pages (list): List of pages, each a list of raw product dictionaries.
+
+        Returns:
+            Columnar_Batch: The products, variants, and images columns of all the pages.
+        """
+        return extract_columns(pages)
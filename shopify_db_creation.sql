@@ -1,45 +1,124 @@
 -- Active: 1730289566889@@127.0.0.1@5432@postgres
 CREATE DATABASE shopify;
 
+-- the tables as Write_to_DB creates and migrates them (schema.MIGRATIONS up to version 6)
 CREATE TABLE products (
-    product_id BIGINT PRIMARY KEY,
+    id BIGINT PRIMARY KEY,
     product_publish_date TIMESTAMP,
     product_vendor VARCHAR,
     product_type VARCHAR,
-    product_tags JSON,
-    product_options JSON,
+    product_tags JSONB,
+    product_options JSONB,
     product_page VARCHAR,
     product_description VARCHAR,
-    product_title VARCHAR
+    product_title VARCHAR,
+    images_ids JSONB,
+    store VARCHAR NOT NULL DEFAULT ''
 );
 
 CREATE TABLE variants (
-    product_id BIGINT REFERENCES products(product_id),
-    variant_id BIGINT PRIMARY KEY,
+    product_id BIGINT REFERENCES products(id),
+    id BIGINT PRIMARY KEY,
     variant_title VARCHAR,
     variant_price REAL,
     variant_compare_at_price REAL,
     variant_sku VARCHAR,
     variant_created_at TIMESTAMP,
     variant_updated_at TIMESTAMP,
-    variant_available BOOLEAN
+    variant_available BOOLEAN,
+    store VARCHAR NOT NULL DEFAULT ''
 );
 
 
 CREATE TABLE images (
-    image_id BIGINT PRIMARY kEY,
+    id BIGINT PRIMARY KEY,
     created_at TIMESTAMP,
     updated_at TIMESTAMP,
-    variant_ids JSON,
+    variant_ids JSONB,
     src VARCHAR,
     width INT,
-    height INT
+    height INT,
+    store VARCHAR NOT NULL DEFAULT '',
+    byte_size BIGINT,
+    content_sha256 CHAR(64),
+    asset_src VARCHAR,
+    asset_extension VARCHAR
+);
+
+CREATE INDEX products_store_idx ON products (store);
+CREATE INDEX products_tags_idx ON products USING GIN (product_tags);
+CREATE INDEX variants_product_id_idx ON variants (product_id);
+CREATE INDEX variants_store_price_idx ON variants (store, variant_price);
+CREATE INDEX variants_updated_at_idx ON variants (variant_updated_at);
+CREATE INDEX images_store_idx ON images (store);
+CREATE INDEX images_updated_at_idx ON images (updated_at);
+CREATE INDEX images_pending_assets_idx ON images (store, id) WHERE asset_src IS DISTINCT FROM src;
+CREATE INDEX images_content_sha256_idx ON images (content_sha256);
+
+-- the price history, one row per change, partitioned by month
+CREATE TABLE variant_history (
+    store VARCHAR NOT NULL,
+    variant_id BIGINT NOT NULL,
+    product_id BIGINT,
+    observed_at TIMESTAMPTZ NOT NULL,
+    variant_price REAL,
+    variant_compare_at_price REAL,
+    variant_available BOOLEAN
+) PARTITION BY RANGE (observed_at);
+CREATE TABLE variant_history_default PARTITION OF variant_history DEFAULT;
+CREATE INDEX variant_history_variant_idx ON variant_history (variant_id, observed_at);
+
+-- the crawl progress of every store, written together with its pages
+CREATE TABLE crawl_checkpoints (
+    store VARCHAR PRIMARY KEY,
+    last_page INT NOT NULL DEFAULT 0,
+    last_product_id BIGINT,
+    status VARCHAR NOT NULL DEFAULT 'in_progress',
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- the latest updated_at stored per store, for the incremental crawls
+CREATE TABLE crawl_watermarks (
+    store VARCHAR PRIMARY KEY,
+    high_water_mark TIMESTAMPTZ
 );
 
+-- the content hashes of the products written, for the dedup of the unchanged ones
+CREATE TABLE product_hashes (
+    id BIGINT PRIMARY KEY,
+    content_hash BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- the stores queue of the distributed workers, created by work_queue.Work_Queue
+CREATE TABLE crawl_queue (
+    store VARCHAR PRIMARY KEY,
+    status VARCHAR NOT NULL DEFAULT 'queued',
+    worker VARCHAR,
+    lease_expires_at TIMESTAMPTZ,
+    attempts INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX crawl_queue_status_idx ON crawl_queue (status, lease_expires_at);
+
+CREATE TABLE schema_migrations (
+    version INT PRIMARY KEY,
+    description VARCHAR,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO schema_migrations (version, description) VALUES (1, 'store column'), (2, 'JSONB columns'), (3, 'indexes'), (4, 'image assets'), (5, 'variant history'), (6, 'image asset extension');
+
+-- to partition the tables by store run `python schema.py --partition-by-store`
+
 
 -- test the tables
 select* from products;
 select* from variants;
 select* from images;
 
-
+-- all the variants in stock of a store under $50
+select* from variants where store = 'https://example.com/' and variant_available and variant_price < 50;
+-- the products tagged "sale"
+select* from products where product_tags ? 'sale';
+-- the price series of a variant
+select observed_at, variant_price, variant_compare_at_price, variant_available from variant_history where variant_id = 123 order by observed_at;
@@ -0,0 +1,541 @@
+"""writes the crawled pages to local files instead of the database.
+
+a sink is where the crawl engines write the extracted pages, through the
+calls of Write_to_DB: write_page, start_checkpoint, finish_checkpoint,
+get_checkpoints, get_watermark, set_watermark, summary, and
+terminate_connection, with its `incremental` and `pool_size` attributes.
+Write_to_DB and Pooled_Writer are the postgres sinks, and the File_Sink
+classes write every table under `output_dir`, partitioned hive-style by
+store and crawl date, so pyarrow, spark, or duckdb read them as one
+dataset per table:
+
+    crawl output/variants/store=https%3A%2F%2Fexample.com%2F/date=2024-10-30/part-00000.parquet
+
+    - Parquet_Sink buffers the rows of every store and table and writes
+      them to one parquet file per partition in row groups of
+      `row_group_size` rows, with typed columns: the dates are UTC
+      timestamps, the tags and ids lists are lists, and the product
+      options are JSON text. the store is the partition value, so it
+      isn't repeated in the files.
+    - Jsonl_Sink writes every row as a line of JSON, the store
+      included, through a zstd stream per partition.
+
+the file sinks keep no state across runs, so they don't support
+incremental, dedup, or resumed crawls, and every run writes new part
+files next to the ones already there. the files of a store are closed
+when its checkpoint is finished, and the rows buffered for it are lost
+if the crawl crashes before.
+
+Typical usage example:
+
+    sink = get_sink("parquet", "crawl output", row_group_size=100_000)
+    sink.start_checkpoint(store_products_API)
+    sink.write_page(products_list, variants_list, images_list, store_products_API, page_number, last_product_id)
+    sink.finish_checkpoint(store_products_API, "done")
+    print(sink.summary())
+    sink.terminate_connection()
+"""
+
+from abc import ABC, abstractmethod
+from json_backend import dumps
+from metrics import registry, timed
+from datetime import datetime, timezone
+from typing import Optional
+from time import perf_counter
+from urllib.parse import quote
+import io
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # the parquet sink is only available with pyarrow installed
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    # the jsonl sink is only available with zstandard installed
+    zstandard = None
+
+# the tables of a page, in the order of write_page's lists
+TABLES = ["products", "variants", "images"]
+
+
+def available_sinks() -> list:
+    """
+    Lists the sinks that can be used.
+
+    Returns:
+        list: The names of the sinks, "postgres" and the file sinks whose library is installed.
+    """
+    sinks = ["postgres"]
+    if pyarrow is not None:
+        sinks.append("parquet")
+    if zstandard is not None:
+        sinks.append("jsonl")
+    return sinks
+
+
+def get_sink(name: str, output_dir: str, **kwargs):
+    """
+    Builds a file sink.
+
+    Args:
+        name (str): "parquet" or "jsonl".
+        output_dir (str): The directory the tables are written under.
+        **kwargs: The arguments of the sink's class.
+
+    Returns:
+        File_Sink: The sink.
+
+    Raises:
+        ValueError: If the sink is unknown or its library is not installed.
+    """
+    if name not in available_sinks() or name == "postgres":
+        raise ValueError(f"the {name} file sink is not available, available: {available_sinks()[1:]}")
+    if name == "parquet":
+        return Parquet_Sink(output_dir, **kwargs)
+    return Jsonl_Sink(output_dir, **kwargs)
+
+
+class File_Sink(ABC):
+    """
+    The partitioning, bookkeeping, and summary shared by the file sinks.
+
+    Attributes:
+        name (str): The sink's name.
+        extension (str): The extension of the part files.
+        output_dir (str): The directory the tables are written under.
+        incremental (bool): Always False, the file sinks keep no watermarks.
+        pool_size (int): The number of pages written at once, always 1.
+        rows_written (int): The number of rows written.
+        files_written (int): The number of part files closed.
+        bytes_written (int): The size of the part files closed.
+        files (dict): The open part files, as (path, writer) by (table name, store, date).
+    """
+
+    name = ""
+    extension = ""
+
+    def __init__(self, output_dir: str) -> None:
+        """
+        Initializes the File_Sink class.
+
+        Args:
+            output_dir (str): The directory the tables are written under, created if missing.
+        """
+        self.output_dir = output_dir
+        self.incremental = False
+        self.pool_size = 1
+        self.rows_written = 0
+        self.files_written = 0
+        self.bytes_written = 0
+        self.__first_write_at = None
+        self.__last_write_at = None
+        self.files = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def partition_dir(self, table_name: str, store: str, date: str) -> str:
+        """
+        Builds the directory of a table's partition.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            store (str): The store URL, percent-encoded into the directory name.
+            date (str): The crawl date, "YYYY-MM-DD".
+
+        Returns:
+            str: The directory path.
+        """
+        return os.path.join(self.output_dir, table_name, f"store={quote(store, safe='')}", f"date={date}")
+
+    def new_file_path(self, table_name: str, store: str, date: str) -> str:
+        """
+        Builds the path of the next part file of a partition, never overwriting the files of a previous run.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            store (str): The store URL.
+            date (str): The crawl date, "YYYY-MM-DD".
+
+        Returns:
+            str: The file path, its directory created.
+        """
+        directory = self.partition_dir(table_name, store, date)
+        os.makedirs(directory, exist_ok=True)
+        part = 0
+        while os.path.exists(os.path.join(directory, f"part-{part:05d}{self.extension}")):
+            part += 1
+        return os.path.join(directory, f"part-{part:05d}{self.extension}")
+
+    @timed("write")
+    def write_page(
+        self,
+        products_list: list,
+        variants_list: list,
+        images_list: list,
+        store: Optional[str] = None,
+        page_number: Optional[int] = None,
+        last_product_id: Optional[int] = None,
+        content_hashes: Optional[dict] = None,
+    ) -> dict:
+        """
+        Writes the products, variants, and images of a page to the partitions of its store and of today.
+
+        Args:
+            products_list (list): List of products.
+            variants_list (list): List of variants.
+            images_list (list): List of images.
+            store (Optional[str]): The store URL, '' if None.
+            page_number (Optional[int]): Unused, the file sinks keep no checkpoints.
+            last_product_id (Optional[int]): Unused.
+            content_hashes (Optional[dict]): Unused, the file sinks keep no content hashes.
+
+        Returns:
+            dict: Empty, no content hashes are stored.
+        """
+        if self.__first_write_at is None:
+            self.__first_write_at = perf_counter()
+        date = datetime.now(timezone.utc).date().isoformat()
+        for table_name, items_list in zip(TABLES, (products_list, variants_list, images_list)):
+            if items_list:
+                self.write_items(table_name, store or "", date, items_list)
+                self.rows_written += len(items_list)
+                registry.increment("shopify_write_rows_total", len(items_list), table=table_name)
+        self.__last_write_at = perf_counter()
+        return {}
+
+    @abstractmethod
+    def write_items(self, table_name: str, store: str, date: str, items_list: list) -> None:
+        """
+        Writes items to a partition, implemented by every file sink.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            store (str): The store URL.
+            date (str): The crawl date, "YYYY-MM-DD".
+            items_list (list): List of items.
+        """
+
+    @abstractmethod
+    def close_file(self, key: tuple) -> None:
+        """
+        Flushes and closes an open file, implemented by every file sink.
+
+        Args:
+            key (tuple): The (table name, store, date) of the file.
+        """
+
+    def record_closed_file(self, path: str) -> None:
+        """
+        Counts a closed part file in the summary.
+
+        Args:
+            path (str): The file path.
+        """
+        self.files_written += 1
+        self.bytes_written += os.path.getsize(path)
+
+    def get_checkpoints(self) -> dict:
+        """
+        Reads the checkpoints of the stores.
+
+        Returns:
+            dict: Empty, every store is crawled from its first page.
+        """
+        return {}
+
+    def start_checkpoint(self, store: str, last_page: int = 0, last_product_id: Optional[int] = None) -> None:
+        """
+        Marks a store in progress, nothing to do for a file sink.
+        """
+
+    def finish_checkpoint(self, store: str, status: str = "done") -> None:
+        """
+        Closes the files of a store, done or failed.
+
+        Args:
+            store (str): The store URL.
+            status (str): Unused.
+        """
+        for key in [key for key in self.files if key[1] == store]:
+            self.close_file(key)
+
+    def get_watermark(self, store: str) -> None:
+        """
+        Reads the high-water mark of a store.
+
+        Returns:
+            None: The file sinks keep no watermarks.
+        """
+        return None
+
+    def set_watermark(self, store: str, high_water_mark: datetime) -> None:
+        """
+        Stores the high-water mark of a store, nothing to do for a file sink.
+        """
+
+    def commit(self) -> None:
+        """
+        Closes all the open files.
+        """
+        for key in list(self.files):
+            self.close_file(key)
+
+    def summary(self) -> str:
+        """
+        Builds the summary of the files written.
+
+        Returns:
+            str: The rows written, the rows/sec, and the files count and size.
+        """
+        elapsed = self.__last_write_at - self.__first_write_at if self.__first_write_at is not None else 0.0
+        rows_per_second = self.rows_written / elapsed if elapsed else 0.0
+        return (
+            f"{'-'*50}\n{self.name} files\n"
+            f"directory: {self.output_dir}\nrows written: {self.rows_written}\nrows/sec: {rows_per_second:.0f}\n"
+            f"files: {self.files_written}\nsize: {self.bytes_written / 1_000_000:.2f} MB\n{'-'*50}\n"
+        )
+
+    def terminate_connection(self) -> None:
+        """
+        Closes all the open files.
+        """
+        self.commit()
+
+
+class Jsonl_Sink(File_Sink):
+    """
+    Writes every row as a line of JSON through a zstd stream per partition.
+
+    Attributes:
+        level (int): The zstd compression level.
+    """
+
+    name = "jsonl"
+    extension = ".jsonl.zst"
+
+    def __init__(self, output_dir: str, level: int = 3) -> None:
+        """
+        Initializes the Jsonl_Sink class.
+
+        Args:
+            output_dir (str): The directory the tables are written under.
+            level (int): The zstd compression level, 1 to 22.
+
+        Raises:
+            ValueError: If zstandard isn't installed.
+        """
+        if zstandard is None:
+            raise ValueError("the jsonl sink needs the zstandard package")
+        super().__init__(output_dir)
+        self.level = level
+
+    def write_items(self, table_name: str, store: str, date: str, items_list: list) -> None:
+        """
+        Appends the items to the zstd stream of their partition.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            store (str): The store URL.
+            date (str): The crawl date, "YYYY-MM-DD".
+            items_list (list): List of items.
+        """
+        key = (table_name, store, date)
+        if key not in self.files:
+            path = self.new_file_path(table_name, store, date)
+            # a compressor holds the state of one stream, the open files can't share it
+            compressor = zstandard.ZstdCompressor(level=self.level)
+            self.files[key] = (path, io.TextIOWrapper(compressor.stream_writer(open(path, "wb")), encoding="utf-8"))
+        stream = self.files[key][1]
+        for item in items_list:
+            item["store"] = store
+            stream.write(dumps(item) + "\n")
+
+    def close_file(self, key: tuple) -> None:
+        """
+        Ends the zstd frame of a partition and closes its file.
+
+        Args:
+            key (tuple): The (table name, store, date) of the file.
+        """
+        path, stream = self.files.pop(key)
+        stream.close()
+        self.record_closed_file(path)
+
+
+class Parquet_Sink(File_Sink):
+    """
+    Writes the rows to one parquet file per partition, in row groups of `row_group_size` rows.
+
+    Attributes:
+        row_group_size (int): The number of rows buffered before a row group is written.
+        compression (str): The parquet compression codec.
+        schemas (dict): The arrow schema of every table.
+    """
+
+    name = "parquet"
+    extension = ".parquet"
+
+    def __init__(self, output_dir: str, row_group_size: int = 100_000, compression: str = "zstd") -> None:
+        """
+        Initializes the Parquet_Sink class.
+
+        Args:
+            output_dir (str): The directory the tables are written under.
+            row_group_size (int): The number of rows of a row group.
+            compression (str): The parquet compression codec, "zstd", "snappy", "gzip", or "none".
+
+        Raises:
+            ValueError: If pyarrow isn't installed.
+        """
+        if pyarrow is None:
+            raise ValueError("the parquet sink needs the pyarrow package")
+        super().__init__(output_dir)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        timestamp = pyarrow.timestamp("us", tz="UTC")
+        self.schemas = {
+            "products": pyarrow.schema([
+                ("id", pyarrow.int64()),
+                ("product_publish_date", timestamp),
+                ("product_vendor", pyarrow.string()),
+                ("product_type", pyarrow.string()),
+                ("product_tags", pyarrow.list_(pyarrow.string())),
+                ("product_options", pyarrow.string()),
+                ("product_page", pyarrow.string()),
+                ("product_description", pyarrow.string()),
+                ("product_title", pyarrow.string()),
+                ("images_ids", pyarrow.list_(pyarrow.int64())),
+            ]),
+            "variants": pyarrow.schema([
+                ("product_id", pyarrow.int64()),
+                ("id", pyarrow.int64()),
+                ("variant_title", pyarrow.string()),
+                ("variant_price", pyarrow.float64()),
+                ("variant_compare_at_price", pyarrow.float64()),
+                ("variant_sku", pyarrow.string()),
+                ("variant_created_at", timestamp),
+                ("variant_updated_at", timestamp),
+                ("variant_available", pyarrow.bool_()),
+            ]),
+            "images": pyarrow.schema([
+                ("id", pyarrow.int64()),
+                ("created_at", timestamp),
+                ("updated_at", timestamp),
+                ("variant_ids", pyarrow.list_(pyarrow.int64())),
+                ("src", pyarrow.string()),
+                ("width", pyarrow.int32()),
+                ("height", pyarrow.int32()),
+            ]),
+        }
+        # the rows waiting for a full row group by (table name, store, date)
+        self.__buffers = {}
+
+    def write_items(self, table_name: str, store: str, date: str, items_list: list) -> None:
+        """
+        Buffers the items of a partition, writing a row group every `row_group_size` rows.
+
+        Args:
+            table_name (str): "products", "variants", or "images".
+            store (str): The store URL.
+            date (str): The crawl date, "YYYY-MM-DD".
+            items_list (list): List of items.
+        """
+        key = (table_name, store, date)
+        buffer = self.__buffers.setdefault(key, [])
+        buffer.extend(items_list)
+        while len(buffer) >= self.row_group_size:
+            self.__write_row_group(key, buffer[:self.row_group_size])
+            del buffer[:self.row_group_size]
+
+    def __write_row_group(self, key: tuple, items_list: list) -> None:
+        """
+        Writes items as one row group of their partition's file, opening it if needed.
+
+        Args:
+            key (tuple): The (table name, store, date) of the file.
+            items_list (list): List of items.
+        """
+        table_name = key[0]
+        schema = self.schemas[table_name]
+        if key not in self.files:
+            path = self.new_file_path(*key)
+            self.files[key] = (path, pyarrow.parquet.ParquetWriter(path, schema, compression=self.compression))
+        columns = [self.__column(items_list, field) for field in schema]
+        self.files[key][1].write_table(pyarrow.Table.from_arrays(columns, schema=schema), row_group_size=len(items_list))
+
+    def __column(self, items_list: list, field):
+        """
+        Builds the arrow array of a column.
+
+        Args:
+            items_list (list): List of items.
+            field (pyarrow.Field): The column's field.
+
+        Returns:
+            pyarrow.Array: The column, the dates parsed from their ISO 8601 text.
+        """
+        values = [item.get(field.name) for item in items_list]
+        if field.name == "product_options":
+            return pyarrow.array([dumps(value) if value is not None else None for value in values], pyarrow.string())
+        if pyarrow.types.is_timestamp(field.type):
+            try:
+                return pyarrow.array(values, pyarrow.string()).cast(field.type)
+            except pyarrow.ArrowInvalid:
+                # a malformed date is stored as null instead of failing the whole row group
+                return pyarrow.array([self.__timestamp(value, field.type) for value in values], field.type)
+        return pyarrow.array(values, field.type)
+
+    def __timestamp(self, value: Optional[str], timestamp_type):
+        """
+        Parses one date, None if it's missing or malformed.
+
+        Args:
+            value (Optional[str]): The ISO 8601 date.
+            timestamp_type (pyarrow.DataType): The timestamp type.
+
+        Returns:
+            Optional[datetime]: The parsed date, None if it's missing or malformed.
+        """
+        try:
+            return pyarrow.scalar(value, pyarrow.string()).cast(timestamp_type).as_py()
+        except (pyarrow.ArrowInvalid, TypeError):
+            return None
+
+    def close_file(self, key: tuple) -> None:
+        """
+        Writes the buffered rows of a partition as its last row group and closes its file.
+
+        Args:
+            key (tuple): The (table name, store, date) of the file.
+        """
+        if self.__buffers.get(key):
+            self.__write_row_group(key, self.__buffers[key])
+        self.__buffers.pop(key, None)
+        if key in self.files:
+            path, writer = self.files.pop(key)
+            writer.close()
+            self.record_closed_file(path)
+
+    def finish_checkpoint(self, store: str, status: str = "done") -> None:
+        """
+        Writes the buffered rows of a store and closes its files, done or failed.
+
+        Args:
+            store (str): The store URL.
+            status (str): Unused.
+        """
+        for key in [key for key in self.__buffers if key[1] == store]:
+            self.close_file(key)
+        super().finish_checkpoint(store, status)
+
+    def commit(self) -> None:
+        """
+        Writes all the buffered rows and closes all the open files.
+        """
+        for key in list(self.__buffers):
+            self.close_file(key)
+        super().commit()
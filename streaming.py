@@ -0,0 +1,327 @@
+"""parses the `products.json` pages while they are downloaded, one product at a time.
+
+through the Products_Stream_Parser class it will take the chunks of a
+response body as they arrive and return the products completed by each
+chunk, with ijson when it is installed, or else by decoding every
+product of the "products" array with the standard JSONDecoder as soon
+as its closing brace arrived. the closing brace is found by a scan
+counting the braces outside of the strings, which resumes where the
+previous chunk left it, so a product is only decoded once, when it is
+complete.
+
+stream_page builds a Streamed_Page out of the chunks: every product is
+extracted into its product, variants, and images dicts as soon as it is
+parsed and then dropped, so neither the whole body nor the raw products
+of a page are ever held in memory, only the records of the page.
+
+a Streamed_Page is the list of the extracted product dicts of the page,
+so the pagination reads its length and ids like a list of raw products,
+and it carries the variants and images lists along. stream_page_async
+parses and extracts the chunks in a worker thread, so the event loop
+keeps serving the other requests.
+
+Typical usage example:
+
+    page = stream_page(response.iter_content(STREAM_CHUNK_SIZE))
+    or, with aiohttp:
+    page = await stream_page_async(response.content.iter_chunked(STREAM_CHUNK_SIZE))
+
+    (products_list, variants_list, images_list), content_hashes = page.extracted_lists()
+"""
+
+from scraper import extract_product, extract_variants, extract_images
+from dedup import content_hash
+from metrics import registry, record_extraction
+import asyncio
+import codecs
+import json
+import re
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# the bytes read from the socket at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+PRODUCTS_ARRAY = re.compile(r'"products"\s*:\s*\[')
+# the characters the scan for the end of a product stops at, inside and outside of a string
+STRING_SPECIALS = re.compile(r'["\\]')
+OBJECT_SPECIALS = re.compile(r'[{}"]')
+
+
+class Products_Stream_Parser:
+    """
+    Parses the products array of a `products.json` body fed chunk by chunk.
+
+    Attributes:
+        backend (str): "ijson" or "json", the library doing the parsing.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the Products_Stream_Parser class.
+        """
+        self.backend = "ijson" if ijson is not None else "json"
+        if ijson is not None:
+            self.__products = ijson.sendable_list()
+            self.__coroutine = ijson.items_coro(self.__products, "products.item", use_float=True)
+        else:
+            self.__text_decoder = codecs.getincrementaldecoder("utf-8")()
+            self.__json_decoder = json.JSONDecoder()
+            self.__buffer = ""
+            self.__in_array = False
+            self.__done = False
+            # the scan of the product at the start of the buffer
+            self.__scanned = 0
+            self.__depth = 0
+            self.__in_string = False
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Parses the next chunk of the body.
+
+        Args:
+            chunk (bytes): The chunk, in the order it was received.
+
+        Returns:
+            list: The raw product dictionaries completed by the chunk.
+
+        Raises:
+            ValueError: If the body isn't valid JSON.
+        """
+        if ijson is not None:
+            try:
+                self.__coroutine.send(chunk)
+            except ijson.JSONError as e:
+                raise ValueError(str(e)) from e
+            products = list(self.__products)
+            del self.__products[:]
+            return products
+        self.__buffer += self.__text_decoder.decode(chunk)
+        return self.__parse_buffer()
+
+    def close(self) -> None:
+        """
+        Checks the body ended after the products array.
+
+        Raises:
+            ValueError: If the body ended before the products array was closed.
+        """
+        if ijson is not None:
+            try:
+                self.__coroutine.close()
+            except ijson.JSONError as e:
+                raise ValueError(str(e)) from e
+        elif not self.__done:
+            raise ValueError("the response ended before the products array was closed")
+
+    def __parse_buffer(self) -> list:
+        """
+        Decodes the products completed in the buffer and drops them from it.
+
+        Returns:
+            list: The raw product dictionaries decoded.
+        """
+        products = []
+        if self.__done:
+            return products
+        if not self.__in_array:
+            match = PRODUCTS_ARRAY.search(self.__buffer)
+            if match is None:
+                # the key may be split across two chunks
+                self.__buffer = self.__buffer[-32:]
+                return products
+            self.__buffer = self.__buffer[match.end():]
+            self.__in_array = True
+        buffer, position = self.__buffer, 0
+        while True:
+            if self.__depth == 0:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position == len(buffer):
+                    break
+                if buffer[position] == "]":
+                    self.__done = True
+                    break
+                if buffer[position] != "{":
+                    raise ValueError(f"expected a product object at {buffer[position:position + 20]!r}")
+                self.__scanned = position
+            end = self.__product_end(buffer)
+            if end is None:
+                # the product isn't complete yet, the scan goes on with the next chunk
+                break
+            try:
+                product, position = self.__json_decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                raise ValueError(str(e)) from e
+            products.append(product)
+        self.__buffer = buffer[position:]
+        self.__scanned -= position
+        return products
+
+    def __product_end(self, buffer: str) -> int:
+        """
+        Scans the product at the start of the buffer for its closing brace, from where the last scan stopped.
+
+        Args:
+            buffer (str): The buffer.
+
+        Returns:
+            int: The position after the closing brace, None if the product isn't complete yet.
+        """
+        position = self.__scanned
+        while True:
+            if self.__in_string:
+                match = STRING_SPECIALS.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() == len(buffer):
+                        # the escaped character is in the next chunk
+                        position = match.start()
+                        break
+                    position = match.end() + 1
+                    continue
+                self.__in_string = False
+                position = match.end()
+                continue
+            match = OBJECT_SPECIALS.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            position = match.end()
+            if match.group() == '"':
+                self.__in_string = True
+            elif match.group() == "{":
+                self.__depth += 1
+            else:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.__scanned = position
+                    return position
+        self.__scanned = position
+        return None
+
+
+class Streamed_Page(list):
+    """
+    The extracted product dicts of a page, with its variants and images.
+
+    Attributes:
+        variants_list (list): The variant dicts of the page.
+        images_list (list): The image dicts of the page.
+        content_hashes (Optional[dict]): The content hashes of the raw products by product id, None if not computed.
+    """
+
+    def __init__(self, content_hashes: bool = False) -> None:
+        """
+        Initializes the Streamed_Page class.
+
+        Args:
+            content_hashes (bool): Hash every raw product before dropping it, for a dedup.Content_Hash_Index.
+        """
+        super().__init__()
+        self.variants_list = []
+        self.images_list = []
+        self.content_hashes = {} if content_hashes else None
+
+    def add(self, product: dict) -> None:
+        """
+        Extracts a raw product into the page.
+
+        Args:
+            product (dict): The raw product dictionary.
+        """
+        if self.content_hashes is not None:
+            self.content_hashes[product["id"]] = content_hash(product)
+        self.append(extract_product(product))
+        self.variants_list.extend(extract_variants(product))
+        self.images_list.extend(extract_images(product))
+
+    def extracted_lists(self, content_hash_index=None) -> tuple:
+        """
+        Gives the products, variants, and images lists of the page.
+
+        Args:
+            content_hash_index (Content_Hash_Index): Drops the products whose content is unchanged, None keeps them all.
+
+        Returns:
+            tuple: The products, variants, and images lists, and the dict of the kept products hashes by product id.
+        """
+        if content_hash_index is None or self.content_hashes is None:
+            return (list(self), self.variants_list, self.images_list), self.content_hashes
+        changed_hashes = content_hash_index.filter_hashes(self.content_hashes)
+        products_list = [product for product in self if product["id"] in changed_hashes]
+        images_ids = {image_id for product in products_list for image_id in product["images_ids"]}
+        variants_list = [variant for variant in self.variants_list if variant["product_id"] in changed_hashes]
+        images_list = [image for image in self.images_list if image["id"] in images_ids]
+        return (products_list, variants_list, images_list), changed_hashes
+
+
+def feed_page(parser: Products_Stream_Parser, page: Streamed_Page, chunk: bytes) -> None:
+    """
+    Parses a chunk and extracts the products it completed into the page.
+
+    Args:
+        parser (Products_Stream_Parser): The parser of the page's body.
+        page (Streamed_Page): The page.
+        chunk (bytes): The next chunk of the body.
+    """
+    for product in parser.feed(chunk):
+        page.add(product)
+
+
+def stream_page(chunks, content_hashes: bool = False) -> Streamed_Page:
+    """
+    Parses and extracts a page from the chunks of its body.
+
+    Args:
+        chunks: An iterable of the body's bytes chunks.
+        content_hashes (bool): Hash every raw product before dropping it, for a dedup.Content_Hash_Index.
+
+    Returns:
+        Streamed_Page: The extracted page.
+
+    Raises:
+        ValueError: If the body isn't a valid `products.json` response.
+    """
+    parser = Products_Stream_Parser()
+    page = Streamed_Page(content_hashes)
+    body_size = 0
+    for chunk in chunks:
+        body_size += len(chunk)
+        feed_page(parser, page, chunk)
+    parser.close()
+    registry.increment("shopify_fetch_decoded_bytes_total", body_size)
+    record_extraction((page, page.variants_list, page.images_list))
+    return page
+
+
+async def stream_page_async(chunks, content_hashes: bool = False) -> Streamed_Page:
+    """
+    Parses and extracts a page from the chunks of its body, received asynchronously.
+
+    Args:
+        chunks: An async iterable of the body's bytes chunks, e.g. `response.content.iter_chunked(STREAM_CHUNK_SIZE)`.
+        content_hashes (bool): Hash every raw product before dropping it, for a dedup.Content_Hash_Index.
+
+    Returns:
+        Streamed_Page: The extracted page.
+
+    Raises:
+        ValueError: If the body isn't a valid `products.json` response.
+    """
+    parser = Products_Stream_Parser()
+    page = Streamed_Page(content_hashes)
+    body_size = 0
+    async for chunk in chunks:
+        body_size += len(chunk)
+        # parsed and extracted off the event loop, the next chunk is received meanwhile
+        await asyncio.to_thread(feed_page, parser, page, chunk)
+    parser.close()
+    registry.increment("shopify_fetch_decoded_bytes_total", body_size)
+    record_extraction((page, page.variants_list, page.images_list))
+    return page
@@ -0,0 +1,111 @@
+"""shared fixtures of the tests: local stores, fast request handlers, and a test database.
+
+the tests that write to postgres run against the database given by the
+`SHOPIFY_TEST_DATABASE` environment variable, as
+"user:password@host:port/db", and are skipped without it. the database
+is emptied before every test, so it must be a database of its own.
+
+    SHOPIFY_TEST_DATABASE=postgres:pw@127.0.0.1:5432/shopify_test python -m pytest -q
+"""
+
+from urllib.parse import urlsplit
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawler import Requests_Handler
+from rate_limiting import Host_Rate_Limiter
+from local_store_server import Local_Store_Server
+
+# the tables emptied before every database test
+TEST_TABLES = ["images", "variants", "products", "product_hashes", "crawl_checkpoints", "crawl_watermarks", "variant_history"]
+
+
+def fast_handler(**kwargs) -> Requests_Handler:
+    """
+    Builds a Requests_Handler that neither rate limits nor waits long between retries.
+
+    Args:
+        **kwargs: The Requests_Handler arguments overriding the fast ones.
+
+    Returns:
+        Requests_Handler: The handler.
+    """
+    options = dict(
+        rate_limiter=Host_Rate_Limiter(initial_rate=1000, max_rate=1000, burst=1000),
+        max_retries=3,
+        backoff_base=0.01,
+        backoff_cap=0.05,
+        timeout=10,
+    )
+    options.update(kwargs)
+    return Requests_Handler(**options)
+
+
+def products_count(write_to_db) -> int:
+    """
+    Counts the products stored.
+
+    Args:
+        write_to_db: The writer of the test database.
+
+    Returns:
+        int: The number of rows of the products table.
+    """
+    from sqlalchemy import text
+
+    with write_to_db.engine.connect() as connection:
+        return connection.execute(text("SELECT count(*) FROM products;")).scalar()
+
+
+@pytest.fixture
+def local_stores():
+    """Starts Local_Store_Servers built with the given arguments and stops them after the test."""
+    servers = []
+
+    def start(**kwargs) -> Local_Store_Server:
+        server = Local_Store_Server(**kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def db_info() -> dict:
+    """The connection arguments of the test database, the test is skipped without one."""
+    database = os.environ.get("SHOPIFY_TEST_DATABASE")
+    if not database:
+        pytest.skip("SHOPIFY_TEST_DATABASE is not set")
+    url = urlsplit(f"postgresql://{database}")
+    return {"user": url.username, "password": url.password, "port": str(url.port or 5432),
+            "db": url.path.strip("/"), "host": url.hostname}
+
+
+@pytest.fixture
+def write_to_db_factory(db_info, tmp_path):
+    """Builds Write_to_DB instances on the emptied test database, spooling to a temporary directory."""
+    from sqlalchemy import text
+    from save_to_sql_db import Write_to_DB
+    from dead_letter import Dead_Letter_Spool
+
+    writers = []
+
+    def build(**kwargs) -> Write_to_DB:
+        write_to_db = Write_to_DB(db_info["user"], db_info["password"], db_info["port"], db_info["db"], host=db_info["host"],
+                                  spool=Dead_Letter_Spool(str(tmp_path / "failed items")), **kwargs)
+        if not writers:
+            with write_to_db.engine.begin() as connection:
+                connection.execute(text(f"TRUNCATE {', '.join(TEST_TABLES)} CASCADE;"))
+        writers.append(write_to_db)
+        return write_to_db
+
+    yield build
+    for write_to_db in writers:
+        write_to_db.terminate_connection()
@@ -0,0 +1,31 @@
+"""tests of the bulk writes through COPY into the staging tables, on the test database."""
+
+from sqlalchemy import text
+
+from dead_letter import read_records, spool_files
+
+
+def test_failing_rows_are_bisected_out_of_the_batch(write_to_db_factory, tmp_path):
+    write_to_db = write_to_db_factory(bulk=True)
+    store = "http://copy.com/"
+    write_to_db.insert_into_table("products", [{"id": 1, "product_title": "a"}], store)
+    # the variants of a product that doesn't exist fail their foreign key
+    variants = [{"id": variant_id, "product_id": 999 if variant_id in (3, 6) else 1} for variant_id in range(1, 9)]
+
+    write_to_db.insert_into_table("variants", variants, store)
+
+    with write_to_db.engine.connect() as connection:
+        assert connection.execute(text("SELECT id FROM variants ORDER BY id;")).scalars().all() == [1, 2, 4, 5, 7, 8]
+    records = list(read_records(spool_files(str(tmp_path / "failed items"))))
+    assert sorted(record["item"]["id"] for record in records) == [3, 6]
+    assert {record["table"] for record in records} == {"variants"}
+
+
+def test_copy_keeps_the_escaped_characters(write_to_db_factory):
+    write_to_db = write_to_db_factory(bulk=True)
+    description = "tab\tnew line\nback\\slash \\N"
+
+    write_to_db.insert_into_table("products", [{"id": 1, "product_description": description, "product_tags": ["a\tb"]}], "http://copy.com/")
+
+    with write_to_db.engine.connect() as connection:
+        assert connection.execute(text("SELECT product_description, product_tags FROM products;")).one() == (description, ["a\tb"])
@@ -0,0 +1,33 @@
+"""tests of the stores checkpoints, against the local stores."""
+
+from threading import Event
+
+from conftest import fast_handler, products_count
+from main import crawl_stores_serially
+from scraper import Products_Data_Extractors
+
+
+def test_interrupted_crawl_resumes_from_its_checkpoint(local_stores, write_to_db_factory, monkeypatch):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    req_handler = fast_handler()
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    # the first crawl is stopped once its first page is written
+    stop = Event()
+    write_page = write_to_db.write_page
+
+    def write_page_then_stop(*args):
+        stop.set()
+        return write_page(*args)
+
+    monkeypatch.setattr(write_to_db, "write_page", write_page_then_stop)
+    crawl_stores_serially(server.stores_urls(), req_handler, Products_Data_Extractors(), write_to_db, stop=stop)
+    monkeypatch.undo()
+    assert write_to_db.get_checkpoints()[store_products_API]["last_page"] == 1
+
+    summary = crawl_stores_serially(server.stores_urls(), req_handler, Products_Data_Extractors(), write_to_db, resume=True)
+
+    assert "resumed after page: 1\npages scraped: 3\nproducts scraped: 350" in summary
+    assert write_to_db.get_checkpoints()[store_products_API]["status"] == "done"
+    assert products_count(write_to_db) == 600
+    assert write_to_db.spool.spooled.total() == 0
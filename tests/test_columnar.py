@@ -0,0 +1,49 @@
+"""tests of the columnar extraction of the pages and of their insertion."""
+
+import pytest
+from sqlalchemy import text
+
+from conftest import products_count
+from local_store_server import make_product
+from save_to_sql_db import Write_to_DB
+from scraper import Products_Data_Extractors, extract_page
+
+
+def synthetic_page(first_id: int, products: int) -> list:
+    """A page of synthetic products, the second one without images."""
+    page = [make_product(product_id, "store") for product_id in range(first_id, first_id + products)]
+    page[1]["images"] = []
+    return page
+
+
+def test_columns_match_the_rows_of_extract_page():
+    pages = [synthetic_page(1, 3), synthetic_page(10, 2)]
+
+    batch = Products_Data_Extractors().get_products_columns(pages)
+
+    assert len(batch) == 5
+    for table_name, items in zip(("products", "variants", "images"), extract_page(pages[0] + pages[1])):
+        columns = Write_to_DB.table_columns[table_name][1:]
+        assert list(batch.rows(table_name, columns)) == [tuple(item[column] for column in columns) for item in items]
+    # the second product of every page has no images
+    assert list(batch.variants_offsets) == [0, 3, 6, 9, 12, 15]
+    assert list(batch.images_offsets) == [0, 2, 2, 4, 6, 6]
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_insert_columns_writes_every_table(write_to_db_factory, bulk):
+    write_to_db = write_to_db_factory(bulk=bulk)
+    batch = Products_Data_Extractors().get_products_columns([synthetic_page(1, 3)])
+
+    for table_name in ("products", "variants", "images"):
+        write_to_db.insert_columns(table_name, batch, "store.com")
+
+    with write_to_db.engine.connect() as connection:
+        counts = {table_name: connection.execute(text(f"SELECT count(*) FROM {table_name} WHERE store = 'store.com';")).scalar()
+                  for table_name in ("variants", "images")}
+        # the missing compare at prices are NaN in their column and NULL in the table
+        compare_at_price = connection.execute(text("SELECT variant_compare_at_price FROM variants WHERE id = 100;")).scalar()
+    assert products_count(write_to_db) == 3
+    assert counts == {"variants": 9, "images": 4}
+    assert compare_at_price is None
+    assert write_to_db.spool.spooled.total() == 0
@@ -0,0 +1,79 @@
+"""tests of loading the spooled rows again, on the test database."""
+
+import os
+
+from sqlalchemy import text
+
+from dead_letter import Dead_Letter_Spool, retry_failed, spool_files
+from save_to_sql_db import Pooled_Writer
+
+
+def variant(variant_id: int, price: float, updated_at: str) -> dict:
+    return {"store": "http://spool.com/", "product_id": 1, "id": variant_id, "variant_price": price, "variant_updated_at": updated_at}
+
+
+def stored_prices(write_to_db) -> dict:
+    with write_to_db.engine.connect() as connection:
+        return dict(connection.execute(text("SELECT id, variant_price FROM variants;")).all())
+
+
+def test_stale_rows_never_overwrite_newer_ones(write_to_db_factory, tmp_path):
+    write_to_db = write_to_db_factory(bulk=True, incremental=True)
+    store = "http://spool.com/"
+    write_to_db.insert_into_table("products", [{"store": store, "id": 1, "product_title": "crawled since"}], store)
+    write_to_db.insert_into_table("variants", [variant(10, 2.0, "2024-06-02T10:00:00-05:00"), variant(20, 2.0, "2024-06-01T10:00:00-05:00")], store)
+    spool = Dead_Letter_Spool(str(tmp_path / "retry"))
+    spool.add("products", {"store": store, "id": 1, "product_title": "spooled"}, store)
+    # the first variant was updated since it failed, the second one wasn't
+    spool.add("variants", variant(10, 1.0, "2024-06-01T10:00:00-05:00"), store)
+    spool.add("variants", variant(20, 3.0, "2024-06-03T10:00:00-05:00"), store)
+    spool.flush()
+
+    summary = retry_failed(write_to_db, spool.directory)
+
+    assert stored_prices(write_to_db) == {10: 2.0, 20: 3.0}
+    with write_to_db.engine.connect() as connection:
+        assert connection.execute(text("SELECT product_title FROM products;")).scalar() == "crawled since"
+    assert "products: 0 retried, 0 failed again, 1 stale skipped" in summary
+    assert "variants: 1 retried, 0 failed again, 1 stale skipped" in summary
+    assert spool_files(spool.directory) == []
+
+
+def test_files_of_a_failed_batch_are_kept(write_to_db_factory, tmp_path, monkeypatch):
+    write_to_db = write_to_db_factory(bulk=True, incremental=True)
+    store = "http://spool.com/"
+    directory = str(tmp_path / "retry")
+    products_spool, images_spool = Dead_Letter_Spool(directory), Dead_Letter_Spool(directory, buffer_size=1)
+    products_spool.add("products", {"store": store, "id": 1, "product_title": "spooled"}, store)
+    products_spool.flush()
+    images_spool.add("images", {"store": store, "id": 50, "src": "https://cdn.shopify.com/50.jpg"}, store)
+    insert_into_table = write_to_db.insert_into_table
+
+    def fail_images(table_name: str, items_list: list, store: str = "") -> None:
+        if table_name == "images":
+            raise ConnectionError("connection lost")
+        insert_into_table(table_name, items_list, store)
+
+    monkeypatch.setattr(write_to_db, "insert_into_table", fail_images)
+    summary = retry_failed(write_to_db, directory)
+
+    assert "files kept: 1" in summary
+    assert spool_files(directory) == images_spool.segments
+    assert all(not os.path.exists(path) for path in products_spool.segments)
+
+
+def test_pooled_writer_loads_the_spooled_rows_with_their_store(write_to_db_factory, db_info, tmp_path, monkeypatch):
+    write_to_db_factory().terminate_connection()
+    monkeypatch.chdir(tmp_path)
+    pooled_writer = Pooled_Writer(db_info["user"], db_info["password"], db_info["port"], db_info["db"], pool_size=2, bulk=True, host=db_info["host"])
+    store = "http://spool.com/"
+    spool = Dead_Letter_Spool(str(tmp_path / "retry"))
+    spool.add("products", {"store": store, "id": 1, "product_title": "spooled"}, store)
+    spool.flush()
+
+    summary = retry_failed(pooled_writer, spool.directory)
+
+    assert "products: 1 retried, 0 failed again" in summary
+    with pooled_writer.engine.connect() as connection:
+        assert connection.execute(text("SELECT store FROM products;")).scalar() == store
+    pooled_writer.terminate_connection()
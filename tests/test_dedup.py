@@ -0,0 +1,67 @@
+"""tests of the content hash index skipping the unchanged products."""
+
+from sqlalchemy import text
+
+from conftest import fast_handler, products_count
+from dedup import Content_Hash_Index, content_hash
+from local_store_server import make_product
+from main import crawl_stores_serially
+from scraper import Products_Data_Extractors, extract_page
+
+
+def test_content_hash_ignores_the_keys_order():
+    product = make_product(1, "store")
+    reordered = dict(reversed(list(product.items())))
+    changed = make_product(1, "store")
+    changed["variants"][0]["price"] = "9.99"
+
+    assert content_hash(product) == content_hash(reordered)
+    assert content_hash(product) != content_hash(changed)
+
+
+def test_recrawl_skips_the_unchanged_products(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    content_hash_index = Content_Hash_Index(write_to_db.engine)
+
+    crawl_stores_serially(server.stores_urls(), fast_handler(), Products_Data_Extractors(), write_to_db,
+                          content_hash_index=content_hash_index)
+    with write_to_db.engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM product_hashes;")).scalar() == 600
+    assert (content_hash_index.hits, content_hash_index.misses) == (0, 600)
+
+    crawl_stores_serially(server.stores_urls(), fast_handler(), Products_Data_Extractors(), write_to_db,
+                          content_hash_index=content_hash_index)
+
+    # the hashes of the written products were remembered, so none is read again
+    assert (content_hash_index.hits, content_hash_index.misses) == (600, 600)
+    assert content_hash_index.cache_hits == 600
+    assert products_count(write_to_db) == 600
+
+
+def test_stored_hashes_are_read_back_by_a_new_index(write_to_db_factory):
+    write_to_db = write_to_db_factory()
+    page = [make_product(product_id, "store") for product_id in range(1, 4)]
+    row_products_list, content_hashes = Content_Hash_Index(write_to_db.engine).filter_page(page)
+    write_to_db.write_page(*extract_page(row_products_list), content_hashes=content_hashes)
+    write_to_db.commit()
+    page[0]["title"] = "Renamed product"
+
+    content_hash_index = Content_Hash_Index(write_to_db.engine)
+    row_products_list, content_hashes = content_hash_index.filter_page(page)
+
+    assert [product["id"] for product in row_products_list] == [1]
+    assert list(content_hashes) == [1]
+    assert (content_hash_index.hits, content_hash_index.misses, content_hash_index.cache_hits) == (2, 1, 0)
+
+
+def test_cache_keeps_the_most_recent_hashes(write_to_db_factory):
+    write_to_db = write_to_db_factory()
+    content_hash_index = Content_Hash_Index(write_to_db.engine, cache_size=2)
+    hashes = {product_id: content_hash(make_product(product_id, "store")) for product_id in range(1, 4)}
+
+    content_hash_index.remember(hashes)
+
+    # the first hash was evicted and isn't stored, so its product counts as new
+    assert content_hash_index.filter_hashes(hashes) == {1: hashes[1]}
+    assert content_hash_index.cache_hits == 2
@@ -0,0 +1,30 @@
+"""tests of the plain text descriptions."""
+
+import description_cleaning
+from columnar import extract_columns
+from description_cleaning import clean_description, set_stored_max_length
+from local_store_server import make_product
+from scraper import extract_page
+
+
+def test_block_tags_of_any_case_separate_words():
+    assert clean_description("one<Br>two<P class='a'>three</P><DIV>four</div>fi<B>ve</B>") == "one two three four five"
+
+
+def test_descriptions_are_kept_whole_unless_capped():
+    description = "<p>" + "word " * 200 + "</p>"
+
+    assert clean_description(description) == " ".join(["word"] * 200)
+    assert clean_description(description, max_length=12) == "word word"
+
+
+def test_stored_descriptions_are_capped_once_a_length_is_set(monkeypatch):
+    monkeypatch.setattr(description_cleaning, "stored_max_length", None)
+    page = [make_product(1, "store0")]
+    page[0]["body_html"] = "<p>" + "word " * 200 + "</p>"
+    assert len(extract_page(page)[0][0]["product_description"]) == 999
+
+    set_stored_max_length(12)
+
+    assert extract_page(page)[0][0]["product_description"] == "word word"
+    assert extract_columns([page]).products["product_description"] == ["word word"]
@@ -0,0 +1,74 @@
+"""tests of the conditional requests of the products pages, against the local stores."""
+
+import pytest
+
+from async_crawler import Async_Crawl_Engine
+from conftest import fast_handler, products_count
+from http_cache import Http_Cache
+from main import crawl_stores_serially
+from pagination import paginate
+from scraper import Products_Data_Extractors
+
+
+def test_recrawl_skips_the_pages_not_modified(local_stores, write_to_db_factory, tmp_path):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    http_cache = Http_Cache(str(tmp_path / "http_cache.sqlite"))
+    req_handler = fast_handler(http_cache=http_cache)
+
+    crawl_stores_serially(server.stores_urls(), req_handler, Products_Data_Extractors(), write_to_db)
+    summary = crawl_stores_serially(server.stores_urls(), req_handler, Products_Data_Extractors(), write_to_db)
+    http_cache.close()
+
+    # the 3 pages are downloaded once, then answered with a 304
+    assert server.statuses_count == {200: 3, 304: 3}
+    # none of them is parsed or written again
+    assert "products scraped: 0" in summary
+    assert products_count(write_to_db) == 600
+    assert write_to_db.spool.spooled.total() == 0
+
+
+def test_not_modified_page_missing_from_the_cache_is_requested_again(local_stores, write_to_db_factory, tmp_path):
+    server = local_stores(stores_count=1, products_per_store=10)
+    write_to_db = write_to_db_factory()
+    http_cache = Http_Cache(str(tmp_path / "http_cache.sqlite"))
+    req_handler = fast_handler(http_cache=http_cache)
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    # both crawlers are answered a 304 to their first request, sent without validators
+    server.script_responses([(304, None)])
+
+    assert len(req_handler.fetch_products_list(req_handler.config_store_products_url(store_products_API, 1))["products"]) == 10
+    server.script_responses([(304, None)])
+    summary = Async_Crawl_Engine(write_to_db, req_handler=req_handler).run(server.stores_urls())
+    http_cache.close()
+
+    assert "products scraped: 10" in summary
+    assert products_count(write_to_db) == 10
+    assert http_cache.not_modified == 0
+
+
+@pytest.mark.parametrize("send_content_length", [True, False])
+def test_bytes_received_are_counted_without_a_content_length(local_stores, tmp_path, send_content_length):
+    server = local_stores(stores_count=1, products_per_store=600, send_content_length=send_content_length)
+    http_cache = Http_Cache(str(tmp_path / "http_cache.sqlite"))
+    req_handler = fast_handler(http_cache=http_cache)
+
+    for _ in paginate(req_handler, req_handler.config_store_url_and_name(server.stores_urls()[0])[0]):
+        pass
+    http_cache.close()
+
+    assert http_cache.modified == 3
+    # the gzipped bodies, as they came off the socket
+    assert http_cache.bytes_received == server.bytes_sent
+
+
+def test_async_engine_counts_the_bytes_received_without_a_content_length(local_stores, write_to_db_factory, tmp_path):
+    server = local_stores(stores_count=1, products_per_store=600, send_content_length=False)
+    write_to_db = write_to_db_factory()
+    http_cache = Http_Cache(str(tmp_path / "http_cache.sqlite"))
+
+    Async_Crawl_Engine(write_to_db, req_handler=fast_handler(http_cache=http_cache)).run(server.stores_urls())
+    http_cache.close()
+
+    # aiohttp only tells the decoded bytes of a body without a Content-Length
+    assert http_cache.bytes_received >= server.bytes_sent
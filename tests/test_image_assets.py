@@ -0,0 +1,117 @@
+"""tests of the image downloads into the content-addressed Asset_Store."""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import text
+
+from image_assets import Asset_Store, Image_Downloader
+
+JPEG_BODY = b"\xff\xd8\xff\xe0 the same photo"
+PNG_BODY = b"\x89PNG another image"
+# the bodies served by path, the other paths get a 404
+IMAGES = {"/photo.jpg": JPEG_BODY, "/photo-copy.jpeg": JPEG_BODY, "/logo": PNG_BODY}
+
+
+@pytest.fixture
+def images_server():
+    """Serves the IMAGES over HTTP and counts the requests by path."""
+    requests_count = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            requests_count[self.path] = requests_count.get(self.path, 0) + 1
+            if self.path not in IMAGES:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png" if self.path == "/logo" else "image/jpeg")
+            self.send_header("Content-Length", str(len(IMAGES[self.path])))
+            self.end_headers()
+            self.wfile.write(IMAGES[self.path])
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.requests_count = requests_count
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def image_row(image_id: int, src: str) -> dict:
+    """An images row of the bulk writer."""
+    return {"id": image_id, "variant_ids": [], "src": src, "width": 100, "height": 100}
+
+
+def stored_files(root) -> list:
+    """The names of the files of an Asset_Store."""
+    return sorted(name for _, _, names in os.walk(root) for name in names)
+
+
+def test_asset_store_keys_the_files_on_their_digest_alone(tmp_path):
+    asset_store = Asset_Store(str(tmp_path))
+
+    digest, existed = asset_store.put(JPEG_BODY)
+    same_digest, existed_again = asset_store.put(JPEG_BODY)
+
+    assert digest == same_digest == hashlib.sha256(JPEG_BODY).hexdigest()
+    assert (existed, existed_again) == (False, True)
+    assert asset_store.path(digest) == os.path.join(str(tmp_path), digest[:2], digest[2:4], digest)
+    assert stored_files(tmp_path) == [digest]
+
+
+def test_image_downloader_stores_the_same_bytes_once(images_server, write_to_db_factory, tmp_path):
+    write_to_db = write_to_db_factory(bulk=True)
+    base_url = f"http://127.0.0.1:{images_server.server_address[1]}"
+    write_to_db.write_page([], [], [
+        image_row(1, f"{base_url}/photo.jpg"),
+        image_row(2, f"{base_url}/photo-copy.jpeg"),
+        image_row(3, f"{base_url}/logo"),
+        # shares its src with the first image, it is downloaded once
+        image_row(4, f"{base_url}/photo.jpg"),
+        image_row(5, f"{base_url}/missing.jpg"),
+    ], "store.com", 1)
+    write_to_db.commit()
+    image_downloader = Image_Downloader(write_to_db.engine, str(tmp_path / "images"), max_retries=1)
+
+    summary = image_downloader.run(["store.com"])
+
+    assert (image_downloader.downloaded, image_downloader.deduplicated, image_downloader.failed) == (3, 1, 1)
+    assert image_downloader.rows_recorded == 4
+    assert "images downloaded: 3\nalready stored: 1\nfailed: 1\nrows recorded: 4" in summary
+    assert images_server.requests_count["/photo.jpg"] == 1
+    assert stored_files(tmp_path / "images") == sorted(hashlib.sha256(body).hexdigest() for body in (JPEG_BODY, PNG_BODY))
+    with write_to_db.engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT id, byte_size, content_sha256, asset_extension FROM images WHERE store = 'store.com' ORDER BY id;"
+        )).all()
+    jpeg_digest = hashlib.sha256(JPEG_BODY).hexdigest()
+    assert [tuple(row) for row in rows] == [
+        (1, len(JPEG_BODY), jpeg_digest, ".jpg"),
+        (2, len(JPEG_BODY), jpeg_digest, ".jpeg"),
+        # no extension in the URL, it comes from the Content-Type
+        (3, len(PNG_BODY), hashlib.sha256(PNG_BODY).hexdigest(), ".png"),
+        (4, len(JPEG_BODY), jpeg_digest, ".jpg"),
+        (5, None, None, None),
+    ]
+
+
+def test_image_downloader_retries_only_the_pending_images(images_server, write_to_db_factory, tmp_path):
+    write_to_db = write_to_db_factory(bulk=True)
+    base_url = f"http://127.0.0.1:{images_server.server_address[1]}"
+    write_to_db.write_page([], [], [image_row(1, f"{base_url}/photo.jpg"), image_row(2, f"{base_url}/missing.jpg")], "store.com", 1)
+    write_to_db.commit()
+    Image_Downloader(write_to_db.engine, str(tmp_path / "images"), max_retries=1).run()
+
+    image_downloader = Image_Downloader(write_to_db.engine, str(tmp_path / "images"), max_retries=1)
+    image_downloader.run()
+
+    # the downloaded image is skipped, the failed one is tried again
+    assert images_server.requests_count == {"/photo.jpg": 1, "/missing.jpg": 2}
+    assert (image_downloader.downloaded, image_downloader.failed) == (0, 1)
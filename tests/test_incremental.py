@@ -0,0 +1,59 @@
+"""tests of the incremental re-crawls: the updated_at filter, the upserts, and the watermarks."""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from incremental_filter import Incremental_Filter
+
+
+def page(*products: tuple) -> tuple:
+    """Builds the extracted lists of a page from (product id, variant updated_at) pairs."""
+    products_list = [{"id": product_id, "images_ids": []} for product_id, _ in products]
+    variants_list = [{"id": product_id * 100, "product_id": product_id, "variant_updated_at": updated_at} for product_id, updated_at in products]
+    return products_list, variants_list, []
+
+
+def test_products_changed_in_the_watermark_second_are_kept():
+    incremental_filter = Incremental_Filter(datetime(2024, 6, 1, 15, tzinfo=timezone.utc))
+
+    products_list, variants_list, _ = incremental_filter.filter_page(*page(
+        (1, "2024-06-01T10:00:00-05:00"),
+        (2, "2024-06-01T09:59:59-05:00"),
+        (3, "2024-06-02T10:00:00-05:00"),
+    ))
+
+    assert [product["id"] for product in products_list] == [1, 3]
+    assert [variant["product_id"] for variant in variants_list] == [1, 3]
+    assert incremental_filter.unchanged_products == 1
+    assert incremental_filter.new_high_water_mark == datetime(2024, 6, 2, 15, tzinfo=timezone.utc)
+
+
+def test_upserts_only_rewrite_the_changed_rows(write_to_db_factory):
+    write_to_db = write_to_db_factory(bulk=True, incremental=True)
+    store = "http://incremental.com/"
+
+    def row_versions() -> dict:
+        # a row rewritten by the upsert gets a new xmin
+        with write_to_db.engine.connect() as connection:
+            return dict(connection.execute(text("SELECT id, xmin::text FROM products;")).all())
+
+    write_to_db.write_page([{"id": 1, "product_title": "a"}, {"id": 2, "product_title": "b"}], [], [], store, 1, 2)
+    versions = row_versions()
+    write_to_db.write_page([{"id": 1, "product_title": "a changed"}, {"id": 2, "product_title": "b"}], [], [], store, 1, 2)
+
+    assert row_versions()[1] != versions[1]
+    assert row_versions()[2] == versions[2]
+    with write_to_db.engine.connect() as connection:
+        assert connection.execute(text("SELECT product_title FROM products WHERE id = 1;")).scalar() == "a changed"
+
+
+def test_watermark_never_moves_backwards(write_to_db_factory):
+    write_to_db = write_to_db_factory(incremental=True)
+    store = "http://incremental.com/"
+    assert write_to_db.get_watermark(store) is None
+
+    write_to_db.set_watermark(store, datetime(2024, 6, 2, tzinfo=timezone.utc))
+    write_to_db.set_watermark(store, datetime(2024, 6, 1, tzinfo=timezone.utc))
+
+    assert write_to_db.get_watermark(store) == datetime(2024, 6, 2, tzinfo=timezone.utc)
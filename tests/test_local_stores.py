@@ -0,0 +1,48 @@
+"""tests of the crawlers against the synthetic stores of Local_Store_Server."""
+
+from async_crawler import Async_Crawl_Engine
+from conftest import fast_handler, products_count
+from local_store_server import Local_Store_Server
+
+
+def test_async_engine_keeps_to_the_per_host_limit(local_stores, write_to_db_factory):
+    # the stores are served from one host, so they share its limit
+    server = local_stores(stores_count=4, products_per_store=600, latency=0.05)
+    write_to_db = write_to_db_factory()
+
+    Async_Crawl_Engine(write_to_db, max_concurrency=10, per_host_limit=2, req_handler=fast_handler()).run(server.stores_urls())
+
+    assert server.max_in_flight == 2
+    assert products_count(write_to_db) == 4 * 600
+
+
+def test_async_engine_streams_the_pages_off_the_event_loop(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=2, products_per_store=600)
+    write_to_db = write_to_db_factory()
+
+    summary = Async_Crawl_Engine(write_to_db, req_handler=fast_handler(stream=True)).run(server.stores_urls())
+
+    assert summary.count("products scraped: 600") == 2
+    assert products_count(write_to_db) == 2 * 600
+
+
+class Past_Last_Page_Failing_Server(Local_Store_Server):
+    """Fails the requests of the pages past the last one of a store."""
+
+    def products_page(self, store_index: int, page_number: int, limit: int) -> list:
+        if (page_number - 1) * limit >= self.products_per_store:
+            raise RuntimeError("page past the last one")
+        return super().products_page(store_index, page_number, limit)
+
+
+def test_async_engine_ignores_the_pages_past_the_last_one(write_to_db_factory):
+    server = Past_Last_Page_Failing_Server(stores_count=1, products_per_store=300)
+    server.start()
+    write_to_db = write_to_db_factory()
+    try:
+        summary = Async_Crawl_Engine(write_to_db, per_host_limit=4, req_handler=fast_handler(max_retries=1)).run(server.stores_urls())
+    finally:
+        server.stop()
+
+    assert "pages scraped: 2\nproducts scraped: 300" in summary
+    assert products_count(write_to_db) == 300
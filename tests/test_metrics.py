@@ -0,0 +1,90 @@
+"""tests of the metrics registry outputs and of the server exposing them."""
+
+import json
+from urllib.request import urlopen
+
+from conftest import fast_handler
+from metrics import LATENCY_BUCKETS, Metrics_Registry, Metrics_Server, registry
+from pagination import paginate
+
+
+def filled_registry() -> Metrics_Registry:
+    """A registry with labelled counters and a histogram."""
+    metrics = Metrics_Registry()
+    metrics.increment("shopify_fetch_responses_total", status=200)
+    metrics.increment("shopify_fetch_responses_total", status=200)
+    metrics.increment("shopify_fetch_responses_total", status=429)
+    metrics.increment("shopify_write_rows_total", 250, table="products")
+    metrics.observe("shopify_fetch_seconds", 0.02)
+    metrics.observe("shopify_fetch_seconds", 0.3)
+    return metrics
+
+
+def counter_value(snapshot: dict, name: str) -> float:
+    """The sum of a counter over its labels in a snapshot of the registry."""
+    return sum(counter["value"] for counter in snapshot["counters"] if counter["name"] == name)
+
+
+def test_prometheus_text_of_the_counters_and_histograms():
+    lines = filled_registry().prometheus_text().splitlines()
+
+    assert lines[:4] == [
+        "# HELP shopify_fetch_responses_total Responses received, by status code.",
+        "# TYPE shopify_fetch_responses_total counter",
+        'shopify_fetch_responses_total{status="200"} 2',
+        'shopify_fetch_responses_total{status="429"} 1',
+    ]
+    assert 'shopify_write_rows_total{table="products"} 250' in lines
+    assert "# TYPE shopify_fetch_seconds histogram" in lines
+    # the buckets are cumulative
+    assert 'shopify_fetch_seconds_bucket{le="0.01"} 0' in lines
+    assert 'shopify_fetch_seconds_bucket{le="0.025"} 1' in lines
+    assert 'shopify_fetch_seconds_bucket{le="0.5"} 2' in lines
+    assert 'shopify_fetch_seconds_bucket{le="+Inf"} 2' in lines
+    assert len([line for line in lines if line.startswith("shopify_fetch_seconds_bucket")]) == len(LATENCY_BUCKETS) + 1
+    assert "shopify_fetch_seconds_count 2" in lines
+    assert any(line.startswith("shopify_fetch_seconds_sum 0.32") for line in lines)
+
+
+def test_json_snapshot_of_the_counters_and_histograms():
+    snapshot = filled_registry().as_dict()
+
+    first_counter = snapshot["counters"][0]
+    assert first_counter["name"] == "shopify_fetch_responses_total"
+    assert (first_counter["labels"], first_counter["value"]) == ({"status": "200"}, 2)
+    assert first_counter["per_sec"] > 0
+    assert counter_value(snapshot, "shopify_fetch_responses_total") == 3
+    assert snapshot["histograms"] == [
+        {"name": "shopify_fetch_seconds", "labels": {}, "count": 2, "sum": 0.32, "avg": 0.16, "max": 0.3},
+    ]
+    # the snapshot is what /metrics.json serves
+    assert json.loads(json.dumps(snapshot)) == snapshot
+
+
+def test_metrics_server_listens_on_the_local_interface():
+    metrics_server = Metrics_Server(filled_registry(), port=0)
+    metrics_server.start()
+    try:
+        with urlopen(f"http://127.0.0.1:{metrics_server.port}/metrics") as response:
+            prometheus_text = response.read().decode()
+        with urlopen(f"http://127.0.0.1:{metrics_server.port}/metrics.json") as response:
+            snapshot = json.loads(response.read())
+    finally:
+        metrics_server.stop()
+
+    assert metrics_server._Metrics_Server__httpd.server_address[0] == "127.0.0.1"
+    assert 'shopify_fetch_responses_total{status="429"} 1' in prometheus_text
+    assert counter_value(snapshot, "shopify_fetch_responses_total") == 3
+
+
+def test_fetch_bytes_are_counted_decoded(local_stores):
+    server = local_stores(stores_count=1, products_per_store=600)
+    req_handler = fast_handler()
+    decoded_bytes = counter_value(registry.as_dict(), "shopify_fetch_decoded_bytes_total")
+
+    for _ in paginate(req_handler, req_handler.config_store_url_and_name(server.stores_urls()[0])[0]):
+        pass
+
+    decoded_bytes = counter_value(registry.as_dict(), "shopify_fetch_decoded_bytes_total") - decoded_bytes
+    # the pages were gzipped on the wire
+    assert decoded_bytes > 3 * server.bytes_sent
@@ -0,0 +1,88 @@
+"""tests of the page number and since_id paginations, against the local stores."""
+
+import pytest
+
+from conftest import fast_handler
+from pagination import Since_Id_Pagination, paginate
+
+
+def crawl_store(server, **kwargs) -> tuple:
+    """
+    Walks the pages of the first local store.
+
+    Args:
+        server (Local_Store_Server): The local stores.
+        **kwargs: The paginate arguments.
+
+    Returns:
+        tuple: The page numbers, the products ids in order, and the requests made.
+    """
+    req_handler = fast_handler()
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    requests_before = server.requests_count
+    pages = list(paginate(req_handler, store_products_API, **kwargs))
+    ids = [product["id"] for _, row_products_list in pages for product in row_products_list]
+    return [page_number for page_number, _ in pages], ids, server.requests_count - requests_before
+
+
+@pytest.mark.parametrize("strategy", ["page", "since_id"])
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_pagination_stops_on_the_short_last_page(local_stores, strategy, prefetch):
+    server = local_stores(stores_count=1, products_per_store=600)
+
+    page_numbers, ids, requests_made = crawl_store(server, strategy=strategy, prefetch=prefetch)
+
+    assert page_numbers == [1, 2, 3]
+    assert ids == sorted(set(ids)) and len(ids) == 600
+    # no extra request for an empty fourth page
+    assert requests_made == 3
+
+
+def test_pagination_asks_one_empty_page_after_a_full_last_page(local_stores):
+    server = local_stores(stores_count=1, products_per_store=500)
+
+    page_numbers, ids, requests_made = crawl_store(server)
+
+    assert page_numbers == [1, 2]
+    assert len(ids) == 500
+    assert requests_made == 3
+
+
+def test_since_id_pagination_follows_the_cursor(local_stores):
+    server = local_stores(stores_count=1, products_per_store=600)
+    req_handler = fast_handler()
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+
+    pages = Since_Id_Pagination(req_handler, store_products_API)
+    ids = [product["id"] for _, row_products_list in pages for product in row_products_list]
+
+    assert pages.cursor_supported is True
+    assert ids == sorted(set(ids)) and len(ids) == 600
+
+
+def test_since_id_pagination_falls_back_to_page_numbers(local_stores):
+    server = local_stores(stores_count=1, products_per_store=600, supports_since_id=False)
+    req_handler = fast_handler()
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    requests_before = server.requests_count
+
+    pages = Since_Id_Pagination(req_handler, store_products_API)
+    crawled = list(pages)
+    ids = [product["id"] for _, row_products_list in crawled for product in row_products_list]
+
+    assert pages.cursor_supported is False
+    assert [page_number for page_number, _ in crawled] == [1, 2, 3]
+    # every product once, although the second request got the first page again
+    assert ids == sorted(set(ids)) and len(ids) == 600
+    assert server.requests_count - requests_before == 4
+
+
+@pytest.mark.parametrize("supports_since_id", [True, False])
+def test_since_id_pagination_resumes_after_a_page(local_stores, supports_since_id):
+    server = local_stores(stores_count=1, products_per_store=600, supports_since_id=supports_since_id)
+    _, all_ids, _ = crawl_store(server)
+
+    page_numbers, ids, _ = crawl_store(server, strategy="since_id", last_page=1, last_product_id=all_ids[249])
+
+    assert page_numbers == [2, 3]
+    assert ids == all_ids[250:]
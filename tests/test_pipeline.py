@@ -0,0 +1,63 @@
+"""tests of the fetch, transform, and write stages of Page_Pipeline, against the local stores."""
+
+from time import monotonic
+
+import pytest
+
+from conftest import fast_handler, products_count
+from pipeline import Page_Pipeline
+
+
+def test_pipeline_crawls_the_stores(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=3, products_per_store=600)
+    write_to_db = write_to_db_factory(bulk=True)
+
+    summary = Page_Pipeline(fast_handler(), write_to_db, stats_interval=0).run(server.stores_urls())
+
+    assert summary.count("pages scraped: 3\nproducts scraped: 600") == 3
+    assert "stages:\nfetch" in summary
+    assert products_count(write_to_db) == 3 * 600
+
+
+def test_pipeline_extracts_the_pages_in_processes(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=2, products_per_store=600)
+    write_to_db = write_to_db_factory(bulk=True)
+
+    summary = Page_Pipeline(fast_handler(), write_to_db, stats_interval=0, extract_workers=2).run(server.stores_urls())
+
+    assert summary.count("products scraped: 600") == 2
+    assert products_count(write_to_db) == 2 * 600
+
+
+def test_pipeline_raises_the_error_of_a_failed_stage(local_stores, write_to_db_factory, monkeypatch):
+    # enough pages to fill the queues behind the failed write stage
+    server = local_stores(stores_count=4, products_per_store=1500)
+    write_to_db = write_to_db_factory(bulk=True)
+
+    def failing_write_page(*args):
+        raise RuntimeError("database gone")
+
+    monkeypatch.setattr(write_to_db, "write_page", failing_write_page)
+    start = monotonic()
+    with pytest.raises(RuntimeError, match="database gone"):
+        Page_Pipeline(fast_handler(), write_to_db, queue_size=1, stats_interval=0).run(server.stores_urls())
+
+    # the fetch and transform stages stop instead of blocking on the full queues
+    assert monotonic() - start < 10
+    assert products_count(write_to_db) == 0
+
+
+def test_pipeline_gives_up_on_a_failing_store_only(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=2, products_per_store=300)
+    write_to_db = write_to_db_factory(bulk=True)
+    req_handler = fast_handler(max_retries=1)
+    failing_store = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    # the only try of the first store's first page
+    server.script_responses([(500, None)])
+
+    summary = Page_Pipeline(req_handler, write_to_db, stats_interval=0).run(server.stores_urls())
+
+    assert f"{failing_store}\nfailed at page 1" in summary
+    assert write_to_db.get_checkpoints()[failing_store]["status"] == "failed"
+    assert "products scraped: 300" in summary
+    assert products_count(write_to_db) == 300
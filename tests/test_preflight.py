@@ -0,0 +1,38 @@
+"""tests of the stores checks against the local stores."""
+
+import socket
+
+from preflight import Store_Preflight, connection_failure_status
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_only_definitive_answers_are_cached_dead(local_stores, tmp_path):
+    server = local_stores(stores_count=2, products_per_store=10)
+    alive, throttled = (url + "/" for url in server.stores_urls())
+    missing = f"http://127.0.0.1:{server.port}/missing.com/"
+    refused = f"http://127.0.0.1:{free_port()}/store0.com/"
+    store_preflight = Store_Preflight(str(tmp_path / "preflight.sqlite"))
+    server.script_responses([(503, None)])
+    assert store_preflight.run([throttled]) == [throttled]
+    assert store_preflight.results[throttled][1] == "unknown"
+
+    stores_list = store_preflight.run([alive, throttled, missing, refused])
+
+    statuses = {url: status for url, (_, status, _) in store_preflight.results.items()}
+    assert statuses == {alive: "ok", throttled: "ok", missing: "dead", refused: "unknown"}
+    assert stores_list == [alive, throttled, refused]
+    # the throttled and refused stores were checked again, the refused one is checked on the next run too
+    store_preflight.run([alive, throttled, missing, refused])
+    assert "checks from cache: 3" in store_preflight.summary()
+    store_preflight.close()
+
+
+def test_only_a_missing_domain_is_dead():
+    assert connection_failure_status(socket.gaierror(socket.EAI_NONAME, "Name or service not known")) == "dead"
+    assert connection_failure_status(socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")) == "unknown"
+    assert connection_failure_status(ConnectionRefusedError(111, "Connection refused")) == "unknown"
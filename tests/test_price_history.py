@@ -0,0 +1,53 @@
+"""tests of the variants change capture, on the test database."""
+
+import pytest
+from sqlalchemy import text
+
+from price_history import Variant_History, price_series
+
+
+def variant(variant_id: int, product_id: int, price: str, available: bool = True) -> dict:
+    return {"id": variant_id, "product_id": product_id, "variant_price": price, "variant_available": available}
+
+
+def history_rows(write_to_db) -> list:
+    with write_to_db.engine.connect() as connection:
+        return connection.execute(text("SELECT variant_id, variant_price FROM variant_history ORDER BY variant_id, observed_at;")).all()
+
+
+def test_only_changes_of_stored_variants_are_appended(write_to_db_factory):
+    variant_history = Variant_History()
+    write_to_db = write_to_db_factory(bulk=True, incremental=True, variant_history=variant_history)
+    store = "http://history.com/"
+    write_to_db.start_checkpoint(store)
+    products = [{"id": 1}, {"id": 2}]
+
+    write_to_db.write_page(products, [variant(10, 1, "19.99"), variant(20, 2, "5.00")], [], store, 1, 2)
+    write_to_db.write_page(products, [variant(10, 1, "17.99"), variant(20, 2, "5")], [], store, 2, 2)
+    # the variant of a missing product is spooled, its price never reaches the variants table
+    write_to_db.write_page([], [variant(30, 999, "1.00")], [], store, 3, 2)
+
+    assert history_rows(write_to_db) == [(10, 19.99), (10, 17.99), (20, 5.0)]
+    assert [row[1] for row in price_series(write_to_db.engine, 10, store)] == [19.99, 17.99]
+    assert variant_history.changes == 3
+
+
+def test_rollback_forgets_the_states_of_its_transaction_only(write_to_db_factory):
+    variant_history = Variant_History()
+    write_to_db = write_to_db_factory(bulk=True, incremental=True, batch_pages=2, variant_history=variant_history)
+    store = "http://rollback.com/"
+    write_to_db.start_checkpoint(store)
+    write_to_db.write_page([{"id": 1}], [variant(10, 1, "10.00")], [], store, 1, 1)
+    write_to_db.commit()
+
+    write_to_db.write_page([{"id": 2}], [variant(20, 2, "20.00")], [], store, 2, 2)
+    with pytest.raises(Exception):
+        # a checkpoint without a page number fails the page's transaction
+        write_to_db.write_page([{"id": 3}], [variant(30, 3, "30.00")], [], store, None, 3)
+
+    # the rolled back states are recorded again, the committed one is still cached and isn't
+    cache_hits = variant_history.cache_hits
+    write_to_db.write_page([{"id": 2}, {"id": 3}], [variant(10, 1, "10.00"), variant(20, 2, "20.00"), variant(30, 3, "30.00")], [], store, 2, 3)
+    write_to_db.commit()
+    assert variant_history.cache_hits == cache_hits + 1
+    assert history_rows(write_to_db) == [(10, 10.0), (20, 20.0), (30, 30.0)]
@@ -0,0 +1,69 @@
+"""tests of the adaptive rate of the hosts, the backoff on throttled requests, and the circuit breaker."""
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+import pytest
+
+from conftest import fast_handler
+from rate_limiting import Host_Rate_Limiter, Fetch_Error, Circuit_Open_Error
+
+
+def test_concurrent_rate_changes_are_all_applied():
+    rate_limiter = Host_Rate_Limiter(initial_rate=1, max_rate=100_000, increase_step=1)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: rate_limiter.on_success("store.com"), range(8000)))
+
+    assert rate_limiter.rate("store.com") == 8001
+
+
+def test_throttle_keeps_the_longest_pause():
+    rate_limiter = Host_Rate_Limiter(initial_rate=4, min_rate=1, decrease_factor=0.5)
+
+    rate_limiter.on_throttle("store.com", 30)
+    rate_limiter.on_throttle("store.com", 1)
+    rate_limiter.on_throttle("store.com")
+
+    assert rate_limiter.rate("store.com") == 1
+    assert rate_limiter.bucket("store.com").reserve() > 29
+    assert rate_limiter.bucket("store.com").blocked_until > monotonic() + 29
+
+
+def test_throttled_requests_wait_for_retry_after(local_stores):
+    server = local_stores(stores_count=1, products_per_store=10)
+    req_handler = fast_handler()
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    url = req_handler.config_store_products_url(store_products_API, 1)
+    server.script_responses([(429, "0.3"), (503, "0.3")])
+
+    start = monotonic()
+    json_response = req_handler.fetch_products_list(url)
+
+    assert monotonic() - start >= 0.6
+    assert len(json_response["products"]) == 10
+    assert server.statuses_count == {429: 1, 503: 1, 200: 1}
+    # halved twice, then sped up by one success
+    assert req_handler.rate_limiter.rate(f"127.0.0.1:{server.port}") < 1000 / 2
+
+
+def test_circuit_breaker_opens_and_closes(local_stores):
+    server = local_stores(stores_count=1, products_per_store=10)
+    req_handler = fast_handler(max_retries=2, failure_threshold=2, reset_timeout=0.3)
+    store_products_API = req_handler.config_store_url_and_name(server.stores_urls()[0])[0]
+    url = req_handler.config_store_products_url(store_products_API, 1)
+    circuit_breaker = req_handler.circuit_breaker(url)
+    server.script_responses([(500, None), (500, None)])
+
+    with pytest.raises(Fetch_Error):
+        req_handler.fetch_products_list(url)
+    assert circuit_breaker.state == "open"
+    # the open breaker cuts the store off without a request
+    requests_count = server.requests_count
+    with pytest.raises(Circuit_Open_Error):
+        req_handler.fetch_products_list(url)
+    assert server.requests_count == requests_count
+
+    sleep(0.3)
+    assert len(req_handler.fetch_products_list(url)["products"]) == 10
+    assert circuit_breaker.state == "closed"
@@ -0,0 +1,31 @@
+"""tests of recording the local stores into a fixture archive."""
+
+from conftest import fast_handler
+from replay import Fixture_Archive, record_stores
+
+
+def test_recording_retries_and_notes_why_every_store_stopped(local_stores, tmp_path):
+    server = local_stores(stores_count=2, products_per_store=600)
+    path = str(tmp_path / "fixtures.zip")
+    # the first page is throttled then fails once, and is recorded on the third attempt
+    server.script_responses([(429, "0"), (500, None)])
+
+    record_stores(server.stores_urls(), path, fast_handler(), verbose=False)
+    server.script_responses([(500, None)] * 3)
+    record_stores(server.stores_urls()[:1], str(tmp_path / "failed.zip"), fast_handler(), verbose=False)
+
+    archive = Fixture_Archive(path)
+    assert [(store["pages"], store["products"], store["stop_reason"]) for store in archive.stores] == [(3, 600, "last page")] * 2
+    assert archive.pages(0)[0].startswith(b'{"products": [')
+    failed = Fixture_Archive(str(tmp_path / "failed.zip"))
+    assert failed.stores[0]["pages"] == 0
+    assert failed.stores[0]["stop_reason"].startswith("failed at page 1:")
+
+
+def test_recording_stops_at_max_pages(local_stores, tmp_path):
+    server = local_stores(stores_count=1, products_per_store=600)
+    path = str(tmp_path / "fixtures.zip")
+
+    record_stores(server.stores_urls(), path, fast_handler(), max_pages=2, verbose=False)
+
+    assert Fixture_Archive(path).stores[0]["stop_reason"] == "max pages"
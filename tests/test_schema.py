@@ -0,0 +1,111 @@
+"""tests of the schema migrations and the partitions by store, in a postgres schema of their own."""
+
+from threading import Barrier, Thread
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from dead_letter import Dead_Letter_Spool
+from save_to_sql_db import Write_to_DB
+from schema import MIGRATIONS, Schema_Manager, partition_name
+
+
+@pytest.fixture
+def schema_engine(db_info):
+    """An engine whose tables are created in the emptied "schema_test" schema."""
+    url = f"postgresql://{db_info['user']}:{db_info['password']}@{db_info['host']}:{db_info['port']}/{db_info['db']}"
+    admin_engine = create_engine(url)
+    with admin_engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS schema_test CASCADE; CREATE SCHEMA schema_test;"))
+    engine = create_engine(url, connect_args={"options": "-csearch_path=schema_test"})
+    yield engine
+    engine.dispose()
+    with admin_engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA schema_test CASCADE;"))
+    admin_engine.dispose()
+
+
+def writer_on(engine, db_info, tmp_path) -> Write_to_DB:
+    return Write_to_DB(db_info["user"], db_info["password"], db_info["port"], db_info["db"], host=db_info["host"],
+                       engine=engine, spool=Dead_Letter_Spool(str(tmp_path / "failed items")))
+
+
+def row(table_name: str, **values) -> dict:
+    """Builds a row of a table, its missing columns None."""
+    return {**dict.fromkeys(Write_to_DB.table_columns[table_name]), **values}
+
+
+def test_baseline_tables_are_migrated_with_their_rows(schema_engine):
+    with schema_engine.begin() as connection:
+        for query in Write_to_DB.tables_creation:
+            connection.execute(text(query))
+        connection.execute(text("INSERT INTO products (id, product_tags) VALUES (1, '[\"sale\"]');"))
+
+    applied = Schema_Manager(schema_engine).migrate()
+
+    assert applied == [description for _, description, _ in MIGRATIONS]
+    assert Schema_Manager(schema_engine).migrate() == []
+    with schema_engine.connect() as connection:
+        # the tags are JSONB, searched through the GIN index
+        assert connection.execute(text("SELECT store, product_tags ? 'sale' FROM products;")).one() == ("", True)
+        assert connection.execute(text("SELECT to_regclass('products_tags_idx') IS NOT NULL;")).scalar()
+
+
+def test_partition_by_store_moves_the_rows_into_their_store(schema_engine, db_info, tmp_path):
+    write_to_db = writer_on(schema_engine, db_info, tmp_path)
+    write_to_db.write_page([row("products", id=1, product_title="a")], [row("variants", id=10, product_id=1)], [], "http://a.com/", 1, 1)
+    write_to_db.terminate_connection()
+    schema_manager = Schema_Manager(schema_engine)
+
+    assert schema_manager.partition_by_store() == 1
+    assert schema_manager.partition_by_store() == 0
+
+    with schema_engine.connect() as connection:
+        assert connection.execute(text(f"SELECT id FROM {partition_name('variants', 'http://a.com/')};")).scalars().all() == [10]
+    # the same ids may now be stored by two stores
+    write_to_db = writer_on(schema_engine, db_info, tmp_path)
+    write_to_db.start_checkpoint("http://b.com/")
+    write_to_db.write_page([row("products", id=1, product_title="b")], [], [], "http://b.com/", 1, 1)
+    write_to_db.terminate_connection()
+    with schema_engine.connect() as connection:
+        assert connection.execute(text(f"SELECT product_title FROM {partition_name('products', 'http://b.com/')};")).scalar() == "b"
+
+
+def test_writers_starting_together_create_each_partition_once(schema_engine, db_info, tmp_path):
+    writer_on(schema_engine, db_info, tmp_path).terminate_connection()
+    Schema_Manager(schema_engine).partition_by_store()
+    stores = [f"http://store{i}.com/" for i in range(10)]
+    barrier = Barrier(4)
+    created, errors = [], []
+
+    def create_partitions() -> None:
+        barrier.wait()
+        try:
+            created.append(Schema_Manager(schema_engine).create_partitions(stores))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=create_partitions) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sum(created) == 10
+
+
+def test_store_already_in_the_default_partition_is_reported(schema_engine, db_info, tmp_path):
+    writer_on(schema_engine, db_info, tmp_path).terminate_connection()
+    Schema_Manager(schema_engine).partition_by_store()
+    with schema_engine.begin() as connection:
+        connection.execute(text("INSERT INTO products (store, id) VALUES ('http://late.com/', 1);"))
+
+    write_to_db = writer_on(schema_engine, db_info, tmp_path)
+    write_to_db.start_checkpoint("http://late.com/")
+    write_to_db.write_page([row("products", id=2, product_title="b")], [], [], "http://late.com/", 1, 2)
+    write_to_db.terminate_connection()
+
+    assert write_to_db.schema.default_stores == ["http://late.com/"]
+    with schema_engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM products_default;")).scalar() == 2
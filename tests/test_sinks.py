@@ -0,0 +1,83 @@
+"""tests of the parquet and jsonl file sinks, read back after a crawl of the local stores."""
+
+import glob
+import json
+import os
+
+import pytest
+
+from conftest import fast_handler
+from local_store_server import make_product
+from main import crawl_stores_serially
+from scraper import Products_Data_Extractors, extract_page
+from sinks import get_sink
+
+
+def part_files(output_dir, table_name: str) -> list:
+    """The part files of a table, in the order of their paths."""
+    return sorted(glob.glob(os.path.join(str(output_dir), table_name, "store=*", "date=*", "part-*")))
+
+
+def test_parquet_sink_round_trip(local_stores, tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.dataset
+    import pyarrow.parquet
+    server = local_stores(stores_count=2, products_per_store=600)
+    sink = get_sink("parquet", str(tmp_path), row_group_size=250)
+
+    crawl_stores_serially(server.stores_urls(), fast_handler(), Products_Data_Extractors(), sink)
+    sink.terminate_connection()
+
+    files = part_files(tmp_path, "products")
+    assert len(files) == 2
+    assert pyarrow.parquet.ParquetFile(files[0]).metadata.num_row_groups == 3
+    products = pyarrow.dataset.dataset(str(tmp_path / "products"), partitioning="hive").to_table()
+    assert products.num_rows == 2 * 600
+    assert sorted(set(products.column("store").to_pylist())) == [
+        fast_handler().config_store_url_and_name(store)[0] for store in server.stores_urls()
+    ]
+    variants = pyarrow.parquet.read_table(part_files(tmp_path, "variants")[0])
+    assert variants.num_rows == 600 * 3
+    assert variants.schema.field("variant_created_at").type == pyarrow.timestamp("us", tz="UTC")
+    assert sink.files_written == 6 and sink.rows_written == 2 * 600 * 6
+
+
+def test_parquet_sink_stores_a_malformed_date_as_null(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    page = [make_product(1, "store"), make_product(2, "store")]
+    page[1]["published_at"] = "not a date"
+    sink = get_sink("parquet", str(tmp_path))
+
+    sink.write_page(*extract_page(page), "store.com")
+    sink.finish_checkpoint("store.com")
+
+    products = pyarrow.parquet.read_table(part_files(tmp_path, "products")[0])
+    assert products.column("product_publish_date").null_count == 1
+    assert json.loads(products.column("product_options")[0].as_py())[0]["name"] == "Size"
+
+
+def test_jsonl_sink_round_trip(local_stores, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    server = local_stores(stores_count=1, products_per_store=600)
+    store_products_API = fast_handler().config_store_url_and_name(server.stores_urls()[0])[0]
+    sink = get_sink("jsonl", str(tmp_path))
+
+    crawl_stores_serially(server.stores_urls(), fast_handler(), Products_Data_Extractors(), sink)
+    # a second run adds its own part file
+    crawl_stores_serially(server.stores_urls(), fast_handler(), Products_Data_Extractors(), sink)
+    sink.terminate_connection()
+
+    files = part_files(tmp_path, "variants")
+    assert [os.path.basename(path) for path in files] == ["part-00000.jsonl.zst", "part-00001.jsonl.zst"]
+    with open(files[0], "rb") as file:
+        lines = zstandard.ZstdDecompressor().stream_reader(file).read().decode().splitlines()
+    variants = [json.loads(line) for line in lines]
+    assert len(variants) == 600 * 3
+    assert {variant["store"] for variant in variants} == {store_products_API}
+    assert variants[0]["variant_price"] == 19.99
+
+
+def test_get_sink_rejects_an_unknown_sink(tmp_path):
+    with pytest.raises(ValueError):
+        get_sink("csv", str(tmp_path))
@@ -0,0 +1,56 @@
+"""tests of the products stream parser, chunk by chunk."""
+
+import json
+
+import pytest
+
+import streaming
+from local_store_server import make_product
+from streaming import Products_Stream_Parser
+
+
+class Counting_Decoder(json.JSONDecoder):
+    """Counts the products decoded."""
+
+    decoded = 0
+
+    def raw_decode(self, s: str, idx: int = 0) -> tuple:
+        Counting_Decoder.decoded += 1
+        return super().raw_decode(s, idx)
+
+
+def body_and_products() -> tuple:
+    products = [make_product(i, "store") for i in range(1, 6)]
+    # braces, quotes, and backslashes inside the strings don't end a product
+    products[2]["body_html"] = 'a "{quoted}" \\ brace } and \\"escape\\" é'
+    products[3]["title"] = "}}}{{{"
+    body = json.dumps({"products": products}, ensure_ascii=False).encode("utf-8")
+    return body, products
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 100_000])
+def test_fallback_parser_decodes_every_product_once(monkeypatch, chunk_size):
+    monkeypatch.setattr(streaming, "ijson", None)
+    monkeypatch.setattr(streaming.json, "JSONDecoder", Counting_Decoder)
+    Counting_Decoder.decoded = 0
+    body, products = body_and_products()
+    parser = Products_Stream_Parser()
+    assert parser.backend == "json"
+
+    parsed = []
+    for start in range(0, len(body), chunk_size):
+        parsed.extend(parser.feed(body[start:start + chunk_size]))
+    parser.close()
+
+    assert parsed == products
+    assert Counting_Decoder.decoded == len(products)
+
+
+def test_fallback_parser_rejects_a_truncated_body(monkeypatch):
+    monkeypatch.setattr(streaming, "ijson", None)
+    body, products = body_and_products()
+    parser = Products_Stream_Parser()
+
+    assert parser.feed(body[:-10]) == products[:-1]
+    with pytest.raises(ValueError):
+        parser.close()
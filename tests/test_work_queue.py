@@ -0,0 +1,86 @@
+"""tests of the distributed workers against local stores, on the test database."""
+
+from threading import Event
+
+import pytest
+from sqlalchemy import text
+
+from conftest import fast_handler
+from main import crawl_stores_serially
+from scraper import Products_Data_Extractors
+from work_queue import Work_Queue, run_worker
+
+
+@pytest.fixture
+def work_queue(db_info):
+    work_queue = Work_Queue(db_info["user"], db_info["password"], db_info["port"], db_info["db"], host=db_info["host"],
+                            lease_seconds=0.3, max_attempts=2)
+    with work_queue.engine.begin() as connection:
+        connection.execute(text("TRUNCATE crawl_queue;"))
+    yield work_queue
+    work_queue.terminate_connection()
+
+
+def crawl_store_with(write_to_db, req_handler):
+    """Builds the crawl_store of run_worker from the serial crawl, the way main.py does."""
+    def crawl_store(store: str, resume: bool, stop: Event) -> tuple:
+        summary = crawl_stores_serially([store], req_handler, Products_Data_Extractors(), write_to_db, resume=resume, stop=stop)
+        checkpoint = write_to_db.get_checkpoints().get(req_handler.config_store_url_and_name(store)[0], {})
+        return summary, checkpoint.get("status") == "done"
+    return crawl_store
+
+
+def test_failed_store_is_given_back_and_resumed(local_stores, write_to_db_factory, work_queue):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    work_queue.enqueue(server.stores_urls())
+    # every attempt of the first claim's first page fails
+    server.script_responses([(503, None)] * 3)
+
+    summary = run_worker(work_queue, "worker", crawl_store_with(write_to_db, fast_handler()), poll_interval=0.1)
+
+    assert "failed at page 1" in summary
+    assert "products scraped: 600" in summary
+    assert work_queue.counts() == {"done": 1}
+
+
+def test_store_failing_every_attempt_is_marked_failed(local_stores, write_to_db_factory, work_queue):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    work_queue.enqueue(server.stores_urls())
+    server.script_responses([(503, None)] * 3 * work_queue.max_attempts)
+
+    run_worker(work_queue, "worker", crawl_store_with(write_to_db, fast_handler()), poll_interval=0.1)
+
+    assert work_queue.counts() == {"failed": 1}
+
+
+def test_lost_lease_stops_the_crawl(work_queue):
+    work_queue.enqueue(["http://leased.com"])
+    stopped = []
+
+    def crawl_store(store: str, resume: bool, stop: Event) -> tuple:
+        # another worker takes the store over and finishes it
+        with work_queue.engine.begin() as connection:
+            connection.execute(text("UPDATE crawl_queue SET worker = 'other', status = 'done' WHERE store = :store;"), {"store": store})
+        stopped.append(stop.wait(5))
+        return "", False
+
+    run_worker(work_queue, "worker", crawl_store, poll_interval=0.1)
+
+    assert stopped == [True]
+    with work_queue.engine.connect() as connection:
+        assert connection.execute(text("SELECT worker, status FROM crawl_queue;")).one() == ("other", "done")
+
+
+def test_stopped_crawl_leaves_the_store_in_progress(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=1, products_per_store=600)
+    write_to_db = write_to_db_factory()
+    req_handler = fast_handler()
+    stop = Event()
+    stop.set()
+
+    summary = crawl_stores_serially(server.stores_urls(), req_handler, Products_Data_Extractors(), write_to_db, stop=stop)
+
+    assert "stopped before page 1" in summary
+    assert write_to_db.get_checkpoints()[req_handler.config_store_url_and_name(server.stores_urls()[0])[0]]["status"] == "in_progress"
@@ -0,0 +1,110 @@
+"""tests of the batched write_page transactions, on the test database."""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from async_crawler import Async_Crawl_Engine
+from conftest import fast_handler
+from save_to_sql_db import Pooled_Writer
+
+
+class Failing_History:
+    """Stands in for a Variant_History and fails inside the transaction of a store's given page."""
+
+    def __init__(self, store: str, failing_call: int) -> None:
+        self.store = store
+        self.failing_call = failing_call
+        self.calls = 0
+
+    def capture(self, connection, variants_list: list, store: str) -> int:
+        if store == self.store:
+            self.calls += 1
+            if self.calls == self.failing_call:
+                raise RuntimeError("failure injected into the page's transaction")
+        return 0
+
+    def forget(self, store: str, variant_ids: list) -> None:
+        pass
+
+
+def stored_state(write_to_db, store: str) -> tuple:
+    """Reads the products count and the checkpoint of a store."""
+    with write_to_db.engine.connect() as connection:
+        products = connection.execute(text("SELECT count(*) FROM products WHERE store = :store;"), {"store": store}).scalar()
+    return products, write_to_db.get_checkpoints().get(store)
+
+
+def test_failing_page_keeps_other_stores_pages(local_stores, write_to_db_factory):
+    server = local_stores(stores_count=2, products_per_store=1000)
+    write_to_db = write_to_db_factory(bulk=True, batch_pages=4)
+    req_handler = fast_handler()
+    first_store, second_store = (req_handler.config_store_url_and_name(store)[0] for store in server.stores_urls())
+    # the second store fails on its third page, while pages of both stores share the connection
+    write_to_db.variant_history = Failing_History(second_store, 3)
+
+    summary = Async_Crawl_Engine(write_to_db, max_concurrency=2, per_host_limit=2, req_handler=req_handler).run(server.stores_urls())
+
+    products, checkpoint = stored_state(write_to_db, first_store)
+    assert checkpoint["status"] == "done"
+    assert products == 1000
+    products, checkpoint = stored_state(write_to_db, second_store)
+    assert checkpoint["status"] != "done"
+    # the store's committed pages match its checkpoint, it resumes right after them
+    assert products == checkpoint["last_page"] * 250
+    assert "failure injected" in summary
+
+
+def test_write_page_returns_hashes_once_committed(local_stores, write_to_db_factory):
+    write_to_db = write_to_db_factory(bulk=True, batch_pages=2)
+    store = "http://hashes.com/"
+    write_to_db.start_checkpoint(store)
+    page = ([{"id": 1, "product_title": "a"}], [], [])
+
+    assert write_to_db.write_page(*page, store, 1, 1, {1: b"first"}) == {}
+    assert write_to_db.write_page([{"id": 2, "product_title": "b"}], [], [], store, 2, 2, {2: b"second"}) == {1: b"first", 2: b"second"}
+
+
+def test_pooled_writer_commit_returns_the_hashes_of_every_connection(write_to_db_factory, db_info, tmp_path, monkeypatch):
+    write_to_db_factory().terminate_connection()
+    monkeypatch.chdir(tmp_path)
+    pooled_writer = Pooled_Writer(db_info["user"], db_info["password"], db_info["port"], db_info["db"], pool_size=2, bulk=True,
+                                  host=db_info["host"], batch_pages=2)
+    for product_id, store in enumerate(["http://first.com/", "http://second.com/"], 1):
+        pooled_writer.start_checkpoint(store)
+        assert pooled_writer.write_page([{"id": product_id, "product_title": "a"}], [], [], store, 1, product_id, {product_id: b"hash"}) == {}
+
+    assert pooled_writer.commit() == {1: b"hash", 2: b"hash"}
+    pooled_writer.terminate_connection()
+
+
+def test_rows_written_counts_committed_rows_only(write_to_db_factory):
+    write_to_db = write_to_db_factory(bulk=True, batch_pages=2)
+    store = "http://counts.com/"
+    write_to_db.start_checkpoint(store)
+    products = [{"id": 1, "product_title": "a"}, {"id": 2, "product_title": "b"}]
+    # the variant of a product that doesn't exist fails its foreign key and is spooled
+    variants = [{"id": 10, "product_id": 1}, {"id": 20, "product_id": 999}]
+
+    write_to_db.write_page(products, variants, [], store, 1, 2)
+    assert write_to_db.rows_written == 0
+    write_to_db.commit()
+    assert write_to_db.rows_written == 3
+    assert write_to_db.spool.spooled["variants"] == 1
+
+
+def test_pooled_writer_frees_the_connections_of_finished_stores(write_to_db_factory, db_info, tmp_path, monkeypatch):
+    # the rows the pooled writer spools go to the test's directory
+    write_to_db_factory().terminate_connection()
+    monkeypatch.chdir(tmp_path)
+    pooled_writer = Pooled_Writer(db_info["user"], db_info["password"], db_info["port"], db_info["db"], pool_size=2, bulk=True, host=db_info["host"])
+
+    for store in [f"http://store{i}.com/" for i in range(4)]:
+        pooled_writer.start_checkpoint(store)
+        pooled_writer.write_page([{"id": 1, "product_title": "a"}], [], [], store, 1, 1)
+        pooled_writer.finish_checkpoint(store)
+        pooled_writer.set_watermark(store, datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    assert pooled_writer._Pooled_Writer__stores == {}
+    assert pooled_writer.get_watermark("http://store3.com/") == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    pooled_writer.terminate_connection()
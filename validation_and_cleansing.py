@@ -36,14 +36,21 @@ Typical usage example:
         width = image.get("width"),
         height = image.get("height")
     ).as_dict()
+
+the records are slotted dataclasses and `as_dict` builds a shallow dict
+of their fields, the list fields are shared with the record instead of
+being deep-copied like `dataclasses.asdict` does.
+
+the product description is stripped of its HTML tags and entities by
+description_cleaning.clean_stored_description.
     
 """
 
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from typing import Optional
-import re
+from description_cleaning import clean_stored_description
 
-@dataclass
+@dataclass(slots=True)
 class Products:
     """Represents a product with various attributes like vendor, type, tags, and more.
 
@@ -79,8 +86,8 @@ class Products:
         self.product_options = self.process_product_options()
 
     def as_dict(self):
-        """Converts the dataclass instance to a dictionary."""
-        return asdict(self)
+        """Converts the dataclass instance to a dictionary without copying its list fields."""
+        return {name: getattr(self, name) for name in self.__slots__}
 
     def process_product_page(self) -> str:
         """Processes and constructs the full URL for the product page.
@@ -91,13 +98,12 @@ class Products:
         return "https://:" + self.product_vendor + ".com" + "/products/" + self.product_page.replace(" ", "")
 
     def process_product_description(self) -> Optional[str]:
-        """Removes HTML tags from the product description if it exists.
+        """Converts the HTML product description to plain text if it exists, capped if a stored length is set.
 
         Returns:
             Optional[str]: Cleaned product description.
         """
-        if self.product_description:
-            return re.sub(r"<\w+>|</\w+>", "", self.product_description)
+        return clean_stored_description(self.product_description)
 
     def process_images_ids(self) -> list:
         """Extracts IDs from the images list if it exists.
@@ -130,7 +136,7 @@ class Products:
             return []
         return self.product_options
 
-@dataclass
+@dataclass(slots=True)
 class Variants:
     """Represents a variant of a product, with attributes like price, SKU, and availability.
 
@@ -161,8 +167,8 @@ class Variants:
         self.variant_compare_at_price = self.process_variant_compare_at_price()
 
     def as_dict(self):
-        """Converts the dataclass instance to a dictionary."""
-        return asdict(self)
+        """Converts the dataclass instance to a dictionary without copying its list fields."""
+        return {name: getattr(self, name) for name in self.__slots__}
 
     def process_variant_price(self) -> Optional[float]:
         """Converts variant price to a float if it exists.
@@ -182,7 +188,7 @@ class Variants:
         if self.variant_compare_at_price:
             return float(self.variant_compare_at_price)
 
-@dataclass
+@dataclass(slots=True)
 class Images:
     """Represents an image associated with a product or variant.
 
@@ -208,8 +214,8 @@ class Images:
         self.variant_ids = self.process_variant_ids()
 
     def as_dict(self):
-        """Converts the dataclass instance to a dictionary."""
-        return asdict(self)
+        """Converts the dataclass instance to a dictionary without copying its list fields."""
+        return {name: getattr(self, name) for name in self.__slots__}
 
     def process_variant_ids(self) -> list:
         """Ensures variant IDs is a list.
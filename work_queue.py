@@ -0,0 +1,325 @@
+"""shares the stores to crawl between worker processes through a postgreSQL queue.
+
+through the Work_Queue class a coordinator puts the stores of
+"stores_to_scrape.json" in the crawl_queue table of the target database,
+and any number of workers, on one or many machines, claim them one at a
+time with `SELECT ... FOR UPDATE SKIP LOCKED`, so no two workers ever
+claim the same store.
+
+a claimed store is leased for `lease_seconds`, and a Lease_Heartbeat
+thread keeps extending the lease while the worker crawls it. the store
+of a worker that dies stops being heartbeated, and once its lease
+expires it is claimed again by another worker, which resumes it from
+its crawl checkpoint instead of starting over. a worker that loses the
+lease of a store stops crawling it, and a store whose crawl failed is
+given back to the queue, to be claimed again until `max_attempts`.
+
+Typical usage example:
+
+    coordinator:
+
+    work_queue = Work_Queue("admin", "12345", "5555", "shopify")
+    work_queue.enqueue(stores_list)
+
+    workers:
+
+    work_queue = Work_Queue("admin", "12345", "5555", "shopify")
+    run_worker(work_queue, worker_id, crawl_store)
+"""
+
+from sqlalchemy import create_engine, text
+from threading import Thread, Event
+from time import sleep
+from typing import Optional
+import os
+import socket
+
+
+def default_worker_id() -> str:
+    """
+    Builds a worker id unique across the machines.
+
+    Returns:
+        str: The host name and the process id.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Work_Queue:
+    """
+    A queue of stores to crawl, kept in the crawl_queue table.
+
+    a store is "queued", "leased" by a worker, "done", or "failed" once
+    it was given back `max_attempts` times.
+
+    Attributes:
+        table_creation (list): The SQL statements creating the queue table.
+        engine (sqlalchemy.engine.base.Engine): SQLAlchemy engine instance, every call takes its own pooled connection.
+        lease_seconds (float): How long a claimed store stays leased without a heartbeat.
+        max_attempts (int): The number of claims after which a store given back is marked failed.
+    """
+
+    table_creation = [
+        """
+        CREATE TABLE IF NOT EXISTS crawl_queue (
+            store VARCHAR PRIMARY KEY,
+            status VARCHAR NOT NULL DEFAULT 'queued',
+            worker VARCHAR,
+            lease_expires_at TIMESTAMPTZ,
+            attempts INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS crawl_queue_status_idx ON crawl_queue (status, lease_expires_at);
+        """
+    ]
+
+    def __init__(
+        self,
+        user: str,
+        password: str,
+        port: str,
+        db: str,
+        host: str = "localhost",
+        lease_seconds: float = 60,
+        max_attempts: int = 3,
+    ) -> None:
+        """
+        Initializes the Work_Queue class.
+
+        Args:
+            user (str): Database username.
+            password (str): Database password.
+            port (str): Database port.
+            db (str): Database name.
+            host (str): Database host, shared by the workers of all the machines.
+            lease_seconds (float): How long a claimed store stays leased without a heartbeat.
+            max_attempts (int): The number of claims after which a store given back is marked failed.
+        """
+        self.engine = create_engine(f"postgresql://{user}:{password}@{host}:{port}/{db}")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self.engine.begin() as connection:
+            for query in self.table_creation:
+                connection.execute(text(query))
+
+    def enqueue(self, stores_list: list) -> int:
+        """
+        Queues the stores for a new crawl, stores already in the queue are queued again.
+
+        Args:
+            stores_list (list): List of store URLs.
+
+        Returns:
+            int: The number of stores queued.
+        """
+        with self.engine.begin() as connection:
+            for store in stores_list:
+                connection.execute(text("""
+                    INSERT INTO crawl_queue (store) VALUES (:store)
+                    ON CONFLICT (store) DO UPDATE
+                    SET status = 'queued', worker = NULL, lease_expires_at = NULL, attempts = 0, updated_at = now();
+                """), {"store": store})
+        return len(stores_list)
+
+    def claim(self, worker: str) -> Optional[tuple]:
+        """
+        Leases the oldest queued store, or a store whose lease expired.
+
+        Args:
+            worker (str): The id of the claiming worker.
+
+        Returns:
+            Optional[tuple]: The store URL and the number of times it was claimed, None if nothing is claimable.
+        """
+        with self.engine.begin() as connection:
+            # a store whose workers keep dying is not handed out forever
+            connection.execute(text("""
+                UPDATE crawl_queue SET status = 'failed', worker = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE status = 'leased' AND lease_expires_at < now() AND attempts >= :max_attempts;
+            """), {"max_attempts": self.max_attempts})
+            row = connection.execute(text("""
+                UPDATE crawl_queue
+                SET status = 'leased', worker = :worker, attempts = attempts + 1,
+                    lease_expires_at = now() + make_interval(secs => :lease_seconds), updated_at = now()
+                WHERE store = (
+                    SELECT store FROM crawl_queue
+                    WHERE status = 'queued' OR (status = 'leased' AND lease_expires_at < now())
+                    ORDER BY updated_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING store, attempts;
+            """), {"worker": worker, "lease_seconds": self.lease_seconds}).first()
+        return None if row is None else (row.store, row.attempts)
+
+    def heartbeat(self, store: str, worker: str) -> bool:
+        """
+        Extends the lease of a store.
+
+        Args:
+            store (str): The store URL.
+            worker (str): The id of the worker holding the lease.
+
+        Returns:
+            bool: False if the lease expired and was claimed by another worker.
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(text("""
+                UPDATE crawl_queue SET lease_expires_at = now() + make_interval(secs => :lease_seconds), updated_at = now()
+                WHERE store = :store AND worker = :worker AND status = 'leased';
+            """), {"store": store, "worker": worker, "lease_seconds": self.lease_seconds})
+        return result.rowcount == 1
+
+    def complete(self, store: str, worker: str) -> None:
+        """
+        Marks a leased store as done.
+
+        Args:
+            store (str): The store URL.
+            worker (str): The id of the worker holding the lease.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text("""
+                UPDATE crawl_queue SET status = 'done', lease_expires_at = NULL, updated_at = now()
+                WHERE store = :store AND worker = :worker AND status = 'leased';
+            """), {"store": store, "worker": worker})
+
+    def release(self, store: str, worker: str) -> None:
+        """
+        Gives a leased store back to the queue, or marks it failed after `max_attempts` claims.
+
+        Args:
+            store (str): The store URL.
+            worker (str): The id of the worker holding the lease.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text("""
+                UPDATE crawl_queue
+                SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+                    worker = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE store = :store AND worker = :worker AND status = 'leased';
+            """), {"store": store, "worker": worker, "max_attempts": self.max_attempts})
+
+    def counts(self) -> dict:
+        """
+        Counts the stores of the queue by status.
+
+        Returns:
+            dict: The number of stores of every status.
+        """
+        with self.engine.begin() as connection:
+            rows = connection.execute(text("SELECT status, count(*) FROM crawl_queue GROUP BY status;")).all()
+        return {status: count for status, count in rows}
+
+    def terminate_connection(self) -> None:
+        """
+        Closes the pooled connections.
+        """
+        self.engine.dispose()
+
+
+class Lease_Heartbeat:
+    """
+    Extends the lease of a store from a background thread while it is crawled.
+
+    Attributes:
+        work_queue (Work_Queue): The queue holding the lease.
+        store (str): The leased store URL.
+        worker (str): The id of the worker holding the lease.
+        lost (bool): Whether the lease expired and was claimed by another worker.
+        lost_event (Event): Set once the lease is lost, stops the crawl of the store.
+    """
+
+    def __init__(self, work_queue: Work_Queue, store: str, worker: str) -> None:
+        """
+        Initializes the Lease_Heartbeat class.
+
+        Args:
+            work_queue (Work_Queue): The queue holding the lease.
+            store (str): The leased store URL.
+            worker (str): The id of the worker holding the lease.
+        """
+        self.work_queue = work_queue
+        self.store = store
+        self.worker = worker
+        self.lost = False
+        self.lost_event = Event()
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__beat, name=f"heartbeat {store}", daemon=True)
+
+    def __enter__(self) -> "Lease_Heartbeat":
+        """Starts the heartbeat thread."""
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Stops the heartbeat thread."""
+        self.__stop.set()
+        self.__thread.join()
+
+    def __beat(self) -> None:
+        """
+        Extends the lease three times per `lease_seconds` until stopped.
+        """
+        while not self.__stop.wait(self.work_queue.lease_seconds / 3):
+            try:
+                if not self.work_queue.heartbeat(self.store, self.worker):
+                    self.lost = True
+                    self.lost_event.set()
+                    print(f"lost the lease of {self.store}, another worker claimed it.")
+                    return
+            except Exception as e:
+                # a missed heartbeat is retried, the lease only expires after lease_seconds
+                print(f"heartbeat of {self.store} failed: {e}")
+
+
+def run_worker(work_queue: Work_Queue, worker: str, crawl_store, poll_interval: float = 5) -> str:
+    """
+    Claims and crawls stores until the queue has no store left to claim or lease.
+
+    a store claimed for the first time is crawled from its first page, a
+    store claimed again resumes from its checkpoint. a store that isn't
+    done is given back to the queue, and marked failed after `max_attempts`
+    claims, while a store whose lease was lost is left to its new worker.
+
+    Args:
+        work_queue (Work_Queue): The queue of the stores.
+        worker (str): The id of this worker.
+        crawl_store: Called with a store URL, whether to resume it, and an Event set once its lease is lost, which
+            stops the crawl, returns the store's scraping summary and whether the store is done.
+        poll_interval (float): Seconds between two claims while other workers still hold leases.
+
+    Returns:
+        str: The scraping summary of the stores crawled by this worker.
+
+    Raises:
+        Exception: The error that stopped the crawl of a store, the store is given back to the queue first.
+    """
+    all_stores_scraping_summary = ""
+    while True:
+        claimed = work_queue.claim(worker)
+        if claimed is None:
+            # leases held by other workers may still expire and become claimable
+            if work_queue.counts().get("leased", 0) == 0:
+                return all_stores_scraping_summary
+            sleep(poll_interval)
+            continue
+        store, attempts = claimed
+        print(f"\nworker {worker} claimed {store} (attempt {attempts})")
+        with Lease_Heartbeat(work_queue, store, worker) as lease:
+            try:
+                summary, done = crawl_store(store, attempts > 1, lease.lost_event)
+            except BaseException:
+                work_queue.release(store, worker)
+                raise
+        all_stores_scraping_summary += summary
+        if lease.lost:
+            # the store belongs to the worker that claimed it since
+            continue
+        if done:
+            work_queue.complete(store, worker)
+        else:
+            # a failed store is claimed again, by any worker, and resumed from its checkpoint
+            work_queue.release(store, worker)